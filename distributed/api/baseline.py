@@ -0,0 +1,178 @@
+"""
+Current-law Calculators shared across reform runs.
+
+`taxcalc.tbi` builds and calculates a current-law and a reform Calculator for
+every year of every run, although the current-law side only depends on the
+start year, the year, the data set and the sample. `calculators` takes the
+place of tbi's function of the same name: the calculated current-law
+Calculator is kept in a per-process cache and only the reform side is built
+for each request. Runs that change baseline assumptions (growdiff_baseline,
+growdiff_response, consumption or growmodel) fall through to tbi's own
+implementation.
+"""
+import copy
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import taxcalc
+from taxcalc import Behavior, Calculator, Consumption
+
+from api.cache import hash_inputs
+from api.resident import data, data_source
+
+
+# A full-sample PUF Calculator takes several hundred MB, so only a few are
+# kept per worker process
+BASELINE_CACHE_SIZE = int(os.environ.get('BASELINE_CACHE_SIZE', 4))
+
+TAXCALC_VERSION = taxcalc._version.get_versions()['version']
+
+_tbi_calculators = None
+
+
+class BaselineCache(object):
+    """
+    Least recently used cache of calculated current-law Calculators
+    """
+
+    def __init__(self, maxsize=BASELINE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._calcs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calcs)
+
+    def __contains__(self, key):
+        return key in self._calcs
+
+    def get(self, key):
+        with self._lock:
+            calc = self._calcs.get(key)
+            if calc is not None:
+                self._calcs.move_to_end(key)
+            return calc
+
+    def put(self, key, calc):
+        with self._lock:
+            self._calcs[key] = calc
+            self._calcs.move_to_end(key)
+            while len(self._calcs) > self.maxsize:
+                self._calcs.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._calcs.clear()
+
+
+baselines = BaselineCache()
+
+
+def shares_baseline(user_mods):
+    """
+    Only the policy and behavior parameters leave current law untouched
+    """
+    return all(not v for k, v in user_mods.items()
+               if k not in ('policy', 'behavior'))
+
+
+def baseline_key(year_n, start_year, use_puf_not_cps, use_full_sample):
+    return hash_inputs(year_n, int(start_year), use_puf_not_cps,
+                       use_full_sample, TAXCALC_VERSION)
+
+
+def advance(calc, year):
+    while calc.current_year < year:
+        calc.increment_year()
+    assert calc.current_year == year
+
+
+def baseline_calculator(year_n, start_year, use_puf_not_cps,
+                        use_full_sample):
+    """
+    Build and calculate the current-law Calculator for `start_year + year_n`
+    """
+    calc = Calculator(policy=data.policy(),
+                      records=data.records(data_source(use_puf_not_cps),
+                                           use_full_sample),
+                      consumption=Consumption())
+    advance(calc, int(start_year) + year_n)
+    calc.calc_all()
+    return calc
+
+
+def reform_calculator(year_n, start_year, use_puf_not_cps, use_full_sample,
+                      user_mods):
+    """
+    Build the reform Calculator for `start_year + year_n`. It is not
+    calculated yet since a behavioral response needs the baseline.
+    """
+    policy = data.policy()
+    policy.implement_reform(user_mods['policy'])
+    behavior = Behavior()
+    behavior.update_behavior(user_mods['behavior'])
+    calc = Calculator(policy=policy,
+                      records=data.records(data_source(use_puf_not_cps),
+                                           use_full_sample),
+                      consumption=Consumption(),
+                      behavior=behavior)
+    advance(calc, int(start_year) + year_n)
+    return calc, behavior.has_any_response()
+
+
+def get_baseline(year_n, start_year, use_puf_not_cps, use_full_sample):
+    """
+    Get the calculated current-law Calculator from the cache or compute it.
+    Callers get their own copy since taxcalc may modify it.
+    """
+    key = baseline_key(year_n, start_year, use_puf_not_cps, use_full_sample)
+    calc = baselines.get(key)
+    if calc is None:
+        print('computing baseline', year_n, start_year, use_puf_not_cps,
+              use_full_sample)
+        calc = baseline_calculator(year_n, start_year, use_puf_not_cps,
+                                   use_full_sample)
+        baselines.put(key, calc)
+    return copy.deepcopy(calc)
+
+
+def calculators(year_n, start_year, use_puf_not_cps, use_full_sample,
+                user_mods):
+    """
+    Drop-in replacement for taxcalc.tbi's `calculators`
+
+    returns: calculated current-law and reform Calculators
+    """
+    if not shares_baseline(user_mods):
+        return _tbi_calculators(year_n, start_year, use_puf_not_cps,
+                                use_full_sample, user_mods)
+    calc1 = get_baseline(year_n, start_year, use_puf_not_cps,
+                         use_full_sample)
+    calc2, has_response = reform_calculator(year_n, start_year,
+                                            use_puf_not_cps,
+                                            use_full_sample, user_mods)
+    if has_response:
+        calc2 = Behavior.response(calc1, calc2)
+    else:
+        calc2.calc_all()
+    return calc1, calc2
+
+
+def install():
+    """
+    Route the tbi model runs through `calculators`
+
+    returns: whether taxcalc.tbi could be patched
+    """
+    global _tbi_calculators
+    tbi = sys.modules[taxcalc.tbi.run_nth_year_taxcalc_model.__module__]
+    if not hasattr(tbi, 'calculators'):
+        print('taxcalc.tbi does not expose calculators; not sharing '
+              'baselines')
+        return False
+    if tbi.calculators is not calculators:
+        _tbi_calculators = tbi.calculators
+        tbi.calculators = calculators
+    return True
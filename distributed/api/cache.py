@@ -0,0 +1,310 @@
+"""
+Content-addressed caching for the distributed API.
+
+Submissions are keyed by a hash of their canonicalized inputs so that a
+reform that has already been submitted maps back to the job that computed
+it, and each year of a TaxBrain run is memoized so that overlapping runs only
+compute the years that are missing. Reform validations are memoized as
+well. The years belonging to each job are
+recorded so that finished years can be served while the rest are still
+running. Keys live in Redis in production;
+`LocalStore` is a drop-in stand-in for tests and single-process development.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import redis
+
+
+# Celery keeps task results for a day by default. Cached job ids must expire
+# no later than the results they point to.
+CACHE_TTL_IN_SECONDS = int(os.environ.get('CACHE_TTL_IN_SECONDS', 86400))
+CACHE_PREFIX = 'policybrain'
+# The formatted tables of single years are only needed while their job runs
+# and are rebuilt from the year when they are missing
+YEAR_OUTPUTS_TTL_IN_SECONDS = int(
+    os.environ.get('YEAR_OUTPUTS_TTL_IN_SECONDS', 3600))
+
+
+def canonicalize(obj):
+    """
+    Convert `obj` into a structure that serializes identically for equal
+    reforms:
+        - dictionary keys become strings: msgpack preserves the integer year
+          keys sent by the webapp while JSON round trips turn them into
+          strings
+        - tuples become lists
+        - non-boolean numbers become floats so that 4333 and 4333.0 match
+
+    returns: canonicalized copy of obj
+    """
+    if isinstance(obj, dict):
+        return {str(k): canonicalize(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [canonicalize(v) for v in obj]
+    elif isinstance(obj, bool) or obj is None:
+        return obj
+    elif isinstance(obj, (int, float)):
+        return float(obj)
+    elif isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    else:
+        return obj
+
+
+def hash_inputs(*parts):
+    """
+    Hash any number of JSON serializable objects after canonicalizing them
+
+    returns: hex digest
+    """
+    text = json.dumps(canonicalize(list(parts)), sort_keys=True,
+                      separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class LocalStore(object):
+    """
+    In-process stand-in for `RedisStore`. Values are not shared between
+    processes, so this should only be used for testing and development.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def exists(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, value, ttl=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisStore(object):
+    """
+    Key-value store shared by the Flask app and the Celery workers
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def exists(self, key):
+        # checked without transferring the value, which may be large
+        return bool(self.client.exists(key))
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+def get_store(url=None):
+    """
+    Create the store specified by the RESULT_CACHE_URL environment variable.
+    Use "local://" for a `LocalStore`; otherwise a Redis URL is expected and
+    the Celery broker is used by default.
+    """
+    if url is None:
+        url = os.environ.get(
+            'RESULT_CACHE_URL',
+            os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379')
+        )
+    if url.startswith('local://'):
+        return LocalStore()
+    return RedisStore(redis.StrictRedis.from_url(url))
+
+
+class ResultCache(object):
+    """
+    Maps canonicalized submissions to the id of the job that computed them
+    and memoizes the result of each year of a TaxBrain run
+    """
+
+    def __init__(self, store, ttl=CACHE_TTL_IN_SECONDS, prefix=CACHE_PREFIX,
+                 outputs_ttl=YEAR_OUTPUTS_TTL_IN_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+        self.outputs_ttl = outputs_ttl
+
+    def job_key(self, endpoint, inputs, versions):
+        """
+        Build the key for a submission to `endpoint` given the list of task
+        inputs and the versions of the upstream packages that will run it
+        """
+        return '{0}:job:{1}'.format(self.prefix,
+                                    hash_inputs(endpoint, inputs, versions))
+
+    def get_job(self, key):
+        job_id = self.store.get(key)
+        if job_id is None:
+            return None
+        return job_id.decode('utf-8')
+
+    def set_job(self, key, job_id):
+        self.store.set(key, str(job_id), ttl=self.ttl)
+
+    def forget_job(self, key):
+        self.store.delete(key)
+
+    def own_job(self, job_id):
+        """
+        Record that `job_id` was submitted to this deployment so that
+        clients talking to several deployments can find it
+        """
+        self.store.set('{0}:owned:{1}'.format(self.prefix, job_id), '1',
+                       ttl=self.ttl)
+
+    def owns_job(self, job_id):
+        return self.store.get(
+            '{0}:owned:{1}'.format(self.prefix, job_id)) is not None
+
+    def forget_result(self, job_id):
+        """
+        Record that the result of `job_id` was deleted after the webapp saved
+        it, so that resubmitting the same inputs starts a new job
+        """
+        self.store.set('{0}:forgotten:{1}'.format(self.prefix, job_id), '1',
+                       ttl=self.ttl)
+
+    def is_forgotten(self, job_id):
+        return self.store.get(
+            '{0}:forgotten:{1}'.format(self.prefix, job_id)) is not None
+
+    def reuse_job(self, job_id):
+        """
+        Record that `job_id` was handed to another submission with the same
+        inputs, which may not have saved the result yet
+        """
+        self.store.set('{0}:reused:{1}'.format(self.prefix, job_id), '1',
+                       ttl=self.ttl)
+
+    def was_reused(self, job_id):
+        return self.store.exists(
+            '{0}:reused:{1}'.format(self.prefix, job_id))
+
+    def year_key(self, year_n, user_mods, start_year, use_puf_not_cps,
+                 use_full_sample, version):
+        """
+        Build the key for the result of a single `dropq_task` year
+        """
+        return '{0}:year:{1}'.format(
+            self.prefix,
+            hash_inputs(year_n, user_mods, start_year, use_puf_not_cps,
+                        use_full_sample, version)
+        )
+
+    def has_year(self, key):
+        return self.store.exists(key)
+
+    def get_year(self, key):
+        raw_data = self.store.get(key)
+        if raw_data is None:
+            return None
+        return json.loads(raw_data.decode('utf-8'))
+
+    def set_year(self, key, raw_data):
+        self.store.set(key, json.dumps(raw_data), ttl=self.ttl)
+
+    def get_year_outputs(self, key):
+        """
+        returns: formatted tables of the year stored under `key`, or None if
+                 they have not been formatted
+        """
+        outputs = self.store.get(key + ':outputs')
+        if outputs is None:
+            return None
+        return json.loads(outputs.decode('utf-8'))
+
+    def set_year_outputs(self, key, outputs):
+        self.store.set(key + ':outputs', json.dumps(outputs),
+                       ttl=self.outputs_ttl)
+
+    def delete_year_outputs(self, key):
+        self.store.delete(key + ':outputs')
+
+    def manifest_key(self, job_id):
+        return '{0}:manifest:{1}'.format(self.prefix, job_id)
+
+    def set_manifest(self, job_id, year_keys):
+        """
+        Record the year keys of a TaxBrain job in submission order so that
+        finished years can be served before the whole job is done
+        """
+        self.store.set(self.manifest_key(job_id), json.dumps(year_keys),
+                       ttl=self.ttl)
+
+    def get_manifest(self, job_id):
+        raw_data = self.store.get(self.manifest_key(job_id))
+        if raw_data is None:
+            return None
+        return json.loads(raw_data.decode('utf-8'))
+
+    def set_header(self, job_id, group_id):
+        """
+        Record the id of the group of tasks that computed the years of a
+        chord job so that their results can be deleted with the job's
+        """
+        self.store.set('{0}:header:{1}'.format(self.prefix, job_id),
+                       str(group_id), ttl=self.ttl)
+
+    def get_header(self, job_id):
+        group_id = self.store.get('{0}:header:{1}'.format(self.prefix,
+                                                         job_id))
+        if group_id is None:
+            return None
+        return group_id.decode('utf-8')
+
+    def completed_years(self, job_id):
+        """
+        returns: indices of the years of `job_id` that have been computed and
+                 the total number of years, or None if the job's years are
+                 not tracked
+        """
+        manifest = self.get_manifest(job_id)
+        if manifest is None:
+            return None
+        completed = [index for index, key in enumerate(manifest)
+                     if self.has_year(key)]
+        return completed, len(manifest)
+
+    def validation_key(self, reform, assumptions, use_puf_not_cps, version):
+        """
+        Build the key for the validation of a reform and assumptions text
+        """
+        return '{0}:validation:{1}'.format(
+            self.prefix,
+            hash_inputs(reform, assumptions, use_puf_not_cps, version)
+        )
+
+    def get_validation(self, key):
+        result = self.store.get(key)
+        if result is None:
+            return None
+        return json.loads(result.decode('utf-8'))
+
+    def set_validation(self, key, result):
+        self.store.set(key, json.dumps(result), ttl=self.ttl)
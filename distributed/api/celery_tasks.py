@@ -1,13 +1,22 @@
 import json
 import os
+import time
 
 from celery import Celery
+from celery.signals import (task_failure, task_success, task_prerun,
+                            task_postrun)
 
 import taxcalc
 import btax
 from btax.front_end_util import runner_json_tables
 
-from collections import defaultdict
+from collections import OrderedDict
+from itertools import chain
+
+from api import baseline
+from api import events
+from api import runtimes
+from api.cache import ResultCache, get_store
 
 
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL',
@@ -15,13 +24,56 @@ CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL',
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND',
                                        'redis://localhost:6379')
 
+# Each kind of job has its own queue so that interactive quick calculations
+# never wait behind full ten year runs. Workers that consume several queues
+# check them in the order in which they are listed, so list "quick" first.
+QUICK_QUEUE = 'quick'
+FULL_QUEUE = 'full'
+ELAST_QUEUE = 'elast'
+CCC_QUEUE = 'ccc'
+QUEUES = [QUICK_QUEUE, FULL_QUEUE, ELAST_QUEUE, CCC_QUEUE]
+
+TASK_QUEUES = {
+    'api.celery_tasks.dropq_task_small_async': QUICK_QUEUE,
+    'api.celery_tasks.dropq_task_async': FULL_QUEUE,
+    'api.celery_tasks.taxbrain_elast_async': ELAST_QUEUE,
+    'api.celery_tasks.taxbrain_elast_postprocess': ELAST_QUEUE,
+    'api.celery_tasks.btax_async': CCC_QUEUE,
+    # validation is interactive: users wait for it on the input page
+    'api.celery_tasks.validate_reform': QUICK_QUEUE,
+}
+
 celery_app = Celery('tasks2', broker=CELERY_BROKER_URL,
                     backend=CELERY_RESULT_BACKEND)
 celery_app.conf.update(
     task_serializer='json',
     accept_content=['msgpack', 'json'],
+    # results are stored as objects instead of JSON text so that large
+    # tables are not encoded twice
+    result_serializer='msgpack',
+    # taxbrain_postprocess is routed along with the years it merges
+    task_routes={name: {'queue': queue}
+                 for name, queue in TASK_QUEUES.items()},
+    broker_transport_options={'queue_order_strategy': 'priority'},
 )
 
+TAXCALC_VERSION = taxcalc._version.get_versions()['version']
+BTAX_VERSION = btax._version.get_versions()['version']
+
+result_cache = ResultCache(get_store())
+job_events = events.get_job_events()
+task_runtimes = runtimes.get_task_runtimes()
+
+# Compute current law once per year and data set instead of once per run
+baseline.install()
+
+
+def dropq_year_key(year_n, user_mods, start_year, use_puf_not_cps=True,
+                   use_full_sample=True):
+    return result_cache.year_key(year_n, user_mods, int(start_year),
+                                 use_puf_not_cps, use_full_sample,
+                                 TAXCALC_VERSION)
+
 
 def dropq_task(year_n, user_mods, start_year, use_puf_not_cps=True,
                use_full_sample=True):
@@ -36,6 +88,14 @@ def dropq_task(year_n, user_mods, start_year, use_puf_not_cps=True,
         )
     )
 
+    key = dropq_year_key(year_n, user_mods, start_year,
+                         use_puf_not_cps=use_puf_not_cps,
+                         use_full_sample=use_full_sample)
+    raw_data = result_cache.get_year(key)
+    if raw_data is not None:
+        print('using cached year', year_n, key)
+        return raw_data
+
     raw_data = taxcalc.tbi.run_nth_year_taxcalc_model(
         year_n=year_n,
         start_year=int(start_year),
@@ -43,22 +103,109 @@ def dropq_task(year_n, user_mods, start_year, use_puf_not_cps=True,
         use_full_sample=use_full_sample,
         user_mods=user_mods
     )
+    result_cache.set_year(key, raw_data)
+    # format the tables of the year here, where the years run in parallel,
+    # instead of in the postprocessing step that waits for all of them
+    result_cache.set_year_outputs(key, year_outputs(raw_data))
 
     return raw_data
 
 
-def postprocess(ans, postprocess_func):
-    all_to_process = defaultdict(list)
-    for year_data in ans:
-        for key, value in year_data.items():
-            all_to_process[key] += value
-    results = postprocess_func(all_to_process)
+def stitch_years(ans, cached_years):
+    """
+    Insert memoized year results between the freshly computed ones in the
+    order that the years were submitted
+
+    ans: list of results returned by the chord
+    cached_years: list of [index, year_key] pairs for the years that were
+        not dispatched
+
+    returns: list of results for all years
+    """
+    ans = list(ans)
+    for index, key in sorted(cached_years):
+        raw_data = result_cache.get_year(key)
+        if raw_data is None:
+            raise KeyError('Cached year {} expired before postprocessing'
+                           .format(key))
+        ans.insert(index, raw_data)
+    return ans
+
+
+def merge_years(ans):
+    """
+    returns: table id -> rows of the table for every year in `ans`, in the
+             order of the years
+    """
+    keys = OrderedDict.fromkeys(chain.from_iterable(ans))
+    return {key: list(chain.from_iterable(year_data.get(key, [])
+                                          for year_data in ans))
+            for key in keys}
+
+
+def postprocess(ans, postprocess_func, cached_years=None):
+    if cached_years:
+        ans = stitch_years(ans, cached_years)
+    results = postprocess_func(merge_years(ans))
     # Add taxcalc version to results
-    vinfo = taxcalc._version.get_versions()
-    results['taxcalc_version'] = vinfo['version']
+    results['taxcalc_version'] = TAXCALC_VERSION
     # TODO: Make this the distributed app version, not the TC version
-    results['dropq_version'] = vinfo['version']
-    return json.dumps(results)
+    results['dropq_version'] = TAXCALC_VERSION
+    return results
+
+
+def year_outputs(raw_data):
+    """
+    Postprocess the result of a single year so that it can be shown before
+    the rest of the run is done. The aggregate tables need every year and
+    are left out.
+
+    returns: list of outputs for the year
+    """
+    results = postprocess([raw_data], taxcalc.tbi.postprocess)
+    return results['outputs']
+
+
+def cached_year_outputs(key, raw_data):
+    """
+    returns: outputs of the year stored under `key`, formatting them if the
+             year task did not
+    """
+    outputs = result_cache.get_year_outputs(key)
+    if outputs is None:
+        outputs = year_outputs(raw_data)
+        result_cache.set_year_outputs(key, outputs)
+    return outputs
+
+
+def interleave_years(outputs_by_year):
+    """
+    Put the outputs formatted one year at a time in the order of a
+    postprocess of all of the years: by table, then by year
+    """
+    return [outputs[index] for index in range(len(outputs_by_year[0]))
+            for outputs in outputs_by_year]
+
+
+def postprocess_by_year(ans, year_keys):
+    """
+    Postprocess a TaxBrain run whose years were formatted by their own tasks.
+    Only the aggregate tables, which need every year, are built here. The
+    formatted years are dropped once they are part of the results.
+
+    returns: same results as `postprocess(ans, taxcalc.tbi.postprocess)`
+    """
+    outputs_by_year = [cached_year_outputs(key, raw_data)
+                       for key, raw_data in zip(year_keys, ans)]
+    aggr = merge_years([{key: rows for key, rows in year_data.items()
+                         if key.startswith('aggr')} for year_data in ans])
+    results = taxcalc.tbi.postprocess(aggr)
+    results['outputs'] = interleave_years(outputs_by_year)
+    results['taxcalc_version'] = TAXCALC_VERSION
+    results['dropq_version'] = TAXCALC_VERSION
+    for key in year_keys:
+        result_cache.delete_year_outputs(key)
+    return results
 
 
 @celery_app.task(name='api.celery_tasks.dropq_task_async')
@@ -75,8 +222,13 @@ def dropq_task_small_async(year_n, user_mods, start_year,
 
 
 @celery_app.task(name='api.celery_tasks.taxbrain_postprocess')
-def taxbrain_postprocess(ans):
-    return postprocess(ans, taxcalc.tbi.postprocess)
+def taxbrain_postprocess(ans, cached_years=None, year_keys=None):
+    if cached_years:
+        ans = stitch_years(ans, cached_years)
+    # jobs submitted before the years were formatted by their own tasks
+    if year_keys is None:
+        return postprocess(ans, taxcalc.tbi.postprocess)
+    return postprocess_by_year(ans, year_keys)
 
 
 @celery_app.task(name='api.celery_tasks.taxbrain_elast_async')
@@ -122,10 +274,100 @@ def btax_async(user_mods, start_year):
             results["dataframes"] = dataframes
     else:
         results.update(tables)
-    vinfo = taxcalc._version.get_versions()
-    results['taxcalc_version'] = vinfo['version']
-    results['dropq_version'] = vinfo['version']
-    binfo = btax._version.get_versions()
-    results['btax_version'] = binfo['version']
-    json_res = json.dumps(results)
-    return json_res
+    results['taxcalc_version'] = TAXCALC_VERSION
+    results['dropq_version'] = TAXCALC_VERSION
+    results['btax_version'] = BTAX_VERSION
+    return results
+
+
+def validation_key(reform, assumptions, use_puf_not_cps=True):
+    return result_cache.validation_key(reform, assumptions, use_puf_not_cps,
+                                       TAXCALC_VERSION)
+
+
+def validate(reform, assumptions, use_puf_not_cps=True):
+    """
+    Read a reform and assumptions JSON text and check the parameter values
+
+    returns: dictionary with the parameter dictionary that
+             `taxcalc.Calculator.read_json_param_objects` returns under
+             'policy_dict' and the messages of
+             `taxcalc.tbi.reform_warnings_errors` under 'errors_warnings'
+    """
+    key = validation_key(reform, assumptions,
+                         use_puf_not_cps=use_puf_not_cps)
+    result = result_cache.get_validation(key)
+    if result is not None:
+        print('using cached validation', key)
+        return result
+    policy_dict = taxcalc.Calculator.read_json_param_objects(reform,
+                                                             assumptions)
+    errors_warnings = taxcalc.tbi.reform_warnings_errors(policy_dict,
+                                                         use_puf_not_cps)
+    result = {'policy_dict': policy_dict,
+              'errors_warnings': errors_warnings,
+              'taxcalc_version': TAXCALC_VERSION}
+    # store what the webapp will see: JSON turns the year keys into strings
+    result = json.loads(json.dumps(result))
+    result_cache.set_validation(key, result)
+    return result
+
+
+@celery_app.task(name='api.celery_tasks.validate_reform')
+def validate_reform(reform, assumptions, use_puf_not_cps=True):
+    return validate(reform, assumptions, use_puf_not_cps=use_puf_not_cps)
+
+
+# Tasks whose id is the job id handed to the webapp
+JOB_TASKS = {taxbrain_postprocess.name, taxbrain_elast_postprocess.name,
+             btax_async.name, validate_reform.name}
+
+
+def job_id_of(task):
+    """
+    The year tasks of a chord report to the job of the chord's callback
+    """
+    callback = task.request.chord
+    if callback:
+        return callback.get('options', {}).get('task_id')
+    return task.request.id
+
+
+@task_success.connect
+def publish_success(sender=None, **kwargs):
+    if sender.name in JOB_TASKS:
+        job_events.publish(sender.request.id, events.YES)
+
+
+@task_failure.connect
+def publish_failure(sender=None, **kwargs):
+    job_id = job_id_of(sender)
+    if job_id is not None:
+        job_events.publish(job_id, events.FAIL)
+
+
+def queue_of(task):
+    delivery_info = task.request.delivery_info or {}
+    return (delivery_info.get('routing_key') or
+            TASK_QUEUES.get(task.name, 'celery'))
+
+
+# start time of the tasks running in this worker process
+_started = {}
+
+
+@task_prerun.connect
+def record_start(sender=None, task_id=None, **kwargs):
+    _started[task_id] = time.time()
+    task_runtimes.started(queue_of(sender), task_id)
+
+
+@task_postrun.connect
+def record_runtime(sender=None, task_id=None, state=None, **kwargs):
+    start = _started.pop(task_id, None)
+    # failed tasks say nothing about how long a task takes
+    kind = None
+    if start is not None and state == 'SUCCESS':
+        kind = runtimes.task_kind(sender.name, kwargs.get('kwargs') or {})
+    seconds = time.time() - start if start is not None else None
+    task_runtimes.finished(queue_of(sender), task_id, kind, seconds)
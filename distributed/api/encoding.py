@@ -0,0 +1,44 @@
+"""
+Binary encoding of job results for the webapp.
+
+Results are msgpack encoded instead of JSON text when the webapp asks for
+them with an `Accept: application/msgpack` header. Celery stores the results
+with its msgpack result serializer, so they only hold types that msgpack
+supports and read the same in either encoding.
+"""
+import json
+
+import msgpack
+
+
+MSGPACK_TYPE = 'application/msgpack'
+
+
+def pack(results):
+    """
+    results: result of a job
+
+    returns: msgpack encoded bytes
+    """
+    return msgpack.dumps(results, use_bin_type=True)
+
+
+def unpack(packed):
+    """
+    packed: bytes returned by `pack`
+
+    returns: the results
+    """
+    return msgpack.loads(packed, raw=False, use_list=True)
+
+
+def stored_result(result):
+    """
+    Results of jobs that finished before results were stored as objects are
+    JSON text
+
+    returns: the result as an object
+    """
+    if isinstance(result, (bytes, str)):
+        return json.loads(result)
+    return result
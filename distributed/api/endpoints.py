@@ -1,5 +1,5 @@
 from flask import Blueprint, request, make_response
-from celery.result import AsyncResult
+from celery.result import AsyncResult, GroupResult
 from celery import chord
 
 import redis
@@ -7,31 +7,133 @@ import json
 import msgpack
 import os
 
+from collections import OrderedDict
+from functools import partial
+
+from api.encoding import MSGPACK_TYPE, pack, stored_result
+
 from api.celery_tasks import (taxbrain_postprocess,
                               taxbrain_elast_postprocess,
                               dropq_task_async,
                               dropq_task_small_async,
                               taxbrain_elast_async,
-                              btax_async)
+                              btax_async,
+                              validate_reform,
+                              validation_key,
+                              dropq_year_key,
+                              cached_year_outputs,
+                              result_cache,
+                              job_events,
+                              task_runtimes,
+                              QUEUES,
+                              TASK_QUEUES,
+                              TAXCALC_VERSION,
+                              BTAX_VERSION)
 
 bp = Blueprint('endpoints', __name__)
 
-queue_name = "celery"
+# Largest number of jobs that a bulk request may ask about
+MAX_BULK_JOBS = int(os.environ.get('MAX_BULK_JOBS', 20))
+# Results are added to a bulk response until it holds this many bytes. The
+# remaining finished jobs are reported as pending and fetched by the next
+# request.
+MAX_BULK_RESULT_BYTES = int(os.environ.get('MAX_BULK_RESULT_BYTES',
+                                           64 * 1024 * 1024))
+
 client = redis.StrictRedis.from_url(os.environ.get("CELERY_BROKER_URL",
                                                    "redis://redis:6379/0"))
 
 
-def aggr_endpoint(compute_task, postprocess_task):
+def queue_length(queue):
+    """
+    Number of messages waiting in `queue` plus the job being submitted
+    """
+    return client.llen(queue) + 1
+
+
+def cached_job(inputs):
+    """
+    Look up a job that was submitted to this endpoint with the same inputs
+    and upstream package versions. Failed jobs and jobs whose results were
+    deleted are forgotten so that they can be resubmitted.
+
+    returns: cache key, job id or None if there is no usable job
+    """
+    key = result_cache.job_key(request.path, inputs,
+                               [TAXCALC_VERSION, BTAX_VERSION])
+    job_id = result_cache.get_job(key)
+    if job_id is None:
+        return key, None
+    # recorded before checking whether the result was deleted, so that
+    # /dropq_forget_results either sees the reuse or is seen here
+    result_cache.reuse_job(job_id)
+    if AsyncResult(job_id).failed() or result_cache.is_forgotten(job_id):
+        result_cache.forget_job(key)
+        job_id = None
+    return key, job_id
+
+
+def split_cached_years(inputs, year_keys):
+    """
+    Separate the years that have already been computed from the ones that
+    still need to be dispatched
+
+    inputs: list of inputs for each year
+    year_keys: list of the year cache keys matching `inputs`
+
+    returns: list of [index, year_key] pairs for the cached years, list of
+             inputs for the missing years
+    """
+    cached_years = []
+    missing = []
+    for index, (year_inputs, key) in enumerate(zip(inputs, year_keys)):
+        if result_cache.has_year(key):
+            cached_years.append([index, key])
+        else:
+            missing.append(year_inputs)
+    return cached_years, missing
+
+
+def aggr_endpoint(compute_task, postprocess_task, year_key=None):
     print('aggregating endpoint')
     data = request.get_data()
     inputs = msgpack.loads(data, encoding='utf8',
                            use_list=True)
     print('inputs', inputs)
-    result = (chord(compute_task.signature(kwargs=i, serializer='msgpack')
-              for i in inputs))(postprocess_task.signature(
-                serializer='msgpack'))
-    length = client.llen(queue_name) + 1
-    data = {'job_id': str(result), 'qlength': length}
+    queue = TASK_QUEUES[compute_task.name]
+    key, job_id = cached_job(inputs)
+    if job_id is None:
+        if year_key is not None:
+            year_keys = [year_key(**i) for i in inputs]
+            cached_years, missing = split_cached_years(inputs, year_keys)
+            print('cached years', [index for index, _ in cached_years])
+            callback = postprocess_task.signature(
+                kwargs={'cached_years': cached_years,
+                        'year_keys': year_keys},
+                serializer='msgpack', queue=queue)
+        else:
+            missing = inputs
+            callback = postprocess_task.signature(serializer='msgpack',
+                                                  queue=queue)
+        if missing:
+            result = (chord(compute_task.signature(kwargs=i,
+                                                   serializer='msgpack')
+                      for i in missing))(callback)
+        else:
+            # every year is cached; only the postprocessing step is left
+            result = callback.apply_async(args=([],))
+        job_id = str(result)
+        if missing:
+            # the results of the year tasks are deleted along with the job's
+            result.parent.save()
+            result_cache.set_header(job_id, result.parent.id)
+        result_cache.set_job(key, job_id)
+        result_cache.own_job(job_id)
+        if year_key is not None:
+            result_cache.set_manifest(job_id, year_keys)
+    else:
+        print('reusing job', job_id)
+    data = {'job_id': job_id, 'qlength': queue_length(queue)}
     return json.dumps(data)
 
 
@@ -41,21 +143,31 @@ def endpoint(task):
     inputs = msgpack.loads(data, encoding='utf8',
                            use_list=True)
     print('inputs', inputs)
-    result = task.apply_async(kwargs=inputs[0],
-                              serializer='msgpack')
-    length = client.llen(queue_name) + 1
-    data = {'job_id': str(result), 'qlength': length}
+    key, job_id = cached_job(inputs)
+    if job_id is None:
+        result = task.apply_async(kwargs=inputs[0],
+                                  serializer='msgpack')
+        job_id = str(result)
+        result_cache.set_job(key, job_id)
+        result_cache.own_job(job_id)
+    else:
+        print('reusing job', job_id)
+    data = {'job_id': job_id, 'qlength': queue_length(TASK_QUEUES[task.name])}
     return json.dumps(data)
 
 
 @bp.route("/dropq_start_job", methods=['POST'])
 def dropq_endpoint_full():
-    return aggr_endpoint(dropq_task_async, taxbrain_postprocess)
+    return aggr_endpoint(dropq_task_async, taxbrain_postprocess,
+                         year_key=partial(dropq_year_key,
+                                          use_full_sample=True))
 
 
 @bp.route("/dropq_small_start_job", methods=['POST'])
 def dropq_endpoint_small():
-    return aggr_endpoint(dropq_task_small_async, taxbrain_postprocess)
+    return aggr_endpoint(dropq_task_small_async, taxbrain_postprocess,
+                         year_key=partial(dropq_year_key,
+                                          use_full_sample=False))
 
 
 @bp.route("/btax_start_job", methods=['POST'])
@@ -63,17 +175,73 @@ def btax_endpoint():
     return endpoint(btax_async)
 
 
+@bp.route("/validate_reform", methods=['POST'])
+def validate_reform_endpoint():
+    """
+    Start validating a reform. Reforms that have been validated before are
+    answered right away with the validation result instead of a job, and
+    reforms whose validation failed with the error that Tax-Calculator
+    raised, so that the webapp can show it without validating again.
+    """
+    inputs = msgpack.loads(request.get_data(), encoding='utf8',
+                           use_list=True)
+    result = result_cache.get_validation(validation_key(**inputs[0]))
+    if result is not None:
+        print('reusing validation')
+        return json.dumps({'job_id': None, 'qlength': 0, 'result': result})
+    job_id = result_cache.get_job(
+        result_cache.job_key(request.path, inputs,
+                             [TAXCALC_VERSION, BTAX_VERSION]))
+    if job_id is not None and AsyncResult(job_id).failed():
+        print('reporting failed validation', job_id)
+        return json.dumps({'job_id': job_id, 'qlength': 0,
+                           'error': str(AsyncResult(job_id).result)})
+    return endpoint(validate_reform)
+
+
 @bp.route("/elastic_gdp_start_job", methods=['POST'])
 def elastic_endpoint():
     return aggr_endpoint(taxbrain_elast_async, taxbrain_elast_postprocess)
 
 
+@bp.route("/queue_lengths", methods=['GET'])
+def queue_lengths():
+    return json.dumps({queue: client.llen(queue) for queue in QUEUES})
+
+
+@bp.route("/task_runtimes", methods=['GET'])
+def runtimes():
+    """
+    Measured task durations and current load of each queue, from which the
+    webapp estimates when a job will be done
+    """
+    return json.dumps(task_runtimes.summary(
+        {queue: client.llen(queue) for queue in QUEUES}))
+
+
+def wants_msgpack():
+    return request.accept_mimetypes.best_match(
+        ['application/json', MSGPACK_TYPE]) == MSGPACK_TYPE
+
+
+def encoded_response(data):
+    """
+    returns: `data` msgpack encoded if the client accepts it, otherwise as
+             JSON
+    """
+    if wants_msgpack():
+        resp = make_response(pack(data))
+        resp.headers['Content-Type'] = MSGPACK_TYPE
+        return resp
+    return json.dumps(data)
+
+
 @bp.route("/dropq_get_result", methods=['GET'])
 def dropq_results():
     job_id = request.args.get('job_id', '')
     async_result = AsyncResult(job_id)
     if async_result.ready() and async_result.successful():
-        return async_result.result
+        return encoded_response(stored_result(async_result.result))
     elif async_result.failed():
         print('traceback', async_result.traceback)
         return async_result.traceback
@@ -82,9 +250,12 @@ def dropq_results():
         return resp
 
 
-@bp.route("/dropq_query_result", methods=['GET'])
-def query_results():
-    job_id = request.args.get('job_id', '')
+def job_status(job_id):
+    # the workers store the final state of a job when they announce it,
+    # which saves loading the whole result from the backend
+    state = job_events.state(job_id)
+    if state is not None:
+        return state
     async_result = AsyncResult(job_id)
     print('async_result', async_result.state)
     if async_result.ready() and async_result.successful():
@@ -93,3 +264,156 @@ def query_results():
         return 'FAIL'
     else:
         return 'NO'
+
+
+@bp.route("/dropq_query_result", methods=['GET'])
+def query_results():
+    job_id = request.args.get('job_id', '')
+    return job_status(job_id)
+
+
+def bulk_job_ids():
+    """
+    returns: unique job ids passed as repeated job_id arguments in order, or
+             None if there are too many
+    """
+    job_ids = list(OrderedDict.fromkeys(request.args.getlist('job_id')))
+    if len(job_ids) > MAX_BULK_JOBS:
+        return None
+    return job_ids
+
+
+@bp.route("/dropq_query_results", methods=['GET'])
+def bulk_query_results():
+    """
+    Bulk version of /dropq_query_result: status of each job in one response
+    """
+    job_ids = bulk_job_ids()
+    if job_ids is None:
+        return make_response(
+            'at most {} jobs per request'.format(MAX_BULK_JOBS), 400)
+    return json.dumps({job_id: job_status(job_id) for job_id in job_ids})
+
+
+@bp.route("/dropq_get_results", methods=['GET'])
+def bulk_results():
+    """
+    Bulk version of /dropq_get_result. Answers with the results of the
+    finished jobs, the tracebacks of the failed ones and the ids of the jobs
+    that are still running.
+    """
+    job_ids = bulk_job_ids()
+    if job_ids is None:
+        return make_response(
+            'at most {} jobs per request'.format(MAX_BULK_JOBS), 400)
+    msgpack_response = wants_msgpack()
+    encode = pack if msgpack_response else json.dumps
+    # results are encoded one at a time so that only their encoded bytes
+    # are held until the response is sent
+    results, failed, pending = [], {}, []
+    size = 0
+    for job_id in job_ids:
+        async_result = AsyncResult(job_id)
+        if async_result.failed():
+            failed[job_id] = async_result.traceback
+        elif (not async_result.successful() or
+              size >= MAX_BULK_RESULT_BYTES):
+            pending.append(job_id)
+        else:
+            encoded = encode(stored_result(async_result.result))
+            size += len(encoded)
+            results.append((job_id, encoded))
+    if msgpack_response:
+        packer = msgpack.Packer(use_bin_type=True)
+        body = [packer.pack_map_header(3), packer.pack('results'),
+                packer.pack_map_header(len(results))]
+        for job_id, encoded in results:
+            body += [packer.pack(job_id), encoded]
+        body += [packer.pack('failed'), pack(failed),
+                 packer.pack('pending'), pack(pending)]
+        resp = make_response(b''.join(body))
+        resp.headers['Content-Type'] = MSGPACK_TYPE
+        return resp
+    return '{{"results": {{{0}}}, "failed": {1}, "pending": {2}}}'.format(
+        ', '.join('{0}: {1}'.format(json.dumps(job_id), encoded)
+                  for job_id, encoded in results),
+        json.dumps(failed), json.dumps(pending))
+
+
+@bp.route("/dropq_forget_results", methods=['POST'])
+def bulk_forget_results():
+    """
+    Delete the results of finished jobs from the result backend once the
+    webapp has saved them. Jobs that were handed to more than one submission
+    are only marked forgotten and their results are left to expire, since
+    the later submissions may not have saved them yet.
+    """
+    job_ids = bulk_job_ids()
+    if job_ids is None:
+        return make_response(
+            'at most {} jobs per request'.format(MAX_BULK_JOBS), 400)
+    forgotten = []
+    for job_id in job_ids:
+        async_result = AsyncResult(job_id)
+        if not async_result.ready():
+            continue
+        # new submissions start a new job from here on
+        result_cache.forget_result(job_id)
+        if result_cache.was_reused(job_id):
+            print('keeping the result of reused job', job_id)
+            continue
+        async_result.forget()
+        group_id = result_cache.get_header(job_id)
+        if group_id is not None:
+            header = GroupResult.restore(group_id)
+            if header is not None:
+                header.forget()
+                header.delete()
+        job_events.clear(job_id)
+        forgotten.append(job_id)
+    return json.dumps({'forgotten': forgotten})
+
+
+@bp.route("/dropq_owns_job", methods=['GET'])
+def owns_job():
+    job_id = request.args.get('job_id', '')
+    return 'YES' if result_cache.owns_job(job_id) else 'NO'
+
+
+@bp.route("/dropq_query_years", methods=['GET'])
+def query_years():
+    job_id = request.args.get('job_id', '')
+    years = result_cache.completed_years(job_id)
+    if years is None:
+        return make_response('job years are not tracked', 404)
+    completed, total = years
+    return json.dumps({'completed': completed, 'total': total})
+
+
+@bp.route("/dropq_job_progress", methods=['GET'])
+def job_progress():
+    """
+    Status of a job along with the indices of its finished years in one
+    response, so that waiting pages only ask for the years that are new
+    """
+    job_id = request.args.get('job_id', '')
+    years = result_cache.completed_years(job_id)
+    return json.dumps({'status': job_status(job_id),
+                       'years': None if years is None else years[0]})
+
+
+@bp.route("/dropq_get_year_result", methods=['GET'])
+def year_results():
+    job_id = request.args.get('job_id', '')
+    try:
+        index = int(request.args.get('index', ''))
+    except ValueError:
+        return make_response('index must be an integer', 400)
+    manifest = result_cache.get_manifest(job_id)
+    if manifest is None or not 0 <= index < len(manifest):
+        return make_response('year not found', 404)
+    raw_data = result_cache.get_year(manifest[index])
+    if raw_data is None:
+        return make_response('not ready', 202)
+    outputs = cached_year_outputs(manifest[index], raw_data)
+    return json.dumps({'index': index, 'outputs': outputs})
@@ -0,0 +1,54 @@
+"""
+Final states of jobs recorded by the Celery workers.
+
+When the last task of a job succeeds or fails, the workers store the job's
+final state in Redis. Status queries read it instead of loading the whole
+result from the result backend.
+"""
+import os
+
+import redis
+
+from api.cache import CACHE_PREFIX, CACHE_TTL_IN_SECONDS
+
+
+YES = 'YES'
+FAIL = 'FAIL'
+
+
+class JobEvents(object):
+
+    def __init__(self, client, ttl=CACHE_TTL_IN_SECONDS, prefix=CACHE_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def state_key(self, job_id):
+        return '{0}:state:{1}'.format(self.prefix, job_id)
+
+    def publish(self, job_id, event):
+        """
+        Store the final state `event` of `job_id`
+        """
+        self.client.set(self.state_key(job_id), event, ex=self.ttl)
+
+    def clear(self, job_id):
+        """
+        Drop the stored final state of a job whose result was deleted
+        """
+        self.client.delete(self.state_key(job_id))
+
+    def state(self, job_id):
+        state = self.client.get(self.state_key(job_id))
+        if state is None:
+            return None
+        return state.decode('utf-8')
+
+
+def get_job_events(url=None):
+    if url is None:
+        url = os.environ.get(
+            'EVENTS_URL',
+            os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379')
+        )
+    return JobEvents(redis.StrictRedis.from_url(url))
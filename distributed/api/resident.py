@@ -0,0 +1,139 @@
+"""
+Input data kept resident in the Celery worker processes.
+
+`taxcalc.tbi` reads the input data, weights, growth factors and current-law
+policy from disk for every year of every run. `ResidentData` reads them once
+per worker. The data sets named by PRELOAD_TAXCALC_DATA are loaded in the
+`worker_init` hook, before the pool forks, so that the children share those
+pages copy-on-write. Anything a Calculator mutates is handed out as a copy.
+"""
+import copy
+import gc
+import os
+import threading
+
+import pandas as pd
+from celery.signals import worker_init
+
+from taxcalc import GrowFactors, Policy, Records
+
+
+# Comma separated list of data sets to load at boot: "puf", "cps" or both
+PRELOAD_TAXCALC_DATA = os.environ.get('PRELOAD_TAXCALC_DATA', 'puf,cps')
+
+PUF_PATH = 'puf.csv.gz'
+CPS_PATH = os.path.join(Records.CUR_PATH, 'cps.csv.gz')
+WEIGHTS_PATHS = {
+    'puf': os.path.join(Records.CUR_PATH, Records.PUF_WEIGHTS_FILENAME),
+    'cps': os.path.join(Records.CUR_PATH, Records.CPS_WEIGHTS_FILENAME),
+}
+
+# Same samples as the quick calculation in taxcalc.tbi
+SAMPLING = {
+    'puf': {'frac': 0.05, 'random_state': 180},
+    'cps': {'frac': 0.03, 'random_state': 180},
+}
+
+
+def data_source(use_puf_not_cps):
+    return 'puf' if use_puf_not_cps else 'cps'
+
+
+class ResidentData(object):
+    """
+    Lazily loaded, read-only input data shared by all tasks run by a worker
+    process
+    """
+
+    def __init__(self):
+        self._frames = {}
+        self._weights = {}
+        self._growfactors = None
+        self._policy = None
+        self._lock = threading.RLock()
+
+    def load(self, sources=('puf', 'cps')):
+        """
+        Read the data for `sources` along with the growth factors and
+        current-law policy. Data sets that are not available are skipped.
+        """
+        with self._lock:
+            for source in sources:
+                try:
+                    self.frame(source)
+                    self.weights(source)
+                except (IOError, OSError) as e:
+                    print('not preloading', source, e)
+            self.growfactors()
+            self.policy()
+
+    def frame(self, source):
+        with self._lock:
+            if source not in self._frames:
+                path = PUF_PATH if source == 'puf' else CPS_PATH
+                print('loading', source, 'data from', path)
+                self._frames[source] = pd.read_csv(path)
+            return self._frames[source]
+
+    def weights(self, source):
+        with self._lock:
+            if source not in self._weights:
+                self._weights[source] = pd.read_csv(WEIGHTS_PATHS[source])
+            return self._weights[source]
+
+    def sample(self, source, use_full_sample):
+        """
+        Get the full data set or the quick calculation sample as a new
+        DataFrame that the caller may modify
+        """
+        full_sample = self.frame(source)
+        if use_full_sample:
+            return full_sample.copy()
+        return full_sample.sample(**SAMPLING[source])
+
+    def growfactors(self):
+        """
+        Growth factors are only read by Records and Policy, so all tasks
+        share the same instance
+        """
+        with self._lock:
+            if self._growfactors is None:
+                self._growfactors = GrowFactors()
+            return self._growfactors
+
+    def policy(self):
+        """
+        Current-law Policy. Copied since reforms are implemented in place.
+        """
+        with self._lock:
+            if self._policy is None:
+                self._policy = Policy(gfactors=self.growfactors())
+            return copy.deepcopy(self._policy)
+
+    def records(self, source, use_full_sample):
+        """
+        Build Records the same way as the PUF and CPS constructors but from
+        the resident data and weights
+        """
+        sample = self.sample(source, use_full_sample)
+        weights = self.weights(source)
+        if source == 'puf':
+            return Records(data=sample, gfactors=self.growfactors(),
+                           weights=weights)
+        else:
+            return Records(data=sample, gfactors=self.growfactors(),
+                           weights=weights, adjust_ratios=None,
+                           start_year=Records.CPSCSV_YEAR)
+
+
+data = ResidentData()
+
+
+@worker_init.connect
+def preload(**kwargs):
+    sources = [s.strip() for s in PRELOAD_TAXCALC_DATA.split(',') if s.strip()]
+    data.load(sources)
+    # Keep the garbage collector from touching, and thereby copying, the
+    # preloaded objects in the forked children
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
@@ -0,0 +1,130 @@
+"""
+Measured task run times and worker load, used to estimate when a job will
+be done.
+
+The workers record how long each task took per kind of task, i.e. per task
+name and data source, keeping the most recent RUNTIME_WINDOW durations.
+Running tasks are kept per queue along with the largest number of tasks that
+ran at once recently, which is the number of worker processes serving the
+queue.
+"""
+import os
+import time
+
+import redis
+
+from api.cache import CACHE_PREFIX
+
+
+# Number of recent durations that the estimate is based on
+RUNTIME_WINDOW = int(os.environ.get('RUNTIME_WINDOW', 50))
+# Tasks still marked as running after this long belong to workers that died
+MAX_TASK_IN_SECONDS = float(os.environ.get('MAX_TASK_IN_SECONDS', 3600))
+# How long the number of worker processes of a queue is remembered
+CAPACITY_TTL_IN_SECONDS = int(os.environ.get('CAPACITY_TTL_IN_SECONDS',
+                                             3600))
+
+
+def task_kind(task_name, kwargs):
+    """
+    Tax-Calculator runs take much longer on the PUF than on the CPS, so the
+    data source is part of the kind of task. The sample size is implied by
+    the task.
+    """
+    if 'use_puf_not_cps' not in kwargs:
+        return task_name
+    source = 'puf' if kwargs['use_puf_not_cps'] else 'cps'
+    return '{0}:{1}'.format(task_name, source)
+
+
+class TaskRuntimes(object):
+
+    def __init__(self, client, window=RUNTIME_WINDOW, prefix=CACHE_PREFIX):
+        self.client = client
+        self.window = window
+        self.prefix = prefix
+
+    def durations_key(self, kind):
+        return '{0}:runtimes:{1}'.format(self.prefix, kind)
+
+    def kinds_key(self):
+        return '{0}:runtimes'.format(self.prefix)
+
+    def running_key(self, queue):
+        return '{0}:running:{1}'.format(self.prefix, queue)
+
+    def capacity_key(self, queue):
+        return '{0}:capacity:{1}'.format(self.prefix, queue)
+
+    def started(self, queue, task_id):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(self.running_key(queue), {task_id: now})
+        pipe.zremrangebyscore(self.running_key(queue), '-inf',
+                              now - MAX_TASK_IN_SECONDS)
+        pipe.zcard(self.running_key(queue))
+        pipe.get(self.capacity_key(queue))
+        _, _, running, capacity = pipe.execute()
+        if capacity is None or running >= int(capacity):
+            self.client.set(self.capacity_key(queue), running,
+                            ex=CAPACITY_TTL_IN_SECONDS)
+        else:
+            self.client.expire(self.capacity_key(queue),
+                               CAPACITY_TTL_IN_SECONDS)
+
+    def finished(self, queue, task_id, kind, seconds):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.running_key(queue), task_id)
+        if kind is not None:
+            pipe.lpush(self.durations_key(kind), seconds)
+            pipe.ltrim(self.durations_key(kind), 0, self.window - 1)
+            pipe.sadd(self.kinds_key(), kind)
+        pipe.execute()
+
+    def durations(self, kind):
+        return [float(seconds) for seconds in
+                self.client.lrange(self.durations_key(kind), 0, -1)]
+
+    def estimate(self, kind):
+        """
+        returns: mean of the recent durations of `kind` and the number of
+                 durations that it is based on
+        """
+        durations = self.durations(kind)
+        if not durations:
+            return {'mean_seconds': None, 'samples': 0}
+        return {'mean_seconds': sum(durations) / len(durations),
+                'samples': len(durations)}
+
+    def running(self, queue):
+        return self.client.zcount(self.running_key(queue),
+                                  time.time() - MAX_TASK_IN_SECONDS, '+inf')
+
+    def capacity(self, queue):
+        capacity = self.client.get(self.capacity_key(queue))
+        return int(capacity) if capacity is not None else 0
+
+    def summary(self, queue_lengths):
+        """
+        returns: estimated duration of each kind of task and the queued,
+                 running and worker process counts of each queue in
+                 `queue_lengths`
+        """
+        kinds = sorted(kind.decode('utf-8') for kind in
+                       self.client.smembers(self.kinds_key()))
+        return {
+            'tasks': {kind: self.estimate(kind) for kind in kinds},
+            'queues': {queue: {'length': length,
+                               'running': self.running(queue),
+                               'capacity': self.capacity(queue)}
+                       for queue, length in queue_lengths.items()},
+        }
+
+
+def get_task_runtimes(url=None):
+    if url is None:
+        url = os.environ.get(
+            'RUNTIMES_URL',
+            os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379')
+        )
+    return TaskRuntimes(redis.StrictRedis.from_url(url))
@@ -0,0 +1,51 @@
+import taxcalc
+
+from api import baseline
+
+
+USER_MODS = {
+    'policy': {2017: {'_FICA_ss_trt': [0.1]}},
+    'behavior': {},
+    'growdiff_response': {},
+    'consumption': {},
+    'growdiff_baseline': {},
+    'growmodel': {}}
+
+
+def test_shares_baseline():
+    assert baseline.shares_baseline(USER_MODS)
+    assert baseline.shares_baseline(
+        dict(USER_MODS, behavior={2017: {'_BE_sub': [0.25]}}))
+    assert not baseline.shares_baseline(
+        dict(USER_MODS, consumption={2017: {'_MPC_e20400': [0.01]}}))
+
+
+def test_baseline_cache_evicts_least_recently_used():
+    cache = baseline.BaselineCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+
+
+def test_calculators_reuse_baseline():
+    assert baseline.install()
+    baseline.baselines.clear()
+    kwargs = dict(year_n=0, start_year=2017, use_puf_not_cps=False,
+                  use_full_sample=False)
+    calc1, calc2 = baseline.calculators(user_mods=USER_MODS, **kwargs)
+    assert len(baseline.baselines) == 1
+    other = dict(USER_MODS, policy={2017: {'_FICA_ss_trt': [0.2]}})
+    calc1_again, calc3 = baseline.calculators(user_mods=other, **kwargs)
+    assert len(baseline.baselines) == 1
+    assert calc1_again is not calc1
+    assert (calc1.weighted_total('combined') ==
+            calc1_again.weighted_total('combined'))
+    assert (calc2.weighted_total('combined') !=
+            calc3.weighted_total('combined'))
+
+    raw_data = taxcalc.tbi.run_nth_year_taxcalc_model(user_mods=USER_MODS,
+                                                      **kwargs)
+    assert raw_data
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+
+from api.cache import (canonicalize, hash_inputs, LocalStore, ResultCache)
+
+
+@pytest.fixture
+def user_mods():
+    return {
+        "policy": {2017: {"_FICA_ss_trt": [0.1], "_II_em": [4333]}},
+        "behavior": {},
+        "growdiff_baseline": {},
+        "growdiff_response": {},
+        "consumption": {},
+        "growmodel": {}
+    }
+
+
+def test_canonicalize(user_mods):
+    exp = {"policy": {"2017": {"_FICA_ss_trt": [0.1], "_II_em": [4333.0]}},
+           "behavior": {}, "growdiff_baseline": {}, "growdiff_response": {},
+           "consumption": {}, "growmodel": {}}
+    assert canonicalize(user_mods) == exp
+    assert canonicalize([True, 1, None, (1, 2)]) == [True, 1.0, None,
+                                                     [1.0, 2.0]]
+
+
+def test_hash_inputs_ignores_key_type_and_order(user_mods):
+    reordered = {
+        "growmodel": {},
+        "consumption": {},
+        "growdiff_response": {},
+        "growdiff_baseline": {},
+        "behavior": {},
+        "policy": {"2017": {"_II_em": [4333.0], "_FICA_ss_trt": [0.1]}},
+    }
+    assert hash_inputs(user_mods, 2017) == hash_inputs(reordered, 2017.0)
+    assert hash_inputs(user_mods, 2017) != hash_inputs(user_mods, 2018)
+
+
+def test_local_store_expires():
+    store = LocalStore()
+    store.set('a', 'value')
+    store.set('b', b'value', ttl=0.01)
+    assert store.get('a') == b'value'
+    assert store.get('b') == b'value'
+    time.sleep(0.02)
+    assert store.get('b') is None
+    store.delete('a')
+    assert store.get('a') is None
+
+
+def test_result_cache(user_mods):
+    cache = ResultCache(LocalStore())
+    inputs = [{'user_mods': user_mods, 'start_year': 2017, 'year_n': i,
+               'use_puf_not_cps': True} for i in range(3)]
+    key = cache.job_key('/dropq_start_job', inputs, ['0.20.1'])
+    assert key != cache.job_key('/dropq_small_start_job', inputs, ['0.20.1'])
+    assert key != cache.job_key('/dropq_start_job', inputs, ['0.20.2'])
+    assert cache.get_job(key) is None
+    cache.set_job(key, 'job-id')
+    assert cache.get_job(key) == 'job-id'
+    cache.forget_job(key)
+    assert cache.get_job(key) is None
+    assert not cache.owns_job('job-id')
+    cache.own_job('job-id')
+    assert cache.owns_job('job-id')
+
+
+def test_year_cache(user_mods):
+    cache = ResultCache(LocalStore())
+    key = cache.year_key(0, user_mods, 2017, True, True, '0.20.1')
+    assert key != cache.year_key(1, user_mods, 2017, True, True, '0.20.1')
+    assert key != cache.year_key(0, user_mods, 2017, True, False, '0.20.1')
+    assert key != cache.year_key(0, user_mods, 2017, False, True, '0.20.1')
+    assert not cache.has_year(key)
+    raw_data = {'outputs': [{'year': '2017', 'raw': '{}'}],
+                'aggr_outputs': []}
+    cache.set_year(key, raw_data)
+    assert cache.has_year(key)
+    assert cache.get_year(key) == raw_data
+    assert cache.get_year_outputs(key) is None
+    cache.set_year_outputs(key, [{'year': '2017', 'renderable': ''}])
+    assert cache.get_year_outputs(key) == [{'year': '2017',
+                                            'renderable': ''}]
+    cache.delete_year_outputs(key)
+    assert cache.get_year_outputs(key) is None
+    assert cache.get_year(key) == raw_data
+
+
+def test_completed_years(user_mods):
+    cache = ResultCache(LocalStore())
+    keys = [cache.year_key(i, user_mods, 2017, True, True, '0.20.1')
+            for i in range(3)]
+    assert cache.completed_years('job-id') is None
+    cache.set_manifest('job-id', keys)
+    assert cache.completed_years('job-id') == ([], 3)
+    cache.set_year(keys[1], {'aggr_1': '{}'})
+    assert cache.completed_years('job-id') == ([1], 3)
+
+
+def test_validation_cache():
+    cache = ResultCache(LocalStore())
+    reform = '{"policy": {"_II_em": {"2018": [8000]}}}'
+    key = cache.validation_key(reform, None, True, '0.20.1')
+    assert key != cache.validation_key(reform, None, False, '0.20.1')
+    assert key != cache.validation_key(reform, None, True, '0.20.2')
+    assert cache.get_validation(key) is None
+    result = {'policy_dict': {'policy': {'2018': {'_II_em': [8000]}}},
+              'errors_warnings': {'policy': {'warnings': '', 'errors': ''}}}
+    cache.set_validation(key, result)
+    assert cache.get_validation(key) == result
+
+
+def test_forgotten_results():
+    cache = ResultCache(LocalStore())
+    assert not cache.is_forgotten('job-id')
+    cache.forget_result('job-id')
+    assert cache.is_forgotten('job-id')
+
+
+def test_reused_jobs():
+    cache = ResultCache(LocalStore())
+    assert not cache.was_reused('job-id')
+    cache.reuse_job('job-id')
+    assert cache.was_reused('job-id')
+
+
+def test_header():
+    cache = ResultCache(LocalStore())
+    assert cache.get_header('job-id') is None
+    cache.set_header('job-id', 'group-id')
+    assert cache.get_header('job-id') == 'group-id'
@@ -4,7 +4,12 @@ from celery import chord
 from api.celery_tasks import (taxbrain_elast_async,
                               taxbrain_elast_postprocess,
                               dropq_task_small_async,
-                              taxbrain_postprocess)
+                              taxbrain_postprocess,
+                              result_cache,
+                              stitch_years,
+                              merge_years,
+                              interleave_years,
+                              QUEUES)
 
 @pytest.fixture(scope='session')
 def celery_config():
@@ -12,7 +17,15 @@ def celery_config():
         'broker_url': 'redis://localhost:6379',
         'result_backend': 'redis://localhost:6379',
         'task_serializer': 'json',
-        'accept_content': ['msgpack', 'json']}
+        'accept_content': ['msgpack', 'json'],
+        'result_serializer': 'msgpack'}
+
+
+@pytest.fixture(scope='session')
+def celery_worker_parameters():
+    # callbacks built in these tests go to the default queue
+    return {'queues': QUEUES + ['celery']}
+
 
 def test_elast_endpoint(celery_worker):
     elast_params = {
@@ -67,3 +80,26 @@ def test_taxbrain_endpoint(celery_worker):
                     for i in inputs))(postprocess_task.signature(
                         serializer='msgpack'))
     print(result.get())
+
+
+def test_stitch_years():
+    result_cache.set_year('test:year:0', {'outputs': [0]})
+    result_cache.set_year('test:year:2', {'outputs': [2]})
+    ans = stitch_years([{'outputs': [1]}],
+                       [[2, 'test:year:2'], [0, 'test:year:0']])
+    assert ans == [{'outputs': [0]}, {'outputs': [1]}, {'outputs': [2]}]
+    with pytest.raises(KeyError):
+        stitch_years([], [[0, 'test:year:missing']])
+
+
+def test_merge_years():
+    ans = [{'aggr_1': ['2017'], 'dist1_xbin': ['2017']},
+           {'aggr_1': ['2018'], 'dist1_xbin': ['2018']}]
+    assert merge_years(ans) == {'aggr_1': ['2017', '2018'],
+                                'dist1_xbin': ['2017', '2018']}
+
+
+def test_interleave_years():
+    outputs_by_year = [['dist_2017', 'diff_2017'], ['dist_2018', 'diff_2018']]
+    assert interleave_years(outputs_by_year) == [
+        'dist_2017', 'dist_2018', 'diff_2017', 'diff_2018']
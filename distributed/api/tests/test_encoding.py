@@ -0,0 +1,12 @@
+from api.encoding import pack, unpack, stored_result
+
+
+def test_pack_round_trip():
+    results = {'outputs': [{'csv': 'a,b', 'values': [1.5, 2.0]}],
+               'counts': [1, 2], 'total': 3.5, 'renderable': '<table>'}
+    assert unpack(pack(results)) == results
+
+
+def test_stored_result():
+    assert stored_result('{"outputs": []}') == {'outputs': []}
+    assert stored_result({'outputs': []}) == {'outputs': []}
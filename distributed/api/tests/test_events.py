@@ -0,0 +1,22 @@
+import pytest
+import redis
+
+from api.events import JobEvents, YES
+
+
+@pytest.fixture
+def job_events():
+    return JobEvents(redis.StrictRedis.from_url('redis://localhost:6379'),
+                     prefix='policybrain-test')
+
+
+def test_final_state_is_stored(job_events):
+    assert job_events.state('no-such-job') is None
+    job_events.publish('job-2', YES)
+    assert job_events.state('job-2') == YES
+
+
+def test_final_state_is_cleared(job_events):
+    job_events.publish('job-3', YES)
+    job_events.clear('job-3')
+    assert job_events.state('job-3') is None
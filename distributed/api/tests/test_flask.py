@@ -1,9 +1,14 @@
 import pytest
 import json
+import random
 import time
 import msgpack
+from celery.result import GroupResult
 
-from api import create_app
+from api import create_app, endpoints
+from api.encoding import unpack
+from api.celery_tasks import (celery_app, result_cache, TAXCALC_VERSION,
+                              BTAX_VERSION)
 
 
 @pytest.fixture
@@ -69,15 +74,198 @@ def test_hello(client):
     print(resp)
 
 
+def test_queue_lengths(client):
+    resp = client.get('/queue_lengths')
+    assert resp.status_code == 200
+    lengths = json.loads(resp.data.decode('utf-8'))
+    assert set(lengths) == {'quick', 'full', 'elast', 'ccc'}
+
+
+def test_task_runtimes(client):
+    resp = client.get('/task_runtimes')
+    assert resp.status_code == 200
+    summary = json.loads(resp.data.decode('utf-8'))
+    assert set(summary['queues']) == {'quick', 'full', 'elast', 'ccc'}
+    for queue in summary['queues'].values():
+        assert set(queue) == {'length', 'running', 'capacity'}
+
+
 def test_dropq_small_start_job(client, taxcalc_inputs):
     resp = post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
     result = json.loads(resp.data.decode('utf-8'))
     assert 'aggr_outputs' in result
 
 
+def test_dropq_result_msgpack(client, taxcalc_inputs):
+    resp = post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    result = json.loads(resp.data.decode('utf-8'))
+    job_id = json.loads(client.post(
+        '/dropq_small_start_job',
+        data=msgpack.dumps(taxcalc_inputs, use_bin_type=True),
+        headers={'Content-Type': 'application/octet-stream'}
+    ).data.decode('utf-8'))['job_id']
+    resp = client.get('/dropq_get_result?job_id={}'.format(job_id),
+                      headers={'Accept': 'application/msgpack'})
+    assert resp.headers['Content-Type'] == 'application/msgpack'
+    assert unpack(resp.data) == result
+
+
+def test_dropq_resubmit_reuses_job(client, taxcalc_inputs):
+    packed = msgpack.dumps(taxcalc_inputs, use_bin_type=True)
+    job_ids = []
+    for _ in range(2):
+        resp = client.post('/dropq_small_start_job',
+                           data=packed,
+                           headers={'Content-Type': 'application/octet-stream'}
+                           )
+        assert resp.status_code == 200
+        job_ids.append(json.loads(resp.data.decode('utf-8'))['job_id'])
+    assert job_ids[0] == job_ids[1]
+    resp = client.get('/dropq_owns_job?job_id={}'.format(job_ids[0]))
+    assert resp.data.decode('utf-8') == 'YES'
+    resp = client.get('/dropq_owns_job?job_id=not-a-job')
+    assert resp.data.decode('utf-8') == 'NO'
+
+
+def test_dropq_year_results(client, taxcalc_inputs):
+    resp = post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    packed = msgpack.dumps(taxcalc_inputs, use_bin_type=True)
+    resp = client.post('/dropq_small_start_job',
+                       data=packed,
+                       headers={'Content-Type': 'application/octet-stream'}
+                       )
+    job_id = json.loads(resp.data.decode('utf-8'))['job_id']
+
+    resp = client.get('/dropq_query_years?job_id={}'.format(job_id))
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode('utf-8')) == {'completed': [0],
+                                                     'total': 1}
+    resp = client.get('/dropq_job_progress?job_id={}'.format(job_id))
+    assert json.loads(resp.data.decode('utf-8')) == {'status': 'YES',
+                                                     'years': [0]}
+    resp = client.get('/dropq_job_progress?job_id=not-a-job')
+    assert json.loads(resp.data.decode('utf-8')) == {'status': 'NO',
+                                                     'years': None}
+    resp = client.get(
+        '/dropq_get_year_result?job_id={}&index=0'.format(job_id))
+    assert resp.status_code == 200
+    result = json.loads(resp.data.decode('utf-8'))
+    assert result['index'] == 0
+    assert all(output['year'] == '2017' for output in result['outputs'])
+    resp = client.get(
+        '/dropq_get_year_result?job_id={}&index=1'.format(job_id))
+    assert resp.status_code == 404
+
+
 def test_dropq_job_fails(client, taxcalc_inputs):
     del taxcalc_inputs[0]['user_mods']['policy']
     resp = post_and_poll(client, '/dropq_start_job', exp_status='FAIL',
                          data=taxcalc_inputs)
 
     assert 'Traceback' in resp.data.decode('utf-8')
+
+
+def test_validate_reform(client):
+    inputs = [{'reform': '{"policy": {"_II_em": {"2018": [8000]}}}',
+               'assumptions': None,
+               'use_puf_not_cps': False}]
+    resp = post_and_poll(client, '/validate_reform', inputs)
+    result = json.loads(resp.data.decode('utf-8'))
+    assert result['policy_dict']['policy'] == {'2018': {'_II_em': [8000]}}
+    assert set(result['errors_warnings']) >= {'policy', 'behavior'}
+    # validated reforms are answered without starting a job
+    resp = client.post('/validate_reform',
+                       data=msgpack.dumps(inputs, use_bin_type=True),
+                       headers={'Content-Type': 'application/octet-stream'})
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['job_id'] is None
+    assert data['result'] == result
+
+
+def test_validate_reform_reports_errors(client):
+    inputs = [{'reform': '{"policy": ',
+               'assumptions': None,
+               'use_puf_not_cps': False}]
+    post_and_poll(client, '/validate_reform', inputs, exp_status='FAIL')
+    # the error is reported instead of validating the reform again
+    resp = client.post('/validate_reform',
+                       data=msgpack.dumps(inputs, use_bin_type=True),
+                       headers={'Content-Type': 'application/octet-stream'})
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['error']
+
+
+def test_bulk_results(client, taxcalc_inputs, monkeypatch):
+    resp = post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    result = json.loads(resp.data.decode('utf-8'))
+    packed = msgpack.dumps(taxcalc_inputs, use_bin_type=True)
+    resp = client.post('/dropq_small_start_job', data=packed,
+                       headers={'Content-Type': 'application/octet-stream'})
+    job_id = json.loads(resp.data.decode('utf-8'))['job_id']
+    query = 'job_id={}&job_id=not-a-job'.format(job_id)
+
+    resp = client.get('/dropq_query_results?' + query)
+    assert json.loads(resp.data.decode('utf-8')) == {job_id: 'YES',
+                                                     'not-a-job': 'NO'}
+    resp = client.get('/dropq_get_results?' + query)
+    assert json.loads(resp.data.decode('utf-8')) == {
+        'results': {job_id: result}, 'failed': {}, 'pending': ['not-a-job']}
+    resp = client.get('/dropq_get_results?' + query,
+                      headers={'Accept': 'application/msgpack'})
+    assert resp.headers['Content-Type'] == 'application/msgpack'
+    data = msgpack.loads(resp.data, raw=False)
+    assert data['results'] == {job_id: result}
+    # finished jobs beyond the size limit are left for the next request
+    monkeypatch.setattr(endpoints, 'MAX_BULK_RESULT_BYTES', 0)
+    resp = client.get('/dropq_get_results?' + query)
+    assert json.loads(resp.data.decode('utf-8')) == {
+        'results': {}, 'failed': {}, 'pending': [job_id, 'not-a-job']}
+
+    resp = client.get('/dropq_query_results?' + '&'.join(
+        'job_id={}'.format(i) for i in range(101)))
+    assert resp.status_code == 400
+
+
+def test_forget_results(client, taxcalc_inputs):
+    post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    packed = msgpack.dumps(taxcalc_inputs, use_bin_type=True)
+    resp = client.post('/dropq_small_start_job', data=packed,
+                       headers={'Content-Type': 'application/octet-stream'})
+    job_id = json.loads(resp.data.decode('utf-8'))['job_id']
+
+    resp = client.post('/dropq_forget_results?job_id={}&job_id=not-a-job'
+                       .format(job_id))
+    # the job was handed out twice, so its result is left to expire
+    assert json.loads(resp.data.decode('utf-8')) == {'forgotten': []}
+    resp = client.get('/dropq_query_result?job_id={}'.format(job_id))
+    assert resp.data.decode('utf-8') == 'YES'
+    # the same inputs start a new job once the result is forgotten
+    post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    new_job_id = result_cache.get_job(result_cache.job_key(
+        '/dropq_small_start_job', taxcalc_inputs,
+        [TAXCALC_VERSION, BTAX_VERSION]))
+    assert new_job_id != job_id
+
+    resp = client.post('/dropq_forget_results?job_id={}'.format(new_job_id))
+    assert json.loads(resp.data.decode('utf-8')) == {
+        'forgotten': [new_job_id]}
+    resp = client.get('/dropq_query_result?job_id={}'.format(new_job_id))
+    assert resp.data.decode('utf-8') == 'NO'
+
+
+def test_forget_results_deletes_year_results(client, taxcalc_inputs):
+    # a reform that has not been computed before, so that its year runs
+    taxcalc_inputs[0]['user_mods']['policy'][2017]['_FICA_ss_trt'] = [
+        random.uniform(0.1, 0.2)]
+    post_and_poll(client, '/dropq_small_start_job', taxcalc_inputs)
+    job_id = result_cache.get_job(result_cache.job_key(
+        '/dropq_small_start_job', taxcalc_inputs,
+        [TAXCALC_VERSION, BTAX_VERSION]))
+    header = GroupResult.restore(result_cache.get_header(job_id))
+    backend = celery_app.backend
+    keys = [backend.get_key_for_task(year.id) for year in header.results]
+    assert all(backend.client.exists(key) for key in keys)
+
+    resp = client.post('/dropq_forget_results?job_id={}'.format(job_id))
+    assert json.loads(resp.data.decode('utf-8')) == {'forgotten': [job_id]}
+    assert not any(backend.client.exists(key) for key in keys)
@@ -0,0 +1,17 @@
+from api.resident import ResidentData
+
+
+def test_resident_data_hands_out_copies():
+    data = ResidentData()
+    data.load(['cps'])
+    full_sample = data.sample('cps', use_full_sample=True)
+    assert full_sample is not data.frame('cps')
+    assert len(data.sample('cps', use_full_sample=False)) < len(full_sample)
+    assert data.policy() is not data.policy()
+    assert data.growfactors() is data.growfactors()
+
+
+def test_resident_records():
+    data = ResidentData()
+    records = data.records('cps', use_full_sample=False)
+    assert records.array_length == len(data.sample('cps', False))
@@ -0,0 +1,41 @@
+import pytest
+import redis
+
+from api.runtimes import TaskRuntimes, task_kind
+
+
+@pytest.fixture
+def task_runtimes():
+    client = redis.StrictRedis.from_url('redis://localhost:6379')
+    for key in client.keys('policybrain-test:r*'):
+        client.delete(key)
+    for key in client.keys('policybrain-test:capacity:*'):
+        client.delete(key)
+    return TaskRuntimes(client, window=3, prefix='policybrain-test')
+
+
+def test_task_kind():
+    assert task_kind('dropq', {'use_puf_not_cps': True}) == 'dropq:puf'
+    assert task_kind('dropq', {'use_puf_not_cps': False}) == 'dropq:cps'
+    assert task_kind('btax', {'user_mods': {}}) == 'btax'
+
+
+def test_estimate_uses_recent_durations(task_runtimes):
+    assert task_runtimes.estimate('dropq:puf') == {'mean_seconds': None,
+                                                   'samples': 0}
+    for i, seconds in enumerate([100, 10, 20, 30]):
+        task_runtimes.started('full', str(i))
+        task_runtimes.finished('full', str(i), 'dropq:puf', seconds)
+    assert task_runtimes.estimate('dropq:puf') == {'mean_seconds': 20.0,
+                                                   'samples': 3}
+
+
+def test_running_and_capacity(task_runtimes):
+    task_runtimes.started('quick', 'a')
+    task_runtimes.started('quick', 'b')
+    task_runtimes.finished('quick', 'a', None, None)
+    assert task_runtimes.running('quick') == 1
+    assert task_runtimes.capacity('quick') == 2
+    summary = task_runtimes.summary({'quick': 5})
+    assert summary['queues'] == {'quick': {'length': 5, 'running': 1,
+                                           'capacity': 2}}
@@ -0,0 +1,100 @@
+"""
+Time the postprocessing step of a TaxBrain run.
+
+Runs the years of a reform with Tax-Calculator and then compares the step
+that merges and formats all of the years at once with the step that only
+builds the aggregate tables from years that were formatted by their own
+tasks. The year tasks run in parallel, so the time in which the per-year
+formatting is done is that of the slowest year.
+
+Run from the distributed directory:
+
+    python benchmarks/postprocess.py --years 10
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+# keep the years in memory rather than in Redis
+os.environ.setdefault('RESULT_CACHE_URL', 'local://')
+
+import taxcalc  # noqa: E402
+
+from api.celery_tasks import (postprocess, postprocess_by_year,  # noqa: E402
+                              year_outputs, result_cache)
+
+
+USER_MODS = {
+    'policy': {2017: {'_FICA_ss_trt': [0.1], '_II_em': [8000]}},
+    'behavior': {},
+    'growdiff_baseline': {},
+    'growdiff_response': {},
+    'consumption': {},
+    'growmodel': {},
+}
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def run_years(num_years, start_year, use_puf_not_cps, use_full_sample):
+    ans = []
+    for year_n in range(num_years):
+        seconds, raw_data = timed(
+            taxcalc.tbi.run_nth_year_taxcalc_model,
+            year_n=year_n, start_year=start_year,
+            use_puf_not_cps=use_puf_not_cps,
+            use_full_sample=use_full_sample, user_mods=USER_MODS)
+        print('year {0}: {1:.1f}s'.format(year_n, seconds))
+        ans.append(raw_data)
+    return ans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--start-year', type=int, default=2017)
+    parser.add_argument('--cps', action='store_true',
+                        help='use the CPS instead of the PUF')
+    parser.add_argument('--sample', action='store_true',
+                        help='use a sample instead of the full data set')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ans = run_years(args.years, args.start_year, not args.cps,
+                    not args.sample)
+    year_keys = ['benchmark:year:{}'.format(i) for i in range(len(ans))]
+
+    merged_times = []
+    per_year_times = []
+    tail_times = []
+    for _ in range(args.repeat):
+        seconds, expected = timed(postprocess, ans, taxcalc.tbi.postprocess)
+        merged_times.append(seconds)
+
+        year_times = []
+        for key, raw_data in zip(year_keys, ans):
+            seconds, outputs = timed(year_outputs, raw_data)
+            result_cache.set_year_outputs(key, outputs)
+            year_times.append(seconds)
+        per_year_times.append(max(year_times))
+
+        seconds, results = timed(postprocess_by_year, ans, year_keys)
+        tail_times.append(seconds)
+        if results != expected:
+            print('WARNING: results differ from the merged postprocessing')
+
+    print('merged postprocess:      {:.2f}s'.format(min(merged_times)))
+    print('slowest year formatting: {:.2f}s (in the year tasks)'.format(
+        min(per_year_times)))
+    print('aggregate postprocess:   {:.2f}s'.format(min(tail_times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,15 @@
 from functools import partial
 import os
-from ..core.compute import Compute
+from ..core.compute import Compute, BTAX_URL
+from ..core.hosts import HostPool, parse_hosts
 from ..taxbrain.mock_compute import (MockCompute,
                                      MockFailedCompute,
                                      NodeDownCompute,
                                      )
 import requests_mock
 requests_mock.Mocker.TEST_PREFIX = 'dropq'
-btax_workers = os.environ.get('BTAX_WORKERS', '')
-BTAX_WORKERS = btax_workers.split(",")
+# B-Tax jobs go to the DROPQ_WORKERS hosts unless BTAX_WORKERS is set
+BTAX_WORKERS = parse_hosts(os.environ.get('BTAX_WORKERS'))
 
 
 def package_up_vars(self, user_mods, first_budget_year):
@@ -51,9 +52,11 @@ def mock_dropq_get_results(is_error, self, *args, **kwargs):
 class DropqComputeBtax(Compute):
     num_budget_years = 1
     package_up_vars = package_up_vars
+    if BTAX_WORKERS:
+        hosts = HostPool(BTAX_WORKERS)
 
     def submit_btax_calculation(self, user_mods, first_budget_year):
-        url_template = "http://{hn}/btax_start_job"
+        url_template = "http://{hn}" + BTAX_URL
         data = {}
         user_mods = self.package_up_vars(user_mods, first_budget_year)
         if not bool(user_mods):
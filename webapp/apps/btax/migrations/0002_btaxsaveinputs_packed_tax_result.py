@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('btax', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='btaxsaveinputs',
+            name='packed_tax_result',
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -7,8 +7,11 @@ from django.core import validators
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 import datetime
+import json
 from django.utils.timezone import make_aware
 
+from ..core import results as packing
+
 # digit or true/false (case insensitive)
 COMMASEP_REGEX = "(<,)|(\\d*\\.\\d+|\\d+)|((?i)(true|false))"
 
@@ -202,11 +205,45 @@ class BTaxSaveInputs(models.Model):
         max_length=20)
     # Result
     tax_result = models.TextField(default=None, blank=True, null=True)
+    # Result compressed instead of stored in tax_result, see core.results
+    packed_tax_result = models.BinaryField(default=None, blank=True,
+                                           null=True)
     # Creation DateTime
     creation_date = models.DateTimeField(
         default=make_aware(datetime.datetime(2015, 1, 1))
     )
 
+    def has_tax_result(self):
+        return bool(self.tax_result) or self.packed_tax_result is not None
+
+    def get_tax_result(self):
+        """
+        returns: result tables of the run
+        """
+        if self.packed_tax_result is not None:
+            return packing.unpack(self.packed_tax_result)
+        return json.loads(self.tax_result)
+
+    def set_tax_result(self, results):
+        if packing.COMPRESS_RESULTS:
+            self.packed_tax_result = packing.pack(results)
+            self.tax_result = None
+        else:
+            self.tax_result = json.dumps(results)
+            self.packed_tax_result = None
+
+    def compress_results(self):
+        """
+        Move tax_result into packed_tax_result
+
+        returns: whether there was a result to compress
+        """
+        if not self.tax_result:
+            return False
+        self.packed_tax_result = packing.pack(json.loads(self.tax_result))
+        self.tax_result = None
+        return True
+
     class Meta:
         permissions = (
             ("view_inputs", "Allowed to view Taxbrain."),
@@ -23,7 +23,7 @@ from .helpers import (get_btax_defaults,
                       group_args_to_btax_depr, hover_args_to_btax_depr,
                       make_bool, convert_val)
 from .compute import DropqComputeBtax
-from ..core.compute import JobFailError
+from ..core.compute import JobFailError, BTAX_URL
 
 from ..constants import (METTR_TOOLTIP, METR_TOOLTIP, COC_TOOLTIP,
                          DPRC_TOOLTIP, START_YEAR)
@@ -204,8 +204,9 @@ def btax_results(request):
                 unique_url.model_pk = model.pk
                 cur_dt = timezone.now()
                 future_offset = datetime.timedelta(
-                    seconds=((2 + max_q_length) *
-                             JOB_PROC_TIME_IN_SECONDS)
+                    seconds=dropq_compute.eta_seconds(
+                        submitted_id, BTAX_URL, [worker_data], max_q_length,
+                        JOB_PROC_TIME_IN_SECONDS)
                 )
                 expected_completion = cur_dt + future_offset
                 unique_url.exp_comp_datetime = expected_completion
@@ -361,12 +362,11 @@ def output_detail(request, pk):
                          'webapp_version': webapp_vers_disp}
 
     model = url.unique_inputs
-    if model.tax_result:
+    if model.has_tax_result():
         # try to render table; if failure render not available page
         try:
             exp_num_minutes = 0.25
-            tax_result = url.unique_inputs.tax_result
-            tables = json.loads(tax_result)
+            tables = url.unique_inputs.get_tax_result()
             first_year = url.unique_inputs.first_year
             created_on = url.unique_inputs.creation_date
             tables["tooltips"] = {
@@ -435,7 +435,7 @@ def output_detail(request, pk):
 
         if job_ready == 'YES':
             results = dropq_compute.btax_get_results(job_id)
-            model.tax_result = json.dumps(results)
+            model.set_tax_result(results)
             model.creation_date = timezone.now()
             model.save()
             return redirect(url)
@@ -8,6 +8,13 @@ CUR_PATH = os.path.join(
 )
 
 
+@pytest.fixture(autouse=True)
+def validate_locally(monkeypatch):
+    # there are no workers to validate reforms during the tests
+    from .taxbrain import param_formatters
+    monkeypatch.setattr(param_formatters, 'VALIDATE_ON_WORKERS', False)
+
+
 @pytest.fixture()
 def r1(request):
     with open(os.path.join(CUR_PATH, 'r1.json')) as f:
@@ -0,0 +1,64 @@
+"""
+In-process caches shared by the request threads of a web worker.
+"""
+import threading
+from collections import OrderedDict
+
+
+class BoundedCache(object):
+    """
+    Least recently used cache of at most `maxsize` values that are built on
+    demand by calling `build(*key)`. Each key has its own lock so that
+    threads asking for a missing value wait for a single build of it instead
+    of each building it, while values for other keys stay available.
+
+    Values are shared by every thread and must not be modified.
+    """
+
+    def __init__(self, build, maxsize):
+        self.build = build
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+    def _lookup(self, key):
+        if key in self._values:
+            self._values.move_to_end(key)
+            return True, self._values[key]
+        return False, None
+
+    def get(self, key):
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            key_lock = self._building.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # another thread may have built it while this one waited
+                found, value = self._lookup(key)
+                if found:
+                    return value
+            try:
+                value = self.build(*key)
+                with self._lock:
+                    self._values[key] = value
+                    while len(self._values) > self.maxsize:
+                        self._values.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
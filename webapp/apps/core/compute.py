@@ -1,17 +1,46 @@
+import math
 import os
-import requests
+import time
+from collections import OrderedDict
 import msgpack
 from requests.exceptions import RequestException, Timeout
 import requests_mock
+from .transport import transport, backoff, CircuitOpenError
+from .hosts import HostPool, parse_hosts
 requests_mock.Mocker.TEST_PREFIX = 'dropq'
 
-WORKER_HN = os.environ.get('DROPQ_WORKERS')
+# Comma separated list of distributed API hosts
+WORKER_HOSTS = parse_hosts(os.environ.get('DROPQ_WORKERS'))
+WORKER_HN = WORKER_HOSTS[0] if WORKER_HOSTS else None
 DROPQ_URL = "/dropq_start_job"
 # URL to perform the dropq algorithm on a sample of the full dataset
 DROPQ_SMALL_URL = "/dropq_small_start_job"
+ELASTIC_URL = "/elastic_gdp_start_job"
+BTAX_URL = "/btax_start_job"
+VALIDATE_URL = "/validate_reform"
+# Tasks that a job submitted to each endpoint runs and the queue that its
+# tasks wait in on the workers
+JOB_TASKS = {
+    DROPQ_URL: ('api.celery_tasks.dropq_task_async',
+                'api.celery_tasks.taxbrain_postprocess', 'full'),
+    DROPQ_SMALL_URL: ('api.celery_tasks.dropq_task_small_async',
+                      'api.celery_tasks.taxbrain_postprocess', 'quick'),
+    ELASTIC_URL: ('api.celery_tasks.taxbrain_elast_async',
+                  'api.celery_tasks.taxbrain_elast_postprocess', 'elast'),
+    BTAX_URL: ('api.celery_tasks.btax_async', None, 'ccc'),
+    VALIDATE_URL: ('api.celery_tasks.validate_reform', None, 'quick'),
+}
+# How long the task run times reported by a host are reused
+RUNTIMES_TTL_IN_SECONDS = float(
+    os.environ.get("RUNTIMES_TTL_IN_SECONDS", "10"))
 TIMEOUT_IN_SECONDS = 1.0
-MAX_ATTEMPTS_SUBMIT_JOB = 20
+MAX_ATTEMPTS_SUBMIT_JOB = int(os.environ.get("MAX_ATTEMPTS_SUBMIT_JOB", "5"))
 BYTES_HEADER = {'Content-Type': 'application/octet-stream'}
+MSGPACK_TYPE = 'application/msgpack'
+# Results are asked for as msgpack; hosts that predate it answer with JSON
+RESULTS_ACCEPT = MSGPACK_TYPE + ', application/json;q=0.5'
+# Largest number of jobs asked about in one bulk request
+MAX_BULK_JOBS = int(os.environ.get("MAX_BULK_JOBS", "20"))
 NUM_BUDGET_YEARS = int(os.environ.get("NUM_BUDGET_YEARS", "10"))
 NUM_BUDGET_YEARS_QUICK = int(os.environ.get("NUM_BUDGET_YEARS_QUICK", "1"))
 
@@ -19,7 +48,60 @@ class JobFailError(Exception):
     '''An Exception to raise when a remote jobs has failed'''
 
 
+def decode_results(job_response):
+    """
+    returns: body of a result response decoded according to its content
+             type
+    """
+    if job_response.headers.get('Content-Type', '').startswith(MSGPACK_TYPE):
+        return msgpack.loads(job_response.content, raw=False)
+    return job_response.json()
+
+
+# host -> (time fetched, task run times reported by the host)
+_runtimes_cache = {}
+
+
+def estimate_seconds(runtimes, endpoint, data_list):
+    """
+    Estimate how long a job submitted to `endpoint` takes from the task run
+    times measured by the workers. The job's tasks are assumed to be in the
+    queue behind the tasks already there and to be picked up as the queue's
+    worker processes free up.
+
+    returns: number of seconds or None if no task like the job's has been
+             measured yet
+    """
+    if not runtimes or endpoint not in JOB_TASKS:
+        return None
+    task, postprocess_task, queue = JOB_TASKS[endpoint]
+    source = None
+    if data_list and 'use_puf_not_cps' in data_list[0]:
+        source = 'puf' if data_list[0]['use_puf_not_cps'] else 'cps'
+
+    def mean_seconds(kind):
+        return runtimes['tasks'].get(kind, {}).get('mean_seconds')
+
+    task_seconds = mean_seconds(task if source is None
+                                else '{0}:{1}'.format(task, source))
+    if task_seconds is None:
+        return None
+    load = runtimes['queues'].get(queue, {})
+    running = load.get('running', 0)
+    workers = max(load.get('capacity', 0), running, 1)
+    # the job's tasks are counted in the queue's length unless workers have
+    # already picked them up
+    waiting = max(load.get('length', 0), len(data_list))
+    seconds = math.ceil((waiting + running) / workers) * task_seconds
+    if postprocess_task is not None:
+        seconds += mean_seconds(postprocess_task) or 0
+    return seconds
+
+
 class Compute(object):
+    transport = transport
+    hosts = HostPool(WORKER_HOSTS)
+
     def remote_submit_job(
             self,
             theurl,
@@ -28,22 +110,59 @@ class Compute(object):
             headers=None):
         print(theurl, data)
         if headers is not None:
-            response = requests.post(theurl,
-                                     data=data,
-                                     timeout=timeout,
-                                     headers=headers)
+            response = self.transport.post(theurl,
+                                           data=data,
+                                           timeout=timeout,
+                                           headers=headers)
         else:
-            response = requests.post(theurl, data=data, timeout=timeout)
+            response = self.transport.post(theurl, data=data,
+                                           timeout=timeout)
         return response
 
     def remote_results_ready(self, theurl, params):
-        job_response = requests.get(theurl, params=params)
+        job_response = self.transport.get(theurl, params=params)
         return job_response
 
     def remote_retrieve_results(self, theurl, params):
-        job_response = requests.get(theurl, params=params)
+        job_response = self.transport.get(theurl, params=params,
+                                          headers={'Accept': RESULTS_ACCEPT})
+        return job_response
+
+    def remote_owns_job(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params,
+                                          timeout=TIMEOUT_IN_SECONDS)
+        return job_response
+
+    def remote_completed_years(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params)
         return job_response
 
+    def remote_retrieve_year_results(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params)
+        return job_response
+
+    def remote_job_progress(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params)
+        return job_response
+
+    def remote_bulk_results_ready(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params)
+        return job_response
+
+    def remote_bulk_retrieve_results(self, theurl, params):
+        job_response = self.transport.get(theurl, params=params,
+                                          headers={'Accept': RESULTS_ACCEPT})
+        return job_response
+
+    def remote_bulk_forget_results(self, theurl, params):
+        job_response = self.transport.post(theurl, params=params,
+                                           timeout=TIMEOUT_IN_SECONDS)
+        return job_response
+
+    def remote_task_runtimes(self, theurl):
+        response = self.transport.get(theurl, timeout=TIMEOUT_IN_SECONDS)
+        return response
+
     def submit_calculation(self, data):
         url_template = "http://{hn}" + DROPQ_URL
         return self.submit(data, url_template)
@@ -53,7 +172,7 @@ class Compute(object):
         return self.submit(data, url_template, increment_counter=False)
 
     def submit_elastic_calculation(self, data):
-        url_template = "http://{hn}/elastic_gdp_start_job"
+        url_template = "http://{hn}" + ELASTIC_URL
         return self.submit(data, url_template)
 
     def submit(self,
@@ -61,29 +180,53 @@ class Compute(object):
                url_template,
                increment_counter=True,
                use_wnc_offset=True):
-        print("hostnames: ", WORKER_HN)
+        response_d = self._submit(data_list, url_template)
+        return response_d['job_id'], response_d['qlength']
+
+    def _submit(self, data_list, url_template):
+        """
+        Post `data_list` to the least loaded host, failing over to the other
+        hosts
+
+        returns: decoded response of the host that accepted the job
+        """
+        print("hostnames: ", self.hosts.hosts)
         print("submitting data: ", data_list)
-        queue_length = 0
         submitted = False
         attempts = 0
+        tried = set()
+        packed = msgpack.dumps(data_list, use_bin_type=True)
         while not submitted:
-            packed = msgpack.dumps(data_list, use_bin_type=True)
-            theurl = url_template.format(hn=WORKER_HN)
+            if attempts > 0:
+                time.sleep(backoff(attempts - 1))
+            # fail over to the other hosts before retrying a failed one
+            host = self.hosts.choose(self.transport, exclude=tried,
+                                     lane=url_template)
+            if host is None:
+                print("Not submitting, all workers are down")
+                raise IOError("All workers are down")
+            tried.add(host)
+            theurl = url_template.format(hn=host)
             try:
                 response = self.remote_submit_job(
                     theurl, data=packed, timeout=TIMEOUT_IN_SECONDS,
                     headers=BYTES_HEADER)
                 if response.status_code == 200:
-                    print("submitted: ", )
+                    print("submitted: ", host)
                     submitted = True
                     response_d = response.json()
-                    job_id = response_d['job_id']
-                    queue_length = response_d['qlength']
+                    self.hosts.report(host, response_d['qlength'],
+                                      lane=url_template)
+                    if response_d['job_id'] is not None:
+                        self.hosts.assign(response_d['job_id'], host)
                 else:
-                    print("FAILED: ", data_list, WORKER_HN)
+                    print("FAILED: ", data_list, host)
                     attempts += 1
+            except CircuitOpenError as coe:
+                print("Worker is down: ", coe)
+                attempts += 1
             except Timeout:
-                print("Couldn't submit to: ", WORKER_HN)
+                print("Couldn't submit to: ", host)
                 attempts += 1
             except RequestException as re:
                 print("Something unexpected happened: ", re)
@@ -92,13 +235,86 @@ class Compute(object):
                 print("Exceeded max attempts. Bailing out.")
                 raise IOError()
 
-        return job_id, queue_length
+        return response_d
+
+    def start_validation(self, reform, assumptions, use_puf_not_cps):
+        """
+        Have the workers read and check a reform and assumptions JSON text.
+        Does not wait for the validation job.
+
+        returns: dictionary with the validation result under 'result' if the
+                 reform has been validated before, or Tax-Calculator's
+                 message under 'error' if it could not be read. Otherwise
+                 the id of the validation job is under 'job_id'. The result
+                 holds the parameter dictionary read from the texts under
+                 'policy_dict' and Tax-Calculator's warning and error
+                 messages under 'errors_warnings'. Year keys are strings.
+        """
+        return self._submit(
+            [{'reform': reform, 'assumptions': assumptions,
+              'use_puf_not_cps': use_puf_not_cps}],
+            "http://{hn}" + VALIDATE_URL)
+
+    def host_for(self, job_id):
+        """
+        Find the host that accepted `job_id`. Jobs submitted by another
+        process are looked up by asking each host whether it owns the job.
+
+        returns: host name
+        """
+        host = self.hosts.owner(job_id)
+        if host is not None or len(self.hosts) == 1:
+            return host or self.hosts.hosts[0]
+        for host in self.hosts.available(self.transport):
+            url = "http://{hn}/dropq_owns_job".format(hn=host)
+            try:
+                response = self.remote_owns_job(url,
+                                                params={'job_id': job_id})
+            except RequestException as re:
+                print("Couldn't ask {} about {}: ".format(host, job_id), re)
+                continue
+            if response.status_code == 200 and response.text == 'YES':
+                self.hosts.assign(job_id, host)
+                return host
+        return self.hosts.hosts[0]
+
+    def task_runtimes(self, host):
+        """
+        returns: task run times and queue loads reported by `host`, see
+                 /task_runtimes
+        """
+        fetched_at, runtimes = _runtimes_cache.get(host, (0, None))
+        if time.time() - fetched_at < RUNTIMES_TTL_IN_SECONDS:
+            return runtimes
+        url = "http://{hn}/task_runtimes".format(hn=host)
+        response = self.remote_task_runtimes(url)
+        runtimes = response.json() if response.status_code == 200 else None
+        _runtimes_cache[host] = (time.time(), runtimes)
+        return runtimes
+
+    def eta_seconds(self, job_id, endpoint, data_list, queue_length,
+                    default_task_seconds):
+        """
+        Estimate how long the job `job_id` submitted to `endpoint` takes. Uses
+        the fixed time per queued job when the workers have not measured any
+        task like the job's yet or cannot be reached.
+        """
+        try:
+            runtimes = self.task_runtimes(self.host_for(job_id))
+        except (RequestException, ValueError) as e:
+            print('could not get task run times', e)
+            runtimes = None
+        seconds = estimate_seconds(runtimes, endpoint, data_list)
+        if seconds is None:
+            seconds = (2 + queue_length) * default_task_seconds
+        return seconds
 
     def results_ready(self, job_id):
-        result_url = "http://{hn}/dropq_query_result".format(hn=WORKER_HN)
+        host = self.host_for(job_id)
+        result_url = "http://{hn}/dropq_query_result".format(hn=host)
         job_response = self.remote_results_ready(
             result_url, params={'job_id': job_id})
-        msg = '{0} failed on host: {1}'.format(job_id, WORKER_HN)
+        msg = '{0} failed on host: {1}'.format(job_id, host)
         if job_response.status_code == 200:  # Valid response
             return job_response.text
         else:
@@ -107,8 +323,56 @@ class Compute(object):
                 job_response.status_code)
             raise JobFailError(msg)
 
+    def completed_years(self, job_id):
+        """
+        returns: indices of the years of `job_id` that have finished, or None
+                 if the worker does not track the job's years
+        """
+        result_url = "http://{hn}/dropq_query_years".format(
+            hn=self.host_for(job_id))
+        job_response = self.remote_completed_years(
+            result_url, params={'job_id': job_id})
+        if job_response.status_code == 200:
+            return job_response.json()['completed']
+        else:
+            return None
+
+    def job_progress(self, job_id):
+        """
+        Status of `job_id` and its finished years in one request. Hosts
+        without the progress endpoint are asked for each separately.
+
+        returns: dictionary with 'YES', 'NO' or 'FAIL' under 'status' and the
+                 indices of the finished years, or None if the worker does
+                 not track the job's years, under 'years'
+        """
+        result_url = "http://{hn}/dropq_job_progress".format(
+            hn=self.host_for(job_id))
+        job_response = self.remote_job_progress(
+            result_url, params={'job_id': job_id})
+        if job_response.status_code == 200:
+            return job_response.json()
+        status = self.results_ready(job_id)
+        years = self.completed_years(job_id) if status == 'NO' else None
+        return {'status': status, 'years': years}
+
+    def get_year_results(self, job_id, index):
+        """
+        returns: outputs for the year at position `index` of `job_id`, or
+                 None if that year is not available
+        """
+        result_url = "http://{hn}/dropq_get_year_result".format(
+            hn=self.host_for(job_id))
+        job_response = self.remote_retrieve_year_results(
+            result_url, params={'job_id': job_id, 'index': index})
+        if job_response.status_code == 200:
+            return job_response.json()['outputs']
+        else:
+            return None
+
     def _get_results_base(self, job_id, job_failure=False):
-        result_url = "http://{hn}/dropq_get_result".format(hn=WORKER_HN)
+        result_url = "http://{hn}/dropq_get_result".format(
+            hn=self.host_for(job_id))
         job_response = self.remote_retrieve_results(
             result_url,
             params={'job_id': job_id}
@@ -118,8 +382,8 @@ class Compute(object):
                 if job_failure:
                     return job_response.text
                 else:
-                    return job_response.json()
-            except ValueError:
+                    return decode_results(job_response)
+            except (ValueError, msgpack.UnpackException):
                 # Got back a bad response. Get the text and re-raise
                 msg = 'PROBLEM WITH RESPONSE. TEXT RECEIVED: {}'
                 raise ValueError(msg)
@@ -133,3 +397,108 @@ class Compute(object):
         ans = self._get_results_base(job_id, job_failure=job_failure)
 
         return ans
+
+    def _bulk_batches(self, job_ids):
+        """
+        Group `job_ids` by host in batches that fit in a bulk request. Jobs
+        whose host this process does not know are sent to every host rather
+        than looking up the host of each job; hosts report jobs that they do
+        not own as pending.
+
+        returns: generator of (host, list of job ids)
+        """
+        by_host = OrderedDict()
+        unknown = []
+        for job_id in job_ids:
+            host = self.hosts.owner(str(job_id))
+            if host is None:
+                unknown.append(str(job_id))
+            else:
+                by_host.setdefault(host, []).append(str(job_id))
+        if unknown:
+            hosts = (self.hosts.hosts if len(self.hosts) == 1
+                     else self.hosts.available(self.transport))
+            for host in hosts:
+                by_host.setdefault(host, []).extend(unknown)
+        for host, ids in by_host.items():
+            for start in range(0, len(ids), MAX_BULK_JOBS):
+                yield host, ids[start:start + MAX_BULK_JOBS]
+
+    def results_ready_many(self, job_ids):
+        """
+        Bulk version of `results_ready` that asks each host about all of its
+        jobs at once. Hosts without the bulk endpoint are asked about each
+        job.
+
+        returns: job id -> 'YES', 'NO' or 'FAIL'
+        """
+        statuses = {}
+        for host, batch in self._bulk_batches(job_ids):
+            result_url = "http://{hn}/dropq_query_results".format(hn=host)
+            job_response = self.remote_bulk_results_ready(
+                result_url, params={'job_id': batch})
+            if job_response.status_code == 200:
+                answers = job_response.json()
+            else:
+                answers = {job_id: self.results_ready(job_id)
+                           for job_id in batch
+                           if statuses.get(job_id, 'NO') == 'NO'}
+            for job_id, status in answers.items():
+                # only the host that owns a job knows that it is done
+                if status != 'NO':
+                    self.hosts.assign(job_id, host)
+                if statuses.get(job_id, 'NO') == 'NO':
+                    statuses[job_id] = status
+        return statuses
+
+    def get_results_many(self, job_ids):
+        """
+        Bulk version of `get_results`. Hosts may hold back some of the
+        finished jobs to keep their responses small; those are pending until
+        the next call.
+
+        returns: dictionary with the results of the finished jobs by job id
+                 under 'results', the error messages of the failed jobs under
+                 'failed' and the ids of the jobs that are not done under
+                 'pending'
+        """
+        results, failed = {}, {}
+        for host, batch in self._bulk_batches(job_ids):
+            result_url = "http://{hn}/dropq_get_results".format(hn=host)
+            job_response = self.remote_bulk_retrieve_results(
+                result_url, params={'job_id': batch})
+            if job_response.status_code == 200:
+                data = decode_results(job_response)
+            else:
+                data = {'results': {}, 'failed': {}}
+                for job_id, status in self.results_ready_many(batch).items():
+                    if status == 'YES':
+                        data['results'][job_id] = self.get_results(job_id)
+                    elif status == 'FAIL':
+                        data['failed'][job_id] = self.get_results(
+                            job_id, job_failure=True)
+            for job_id in list(data['results']) + list(data['failed']):
+                self.hosts.assign(job_id, host)
+            results.update(data['results'])
+            failed.update(data['failed'])
+        pending = [job_id for job_id in OrderedDict.fromkeys(
+                   str(job_id) for job_id in job_ids)
+                   if job_id not in results and job_id not in failed]
+        return {'results': results, 'failed': failed, 'pending': pending}
+
+    def forget_results(self, job_ids):
+        """
+        Have the hosts delete the results of finished jobs that have been
+        saved. Hosts without the bulk endpoint keep the results until they
+        expire.
+
+        returns: ids of the jobs whose results were deleted
+        """
+        forgotten = []
+        for host, batch in self._bulk_batches(job_ids):
+            result_url = "http://{hn}/dropq_forget_results".format(hn=host)
+            job_response = self.remote_bulk_forget_results(
+                result_url, params={'job_id': batch})
+            if job_response.status_code == 200:
+                forgotten += job_response.json()['forgotten']
+        return forgotten
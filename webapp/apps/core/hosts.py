@@ -0,0 +1,100 @@
+"""
+Pool of distributed API hosts that `Compute` submits jobs to.
+
+New jobs go to the available host that reported the shortest queue when it
+last accepted a job. The workers have a queue per kind of job, so queue
+lengths are tracked per lane, e.g. per submission endpoint. A host is only
+told about its queue when it accepts a job, so reports expire: otherwise a
+host that once reported a long queue would not be picked again until the
+others had longer ones. The host that
+accepted a job is remembered so that its status and results are requested
+from the same host.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+# Number of job to host assignments remembered per process. Older jobs are
+# looked up by asking the hosts.
+MAX_REMEMBERED_JOBS = 10000
+# How long a reported queue length is trusted. Hosts whose reports are older
+# count as idle.
+QUEUE_REPORT_TTL_IN_SECONDS = float(
+    os.environ.get('QUEUE_REPORT_TTL_IN_SECONDS', 60))
+
+
+def parse_hosts(hosts):
+    """
+    returns: list of the host names in a comma separated string
+    """
+    return [host.strip() for host in (hosts or '').split(',')
+            if host.strip()]
+
+
+class HostPool(object):
+
+    def __init__(self, hosts, report_ttl=QUEUE_REPORT_TTL_IN_SECONDS):
+        # keep a single unconfigured host so that URLs are built the same
+        # way as before hosts could be pooled
+        self.hosts = list(hosts) or [None]
+        self.report_ttl = report_ttl
+        # (lane, host) -> (queue length, time reported)
+        self._qlengths = {}
+        self._owners = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def available(self, transport):
+        return [host for host in self.hosts
+                if transport.is_available(str(host))]
+
+    def choose(self, transport, exclude=(), lane=None):
+        """
+        Pick the least loaded available host, preferring hosts that are not
+        in `exclude`. Ties are broken randomly so that idle hosts share the
+        load.
+
+        returns: host name or None if every host is unavailable
+        """
+        available = self.available(transport)
+        if not available:
+            return None
+        candidates = [host for host in available if host not in exclude]
+        if not candidates:
+            candidates = available
+        with self._lock:
+            qlengths = {host: self._qlength(host, lane)
+                        for host in candidates}
+        shortest = min(qlengths.values())
+        return random.choice([host for host in candidates
+                              if qlengths[host] == shortest])
+
+    def _qlength(self, host, lane):
+        qlength, reported_at = self._qlengths.get((lane, host), (0, 0))
+        if time.time() - reported_at > self.report_ttl:
+            return 0
+        return qlength
+
+    def report(self, host, qlength, lane=None):
+        with self._lock:
+            self._qlengths[(lane, host)] = (qlength, time.time())
+
+    def assign(self, job_id, host):
+        with self._lock:
+            self._owners[str(job_id)] = host
+            self._owners.move_to_end(str(job_id))
+            while len(self._owners) > MAX_REMEMBERED_JOBS:
+                self._owners.popitem(last=False)
+
+    def owner(self, job_id):
+        """
+        returns: the host that accepted `job_id` or None if it is not known
+                 to this process
+        """
+        with self._lock:
+            return self._owners.get(str(job_id))
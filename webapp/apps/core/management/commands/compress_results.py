@@ -0,0 +1,54 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import CoreRun
+from ....btax.models import BTaxSaveInputs
+
+
+def uncompressed_rows():
+    """
+    returns: (model, queryset of the rows with results stored uncompressed,
+             fields that compressing a row changes) for each model with
+             results
+    """
+    for model in apps.get_models():
+        if issubclass(model, CoreRun):
+            rows = (model.objects.with_results()
+                    .filter(packed_results__isnull=True)
+                    .exclude(outputs__isnull=True,
+                             aggr_outputs__isnull=True))
+            yield model, rows, ['packed_results', 'outputs', 'aggr_outputs']
+    rows = BTaxSaveInputs.objects.filter(packed_tax_result__isnull=True,
+                                         tax_result__isnull=False)
+    yield BTaxSaveInputs, rows, ['packed_tax_result', 'tax_result']
+
+
+class Command(BaseCommand):
+    help = ("Compress the results of runs that were stored before "
+            "COMPRESS_RESULTS was set")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='rows to compress per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, rows, fields in uncompressed_rows():
+            pks = list(rows.values_list('pk', flat=True))
+            compressed = 0
+            for start in range(0, len(pks), batch_size):
+                with transaction.atomic():
+                    batch = rows.filter(pk__in=pks[start:start + batch_size])
+                    for row in batch.select_for_update():
+                        try:
+                            if not row.compress_results():
+                                continue
+                        except ValueError as e:
+                            self.stderr.write('skipping {0} {1}: {2}'.format(
+                                model.__name__, row.pk, e))
+                            continue
+                        row.save(update_fields=fields)
+                        compressed += 1
+            self.stdout.write('compressed {0} {1} rows'.format(
+                compressed, model.__name__))
@@ -0,0 +1,116 @@
+import datetime
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from requests.exceptions import RequestException
+
+from ...compute import Compute, JobFailError, MAX_BULK_JOBS
+from ...models import CoreRun
+from ....btax.compute import DropqComputeBtax
+from ....btax.models import BTaxSaveInputs, BTaxOutputUrl
+
+
+def store_run(row, results, failure):
+    if results is not None:
+        row.store_results(results)
+    else:
+        row.store_failure(failure)
+    row.save()
+
+
+def store_btax(row, results, failure):
+    # failed B-Tax runs are not saved; their page asks the workers again
+    if results is not None:
+        row.set_tax_result(results)
+        row.creation_date = timezone.now()
+        row.save()
+
+
+def unfinished(since):
+    """
+    returns: (model, queryset of the runs submitted after `since` that are
+             waiting for results, function that saves a result to a run,
+             compute object that talks to the run's workers) for each kind of
+             run
+    """
+    for model in apps.get_models():
+        if issubclass(model, CoreRun):
+            rows = model.objects.with_has_results().filter(
+                has_results=False, error_text__isnull=True,
+                job_id__isnull=False, exp_comp_datetime__gte=since)
+            yield model, rows, store_run, Compute()
+    recent = BTaxOutputUrl.objects.filter(
+        exp_comp_datetime__gte=since).values('unique_inputs')
+    rows = BTaxSaveInputs.objects.filter(
+        tax_result__isnull=True, packed_tax_result__isnull=True,
+        job_id__isnull=False, pk__in=recent)
+    yield BTaxSaveInputs, rows, store_btax, DropqComputeBtax()
+
+
+class Command(BaseCommand):
+    help = ("Save the results of finished runs that nobody has looked at "
+            "yet and delete them from the workers")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=24,
+                            help=('only look at runs submitted this recently; '
+                                  'older results have expired'))
+        parser.add_argument('--batch-size', type=int, default=MAX_BULK_JOBS,
+                            help='jobs to fetch and save at a time')
+        parser.add_argument('--keep-results', action='store_true',
+                            help='do not delete saved results from the workers')
+        parser.add_argument('--every', type=float, default=None,
+                            help='harvest again every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            since = timezone.now() - datetime.timedelta(
+                hours=options['max_age_hours'])
+            for model, rows, store, compute in unfinished(since):
+                saved = self.harvest(rows, store, compute,
+                                     options['batch_size'],
+                                     not options['keep_results'])
+                self.stdout.write('saved {0} {1} results'.format(
+                    saved, model.__name__))
+            if options['every'] is None:
+                break
+            time.sleep(options['every'])
+
+    def harvest(self, rows, store, compute, batch_size, forget):
+        """
+        Fetch the results of `rows` in bulk and save each batch in a
+        transaction
+
+        returns: number of rows saved
+        """
+        job_ids = list(OrderedDict.fromkeys(
+            str(job_id) for job_id in rows.values_list('job_id', flat=True)))
+        saved = 0
+        for start in range(0, len(job_ids), batch_size):
+            batch = job_ids[start:start + batch_size]
+            try:
+                fetched = compute.get_results_many(batch)
+            except (RequestException, JobFailError, ValueError) as e:
+                self.stderr.write('could not fetch results: {}'.format(e))
+                continue
+            done = list(fetched['results']) + list(fetched['failed'])
+            if not done:
+                continue
+            with transaction.atomic():
+                # looked up again by job id to include runs that were handed
+                # one of these jobs after the batch was listed
+                for row in rows.filter(job_id__in=done).select_for_update():
+                    job_id = str(row.job_id)
+                    store(row, fetched['results'].get(job_id),
+                          fetched['failed'].get(job_id))
+                    saved += 1
+            if forget:
+                try:
+                    compute.forget_results(list(fetched['results']))
+                except RequestException as e:
+                    self.stderr.write('could not delete results: {}'.format(e))
+        return saved
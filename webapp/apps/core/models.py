@@ -3,6 +3,7 @@ from django.contrib.postgres.fields import JSONField
 from django.core.validators import validate_comma_separated_integer_list
 from django.contrib.auth.models import User
 import datetime
+from django.utils import timezone
 from django.utils.timezone import make_aware
 from django.utils.functional import cached_property
 from django.core.urlresolvers import reverse
@@ -10,6 +11,8 @@ import uuid
 from dataclasses import dataclass, field
 from typing import List, Union
 
+from . import results as packing
+
 
 class CoreInputs(models.Model):
     raw_gui_field_inputs = JSONField(default=None, blank=True, null=True)
@@ -41,11 +44,61 @@ class CoreInputs(models.Model):
         abstract = True
 
 
+# Columns holding the results of a run. They can be megabytes large and are
+# only needed to show or download the results.
+RESULT_FIELDS = ('outputs', 'aggr_outputs', 'partial_outputs',
+                 'packed_results')
+# Results that are stored in packed_results when they are compressed
+PACKED_FIELDS = ('outputs', 'aggr_outputs')
+
+
+class CoreRunQuerySet(models.QuerySet):
+
+    def without_results(self):
+        return self.defer(*RESULT_FIELDS)
+
+    def with_results(self):
+        return self.defer(None)
+
+    def only(self, *fields):
+        # only() drops the fields that were deferred before from the fields
+        # to load. Model.refresh_from_db loads deferred fields with only()
+        # on the default manager, so start over from a queryset that loads
+        # every field.
+        return super(CoreRunQuerySet, self.with_results()).only(*fields)
+
+    def with_has_results(self):
+        """
+        Annotate whether each run has stored results so that the results
+        do not have to be loaded to find out
+        """
+        return self.annotate(has_results=models.Case(
+            models.When(models.Q(outputs__isnull=False) |
+                        models.Q(aggr_outputs__isnull=False) |
+                        models.Q(packed_results__isnull=False),
+                        then=models.Value(True)),
+            default=models.Value(False),
+            output_field=models.BooleanField()))
+
+
+class CoreRunManager(models.Manager.from_queryset(CoreRunQuerySet)):
+    """
+    Leaves the result columns out of queries. They are loaded when they are
+    first accessed or up front with `with_results`.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().without_results()
+
+
 class CoreRun(models.Model):
     # Subclasses must implement:
     # inputs = models.OneToOneField(CoreInputs)
     outputs = JSONField(default=None, blank=True, null=True)
     aggr_outputs = JSONField(default=None, blank=True, null=True)
+    # Outputs of the years that have finished while the run is in progress,
+    # keyed by the year's position in the run
+    partial_outputs = JSONField(default=None, blank=True, null=True)
     uuid = models.UUIDField(
         default=uuid.uuid1,
         editable=False,
@@ -67,6 +120,81 @@ class CoreRun(models.Model):
                                      max_length=50)
     webapp_vers = models.CharField(blank=True, default=None, null=True,
                                    max_length=50)
+    # outputs and aggr_outputs compressed, see core.results
+    packed_results = models.BinaryField(default=None, blank=True, null=True)
+
+    objects = CoreRunManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        packed = instance.__dict__.get('packed_results')
+        if packed is not None:
+            results = packing.unpack(packed)
+            for name in PACKED_FIELDS:
+                if name in field_names:
+                    instance.__dict__[name] = results[name]
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # compressed results are read along with the fields they replace
+        if fields is not None and set(fields) & set(PACKED_FIELDS):
+            fields = list(set(fields) | {'packed_results'})
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+
+    def compress_results(self):
+        """
+        Move outputs and aggr_outputs into packed_results
+
+        returns: whether there were results to compress
+        """
+        results = {name: getattr(self, name) for name in PACKED_FIELDS}
+        if all(value is None for value in results.values()):
+            return False
+        self.packed_results = packing.pack(results)
+        for name in PACKED_FIELDS:
+            setattr(self, name, None)
+        return True
+
+    def store_results(self, results):
+        """
+        Set the results returned by the workers. The caller saves the run.
+        """
+        self.outputs = results['outputs']
+        self.aggr_outputs = results['aggr_outputs']
+        self.partial_outputs = None
+        self.creation_date = timezone.now()
+
+    def store_failure(self, error_msg):
+        """
+        Set the error of a failed run from the traceback returned by the
+        workers. The caller saves the run.
+        """
+        if not error_msg:
+            error_msg = ("Error: stack trace for this error is "
+                         "unavailable")
+        val_err_idx = error_msg.rfind("Error")
+        self.error_text = error_msg[val_err_idx:].replace(" ", "&nbsp;")
+
+    def save(self, *args, **kwargs):
+        deferred = self.get_deferred_fields()
+        if (kwargs.get('update_fields') is not None or
+                set(PACKED_FIELDS) & deferred):
+            return super().save(*args, **kwargs)
+        if not packing.COMPRESS_RESULTS:
+            # the results are stored as they are loaded
+            if 'packed_results' not in deferred:
+                self.packed_results = None
+            return super().save(*args, **kwargs)
+        results = {name: getattr(self, name) for name in PACKED_FIELDS}
+        if not self.compress_results():
+            return super().save(*args, **kwargs)
+        # keep the results usable after saving them compressed
+        try:
+            return super().save(*args, **kwargs)
+        finally:
+            for name, value in results.items():
+                setattr(self, name, value)
 
     def get_absolute_url(self):
         raise NotImplementedError()
@@ -0,0 +1,46 @@
+"""
+Compressed storage of run results.
+
+The result tables of a run are stored as JSON by default, which makes them
+the largest values in the database. With COMPRESS_RESULTS set, they are
+stored as zlib compressed msgpack instead. The rendered HTML and CSV text of
+the tables compresses to a small fraction of its size. Rows stored either
+way are read transparently, and the `compress_results` management command
+converts the rows that were stored as JSON.
+"""
+import os
+import zlib
+
+import msgpack
+
+
+COMPRESS_RESULTS = bool(os.environ.get('COMPRESS_RESULTS', ''))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# Bumped when the layout of the packed values changes
+PACKED_FORMAT = 1
+
+
+def pack(results):
+    """
+    results: JSON serializable object
+
+    returns: compressed bytes
+    """
+    packed = msgpack.dumps({'format': PACKED_FORMAT, 'results': results},
+                           use_bin_type=True)
+    return zlib.compress(packed, COMPRESSION_LEVEL)
+
+
+def unpack(packed):
+    """
+    packed: bytes returned by `pack`, or a memoryview of them as read from a
+        binary column
+
+    returns: the object that was packed
+    """
+    data = msgpack.loads(zlib.decompress(bytes(packed)), raw=False,
+                         use_list=True)
+    if data['format'] != PACKED_FORMAT:
+        raise ValueError('unknown packed results format {}'.format(
+            data['format']))
+    return data['results']
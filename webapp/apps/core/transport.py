@@ -0,0 +1,183 @@
+"""
+HTTP transport used by `Compute` to talk to the distributed API.
+
+All requests share one `requests.Session` so that connections to the worker
+hosts are pooled and kept alive. Each host has a circuit breaker: after
+CIRCUIT_FAILURE_THRESHOLD consecutive connection errors or 5xx responses
+requests to the host fail immediately with `CircuitOpenError` until
+CIRCUIT_RESET_IN_SECONDS have passed, after which a single trial request is
+let through. Timings are kept per endpoint.
+"""
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+
+POOL_SIZE = int(os.environ.get('COMPUTE_POOL_SIZE', '10'))
+BACKOFF_BASE_IN_SECONDS = float(
+    os.environ.get('COMPUTE_BACKOFF_BASE_IN_SECONDS', '0.1'))
+BACKOFF_CAP_IN_SECONDS = float(
+    os.environ.get('COMPUTE_BACKOFF_CAP_IN_SECONDS', '2.0'))
+CIRCUIT_FAILURE_THRESHOLD = int(
+    os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_IN_SECONDS = float(
+    os.environ.get('CIRCUIT_RESET_IN_SECONDS', '30'))
+
+
+class CircuitOpenError(RequestException):
+    '''Raised instead of sending a request to a host that is down'''
+
+
+def backoff(attempt, base=BACKOFF_BASE_IN_SECONDS,
+            cap=BACKOFF_CAP_IN_SECONDS):
+    """
+    Exponential backoff with full jitter
+
+    returns: number of seconds to wait before retry number `attempt`
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_in_seconds=CIRCUIT_RESET_IN_SECONDS):
+        self.threshold = threshold
+        self.reset_in_seconds = reset_in_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    @property
+    def is_ready(self):
+        """
+        Whether `allow` would let a request through
+        """
+        return (self.opened_at is None or
+                time.time() - self.opened_at >= self.reset_in_seconds)
+
+    def allow(self):
+        """
+        Closed circuits let every request through. Open ones let a single
+        trial request through once the reset time has passed.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_in_seconds:
+                # half open: restart the clock so that only this request
+                # goes through until it succeeds
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print('circuit opened after', self.failures, 'failures')
+                self.opened_at = time.time()
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self):
+        mean = self.total_seconds / self.count if self.count else 0.0
+        return {'count': self.count, 'errors': self.errors,
+                'mean_seconds': mean, 'max_seconds': self.max_seconds}
+
+
+class Transport(object):
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+            return self._breakers[host]
+
+    def is_available(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+        return breaker is None or breaker.is_ready
+
+    def _record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            stats.record(seconds, error=error)
+
+    def stats(self):
+        """
+        returns: request count, error count and mean and maximum duration
+                 per endpoint
+        """
+        with self._lock:
+            return {endpoint: stats.as_dict()
+                    for endpoint, stats in self._stats.items()}
+
+    def request(self, method, url, **kwargs):
+        parsed = urlparse(url)
+        breaker = self.breaker(parsed.netloc)
+        if not breaker.allow():
+            raise CircuitOpenError(
+                '{} is unavailable'.format(parsed.netloc))
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except RequestException:
+            self._record(parsed.path, time.time() - start, error=True)
+            breaker.record_failure()
+            raise
+        error = response.status_code >= 500
+        self._record(parsed.path, time.time() - start, error=error)
+        if error:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+transport = Transport()
@@ -2,17 +2,42 @@ from django.utils import timezone
 from django.db import models
 from .models import CoreRun
 from .compute import Compute, JobFailError
+from requests.exceptions import RequestException
 from django.views.generic.base import View
 from django.views.generic.detail import SingleObjectMixin, DetailView
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, Http404, JsonResponse
+from django.http import (HttpResponse, Http404, JsonResponse,
+                         HttpResponseNotModified, StreamingHttpResponse,
+                         FileResponse)
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+import hashlib
 import itertools
-from io import BytesIO
-from zipfile import ZipFile
+import os
+import shutil
+import tempfile
+from zipfile import ZipFile, ZIP_DEFLATED
 import traceback
 import json
 
 
+# Change when the markup of the result tables changes so that pages rendered
+# with the old markup are no longer served
+RESULTS_TEMPLATE_VERSION = '1'
+# Results never change once they are stored, so the rendered tables are kept
+# until they are evicted. The pages embed the visitor's CSRF token, so only
+# the browser may keep them, and only briefly; after that it revalidates them
+# with their ETag and gets a 304 while the results are unchanged.
+RESULTS_MAX_AGE_IN_SECONDS = int(
+    os.environ.get('RESULTS_MAX_AGE_IN_SECONDS', 60))
+RESULTS_CACHE_TIMEOUT = int(
+    os.environ.get('RESULTS_CACHE_TIMEOUT', 60 * 60 * 24 * 30))
+
+
 class SuperclassTemplateNameMixin(object):
     """A mixin that adds the templates corresponding to the core as candidates
     if customized ones aren't found in subclasses."""
@@ -53,13 +78,54 @@ class CoreRunDetailView(SuperclassTemplateNameMixin, DetailView):
 
         case 3: query results
           case 3a: all jobs have completed
-          case 3b: not all jobs have completed
+          case 3b: not all jobs have completed; the years that have
+                   finished are saved and shown while waiting
     """
 
     model = CoreRun
     dropq_compute = Compute()
     is_editable = True
     result_header = "Results"
+    results_cache_timeout = RESULTS_CACHE_TIMEOUT
+
+    def results_cache_key(self):
+        """
+        Identifies the rendered result tables of this run. The view class is
+        part of the key since it defines the tags that the tables are
+        filtered by.
+        """
+        return '{0}.{1}:{2}:{3}:{4}'.format(
+            self.__class__.__module__, self.__class__.__name__,
+            self.object.pk, RESULTS_TEMPLATE_VERSION, settings.WEBAPP_VERSION)
+
+    def results_etag(self, request):
+        # the page embeds the CSRF token, so a new token means a new page
+        key = '{0}:{1}:{2}'.format(self.results_cache_key(),
+                                   self.object.creation_date.isoformat(),
+                                   get_token(request))
+        return quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def render_results(self, request, *args, **kwargs):
+        """
+        Render the stored results. Browsers that already have the page are
+        told that it has not changed.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return super().get(self, request, *args, **kwargs)
+        etag = self.results_etag(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = super().get(self, request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True,
+                            max_age=RESULTS_MAX_AGE_IN_SECONDS)
+        return response
+
+    def get_queryset(self):
+        # the result tables are usually served from the cache, so the results
+        # are only loaded when the tables are rendered
+        return super().get_queryset().with_has_results()
 
     def fail(self):
         return render(self.request, 'core/failed.html',
@@ -67,38 +133,36 @@ class CoreRunDetailView(SuperclassTemplateNameMixin, DetailView):
 
     def dispatch(self, request, *args, **kwargs):
         self.object = self.get_object()
-        if self.object.outputs or self.object.aggr_outputs:
-            return super().get(self, request, *args, **kwargs)
+        if request.method == 'GET' and 'years' in request.GET:
+            return self.render_partial_outputs(request)
+        if self.object.has_results:
+            return self.render_results(request, *args, **kwargs)
         elif self.object.error_text is not None:
             return self.fail()
         else:
             job_id = str(self.object.job_id)
             try:
-                job_ready = self.dropq_compute.results_ready(job_id)
+                progress = self.dropq_compute.job_progress(job_id)
             except JobFailError as jfe:
                 self.object.error_text = ""
                 self.object.save()
                 return self.fail()
+            job_ready = progress['status']
             if job_ready == 'FAIL':
                 error_msg = self.dropq_compute.get_results(job_id,
                                                            job_failure=True)
-                if not error_msg:
-                    error_msg = ("Error: stack trace for this error is "
-                                 "unavailable")
-                val_err_idx = error_msg.rfind("Error")
-                error_contents = error_msg[val_err_idx:].replace(" ", "&nbsp;")
-                self.object.error_text = error_contents
+                self.object.store_failure(error_msg)
                 self.object.save()
                 return self.fail()
 
             if job_ready == 'YES':
                 results = self.dropq_compute.get_results(job_id)
-                self.object.outputs = results['outputs']
-                self.object.aggr_outputs = results['aggr_outputs']
-                self.object.creation_date = timezone.now()
+                self.object.store_results(results)
                 self.object.save()
-                return super().get(self, request, *args, **kwargs)
+                return self.render_results(request, *args, **kwargs)
             else:
+                years_ready = self.update_partial_outputs(
+                    job_id, progress['years'])
                 if request.method == 'POST':
                     # if not ready yet, insert number of minutes remaining
                     exp_comp_dt = self.object.exp_comp_datetime
@@ -108,21 +172,72 @@ class CoreRunDetailView(SuperclassTemplateNameMixin, DetailView):
                     exp_num_minutes = round(exp_num_minutes, 2)
                     exp_num_minutes = (exp_num_minutes if exp_num_minutes > 0
                                        else 0)
+                    data = {'eta': exp_num_minutes,
+                            'years_ready': years_ready}
                     if exp_num_minutes > 0:
-                        return JsonResponse({'eta': exp_num_minutes},
-                                            status=202)
+                        return JsonResponse(data, status=202)
                     else:
-                        return JsonResponse({'eta': exp_num_minutes},
-                                            status=200)
+                        return JsonResponse(data, status=200)
 
                 else:
-                    context = {'eta': '100'}
+                    context = {'eta': '100',
+                               'years_ready': years_ready,
+                               'partial_outputs': self.partial_outputs(
+                                   years_ready)}
                     return render(
                         request,
                         'core/not_ready.html',
                         context
                     )
 
+    def update_partial_outputs(self, job_id, completed):
+        """
+        Save the outputs of the years in `completed` that have not been saved
+        yet. Partial results are best effort: if the worker does not track
+        the job's years or cannot be reached, the saved years are kept as
+        they are.
+
+        returns: indices of the years saved so far
+        """
+        partial = dict(self.object.partial_outputs or {})
+        try:
+            for index in completed or []:
+                if str(index) in partial:
+                    continue
+                outputs = self.dropq_compute.get_year_results(job_id, index)
+                if outputs is not None:
+                    partial[str(index)] = outputs
+        except (RequestException, ValueError) as e:
+            print('could not update partial outputs', job_id, e)
+        if len(partial) > len(self.object.partial_outputs or {}):
+            self.object.partial_outputs = partial
+            self.object.save()
+        return sorted(int(index) for index in partial)
+
+    def partial_outputs(self, years):
+        """
+        returns: (key, output) for the saved outputs of `years` in the order
+                 in which the years were submitted. The key tells the
+                 outputs apart on the waiting page.
+        """
+        partial = self.object.partial_outputs or {}
+        return [('{0}-{1}'.format(index, i), output)
+                for index in sorted(years) if str(index) in partial
+                for i, output in enumerate(partial[str(index)])]
+
+    def render_partial_outputs(self, request):
+        """
+        Render the tables of the saved years listed in the `years` argument
+        for the waiting page to insert. Nothing is asked of the workers.
+        """
+        try:
+            years = [int(index) for index in
+                     request.GET['years'].split(',') if index]
+        except ValueError:
+            return HttpResponse('years must be integers', status=400)
+        return render(request, 'core/partial_outputs.html',
+                      {'partial_outputs': self.partial_outputs(years)})
+
     def is_from_file(self):
         if hasattr(self.object.inputs, 'raw_gui_field_inputs'):
             return not self.object.inputs.raw_gui_field_inputs
@@ -136,33 +251,131 @@ class CoreRunDetailView(SuperclassTemplateNameMixin, DetailView):
             return ''
 
 
+class ChunkWriter(object):
+    """
+    Write-only file that hands out what was written to it in chunks. ZipFile
+    writes archives to files that cannot seek without going back to patch
+    the entries' headers.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_chunks(files):
+    """
+    Compress `files` into a ZIP archive one file at a time
+
+    files: iterable of (file name, text) pairs
+
+    returns: generator of the bytes of the archive
+    """
+    out = ChunkWriter()
+    with ZipFile(out, mode='w', compression=ZIP_DEFLATED) as z:
+        for filename, text in files:
+            z.writestr(filename, text)
+            yield out.take()
+    yield out.take()
+
+
+def store_archive(archive, name):
+    """
+    Store the open file `archive` under `name` in the default storage. Files
+    on disk are written under a temporary name and then moved into place, so
+    that concurrent downloads never serve a partly written archive. The
+    archives of a run are identical, so concurrent copies replace each other
+    or are discarded rather than kept under another name.
+    """
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        saved = default_storage.save(name, File(archive))
+        if saved != name:
+            default_storage.delete(saved)
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.part',
+                                     delete=False) as part:
+        try:
+            shutil.copyfileobj(archive, part)
+        except BaseException:
+            os.remove(part.name)
+            raise
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        os.chmod(part.name, settings.FILE_UPLOAD_PERMISSIONS)
+    os.replace(part.name, path)
+
+
 class CoreRunDownloadView(SingleObjectMixin, View):
+    """
+    Serves the downloadable tables of a run as a ZIP archive. The archive is
+    streamed while it is built on the first download and stored so that
+    later downloads are served from storage.
+    """
     model = CoreRun
 
+    def get_queryset(self):
+        # stored archives are served without loading the results
+        return super().get_queryset().with_has_results()
+
+    def archive_name(self):
+        return 'archives/{0}/{1}/{2}.zip'.format(
+            self.object._meta.app_label, self.object._meta.model_name,
+            self.object.pk)
+
+    def stream_and_store(self, files, name):
+        """
+        Stream the archive of `files` while copying it to a temporary file
+        that is moved to storage once the whole archive was sent
+        """
+        with tempfile.TemporaryFile() as copy:
+            for chunk in zip_chunks(files):
+                copy.write(chunk)
+                yield chunk
+            copy.seek(0)
+            try:
+                store_archive(copy, name)
+            except (IOError, OSError) as e:
+                print('could not store archive', name, e)
+
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
 
-        if (not (self.object.outputs or self.object.aggr_outputs) or
-           self.object.error_text):
+        if not self.object.has_results or self.object.error_text:
             return redirect(self.object)
 
-        try:
-            downloadables = list(itertools.chain.from_iterable(
-                output['downloadable'] for output in self.object.outputs))
-            downloadables += list(itertools.chain.from_iterable(
-                output['downloadable'] for output in self.object.aggr_outputs))
-        except KeyError:
-            raise Http404
-        if not downloadables:
-            raise Http404
-
-        s = BytesIO()
-        z = ZipFile(s, mode='w')
-        for i in downloadables:
-            z.writestr(i['filename'], i['text'])
-        z.close()
-        resp = HttpResponse(s.getvalue(), content_type="application/zip")
+        name = self.archive_name()
+        if default_storage.exists(name):
+            resp = FileResponse(default_storage.open(name),
+                                content_type="application/zip")
+        else:
+            try:
+                downloadables = list(itertools.chain.from_iterable(
+                    output['downloadable'] for output in self.object.outputs))
+                downloadables += list(itertools.chain.from_iterable(
+                    output['downloadable']
+                    for output in self.object.aggr_outputs))
+            except KeyError:
+                raise Http404
+            if not downloadables:
+                raise Http404
+
+            files = ((i['filename'], i['text']) for i in downloadables)
+            resp = StreamingHttpResponse(self.stream_and_store(files, name),
+                                         content_type="application/zip")
         resp['Content-Disposition'] = 'attachment; filename={}'.format(
             self.object.zip_filename())
-        s.close()
         return resp
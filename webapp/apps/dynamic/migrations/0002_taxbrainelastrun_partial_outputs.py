@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dynamic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxbrainelastrun',
+            name='partial_outputs',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
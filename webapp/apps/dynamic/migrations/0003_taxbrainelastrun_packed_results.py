@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dynamic', '0002_taxbrainelastrun_partial_outputs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxbrainelastrun',
+            name='packed_results',
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+    ]
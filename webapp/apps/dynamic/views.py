@@ -20,6 +20,7 @@ from ..taxbrain.helpers import json_int_key_encode
 from ..core.views import CoreRunDetailView, CoreRunDownloadView
 from ..core.models import Tag, TagOption
 
+from ..core.compute import ELASTIC_URL
 from ..taxbrain.submit_data import JOB_PROC_TIME_IN_SECONDS
 
 from .helpers import default_elasticity_parameters
@@ -81,7 +82,8 @@ def dynamic_elasticities(request, pk):
             gdp_elasticity = float(model.elastic_gdp)
 
             # get microsim data
-            outputsurl = TaxBrainRun.objects.get(pk=pk)
+            outputsurl = TaxBrainRun.objects.select_related(
+                'inputs').get(pk=pk)
             model.micro_run = outputsurl
             taxbrain_model = outputsurl.inputs
             model.data_source = taxbrain_model.data_source
@@ -135,7 +137,9 @@ def dynamic_elasticities(request, pk):
 
                 cur_dt = timezone.now()
                 future_offset = datetime.timedelta(
-                    seconds=((2 + max_q_length) * JOB_PROC_TIME_IN_SECONDS))
+                    seconds=dropq_compute.eta_seconds(
+                        submitted_id, ELASTIC_URL, data_list, max_q_length,
+                        JOB_PROC_TIME_IN_SECONDS))
                 expected_completion = cur_dt + future_offset
                 unique_url.exp_comp_datetime = expected_completion
                 unique_url.save()
@@ -178,7 +182,8 @@ def edit_dynamic_elastic(request, pk):
     This view handles the editing of previously compute elasticity of GDP
     dynamic simulation
     """
-    url = get_object_or_404(TaxBrainElastRun, pk=pk)
+    url = get_object_or_404(
+        TaxBrainElastRun.objects.select_related('inputs'), pk=pk)
 
     model = url.inputs
     start_year = model.first_year
@@ -210,7 +215,8 @@ def dynamic_landing(request, pk):
     This view gives a landing page to choose a type of dynamic simulation that
     is linked to the microsim
     """
-    outputsurl = get_object_or_404(TaxBrainRun, pk=pk)
+    outputsurl = get_object_or_404(
+        TaxBrainRun.objects.select_related('inputs'), pk=pk)
     include_ogusa = True
     init_context = {
         'pk': pk,
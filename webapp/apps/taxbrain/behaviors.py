@@ -17,20 +17,17 @@ class Fieldable(models.Model):
     class Meta:
         abstract = True
 
-    def set_fields(self, upstream_objs, nonparam_fields=None):
+    def set_fields(self, default_data, nonparam_fields=None):
         """
         Parse raw fields
             1. Only keep fields that user specifies
             2. Map TB names to TC names
             3. Do more specific type checking--in particular, check if
                field is the type that Tax-Calculator expects from this param
-        """
-        default_data = {}
-        for obj in upstream_objs:
-            dd = obj.default_data(start_year=self.start_year,
-                                                     metadata=True)
-            default_data.update(dd)
 
+        default_data: upstream parameter metadata for the start year, e.g. a
+            `param_index.ParameterIndex`
+        """
         gui_field_inputs, failed_lookups = param_formatters.parse_fields(
             self.raw_gui_field_inputs,
             default_data
@@ -1,16 +1,19 @@
 from django import forms
 from django.forms import ModelForm
-import six
+import copy
+import os
 import json
 
 from ..constants import START_YEAR
+from ..core.caches import BoundedCache
 
 from .models import TaxSaveInputs
-from .helpers import (is_safe, INPUTS_META, bool_like)
+from .helpers import (tokenize_fields, MAX_INPUT_LENGTH, INPUTS_META,
+                      bool_like)
 from .param_displayers import defaults_all
+from .param_index import param_index
 from .param_formatters import (get_default_policy_param,
                                ParameterLookUpException)
-import taxcalc
 
 
 class PolicyBrainForm:
@@ -62,18 +65,20 @@ class PolicyBrainForm:
         malicious input
         """
         fields = self.cleaned_data['raw_gui_field_inputs']
+        tokenized = tokenize_fields(fields)
         for param_name, value in fields.items():
             # make sure the text parses OK
             if param_name == 'data_source':
                 assert value in ('CPS', 'PUF')
-            elif isinstance(value, six.string_types) and len(value) > 0:
-                if not is_safe(value):
+            elif param_name in tokenized:
+                tokens, errors = tokenized[param_name]
+                if errors or len(value) > MAX_INPUT_LENGTH:
                     # Parse Error - we don't recognize what they gave us
                     self.add_error(param_name,
                                    "Unrecognized value: {}".format(value))
                 try:
                     # reverse character is not at the beginning
-                    assert value.find('<') <= 0
+                    assert '<' not in tokens[1:]
                 except AssertionError:
                     self.add_error(
                         param_name,
@@ -140,10 +145,23 @@ class PolicyBrainForm:
         return widgets, labels, update_fields
 
 
-TAXCALC_DEFAULTS = {
-    (int(START_YEAR), True): defaults_all(int(START_YEAR),
-                                          use_puf_not_cps=True)
-}
+# Number of (start year, data source) pairs whose parameters and form fields
+# are kept
+FORM_DEFAULTS_CACHE_SIZE = int(os.environ.get('FORM_DEFAULTS_CACHE_SIZE', 12))
+
+# TaxCalcParam objects by (start year, use_puf_not_cps)
+TAXCALC_DEFAULTS = BoundedCache(defaults_all, FORM_DEFAULTS_CACHE_SIZE)
+
+
+def build_form_fields(start_year, use_puf_not_cps):
+    return PolicyBrainForm.set_form(
+        TAXCALC_DEFAULTS.get((start_year, use_puf_not_cps)))
+
+
+# widgets, labels and fields by (start year, use_puf_not_cps). They are
+# shared by the forms of every request, so each form works on its own
+# copies of the fields.
+FORM_FIELDS = BoundedCache(build_form_fields, FORM_DEFAULTS_CACHE_SIZE)
 
 
 class TaxBrainForm(PolicyBrainForm, ModelForm):
@@ -176,6 +194,8 @@ class TaxBrainForm(PolicyBrainForm, ModelForm):
         # 1. initial is specified in `kwargs` (reform has warning/error msgs)
         # 2. if `instance` is specified and `initial` is added above
         #    (edit parameters page)
+        # fields whose widget shows something else than the default
+        own_fields = {}
         if "initial" in kwargs:
             for k, v in kwargs["initial"].items():
                 if k.endswith("cpi") and v:
@@ -193,7 +213,9 @@ class TaxBrainForm(PolicyBrainForm, ModelForm):
                         None,
                         k
                     )
-                    self.widgets[k].attrs["placeholder"] = django_val
+                    field = copy.deepcopy(self.update_fields[k])
+                    field.widget.attrs["placeholder"] = django_val
+                    own_fields[k] = field
 
             if not hasattr(self, 'cleaned_data'):
                 self.cleaned_data = {'raw_gui_field_inputs': kwargs['initial']}
@@ -202,7 +224,12 @@ class TaxBrainForm(PolicyBrainForm, ModelForm):
 
         # update fields in a similar way as
         # https://www.pydanny.com/overloading-form-fields.html
-        self.fields.update(self.update_fields.copy())
+        # Fields are copied the way Django copies `base_fields` so that
+        # changes made to them while handling a request stay with this form
+        self.fields.update((k, copy.deepcopy(field))
+                           for k, field in self.update_fields.items()
+                           if k not in own_fields)
+        self.fields.update(own_fields)
 
     def clean(self):
         """
@@ -232,13 +259,9 @@ class TaxBrainForm(PolicyBrainForm, ModelForm):
         ModelForm.add_error(self, field, error)
 
     def set_form_data(self, start_year, use_puf_not_cps):
-        defaults_key = (start_year, use_puf_not_cps)
-        if defaults_key not in TAXCALC_DEFAULTS:
-            TAXCALC_DEFAULTS[defaults_key] = defaults_all(
-                start_year, use_puf_not_cps)
-        defaults = TAXCALC_DEFAULTS[defaults_key]
         (self.widgets, self.labels,
-            self.update_fields) = PolicyBrainForm.set_form(defaults)
+            self.update_fields) = FORM_FIELDS.get(
+                (start_year, use_puf_not_cps))
 
     class Meta:
         model = TaxSaveInputs
@@ -247,22 +270,6 @@ class TaxBrainForm(PolicyBrainForm, ModelForm):
         fields = ['first_year', 'data_source', 'raw_gui_field_inputs',
                   'gui_field_inputs']
         start_year = int(START_YEAR)
-        default_policy = taxcalc.Policy.default_data(
-            start_year=int(START_YEAR),
-            metadata=True
-        )
-        default_behv = taxcalc.Behavior.default_data(
-            start_year=int(START_YEAR),
-            metadata=True
-        )
-        default_params = dict(default_policy, **default_behv)
-        defaults_key = (start_year, True)
-        if defaults_key not in TAXCALC_DEFAULTS:
-            TAXCALC_DEFAULTS[defaults_key] = defaults_all(
-                start_year,
-                use_puf_not_cps=True
-            )
+        default_params = param_index(start_year)
         (widgets, labels,
-            update_fields) = PolicyBrainForm.set_form(
-            TAXCALC_DEFAULTS[defaults_key]
-        )
+            update_fields) = FORM_FIELDS.get((start_year, True))
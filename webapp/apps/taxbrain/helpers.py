@@ -1,21 +1,75 @@
-import pyparsing as pp
 import six
 import re
-import ast
-
-# Grammar for Field inputs
-TRUE = pp.CaselessKeyword('true')
-FALSE = pp.CaselessKeyword('false')
-WILDCARD = pp.Word('*')
-INT_LIT = pp.Word(pp.nums)
-NEG_DASH = pp.Word('-', exact=1)
-FLOAT_LIT = pp.Word(pp.nums + '.')
-DEC_POINT = pp.Word('.', exact=1)
-FLOAT_LIT_FULL = pp.Word(pp.nums + '.' + pp.nums)
-COMMON = pp.Word(",", exact=1)
-REVERSE = pp.Word("<")
-VALUE = WILDCARD | NEG_DASH | FLOAT_LIT_FULL | FLOAT_LIT | INT_LIT
-BOOL = WILDCARD | TRUE | FALSE
+
+# Longest GUI input accepted for a single field
+MAX_INPUT_LENGTH = 100
+
+# Grammar for Field inputs: a comma separated list of numbers, case
+# insensitive booleans, wildcards (*) and reverse operators (<). Numbers are
+# spelled the way Python spells int and float literals, so integers other
+# than zero cannot have leading zeros.
+TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<float>-?(?:(?:\d+\.\d*|\.\d+)(?:e[-+]?\d+)?|\d+e[-+]?\d+))
+      | (?P<int>-?(?:0+|[1-9]\d*))
+      | (?P<true>true)
+      | (?P<false>false)
+      | (?P<wildcard>\*)
+      | (?P<reverse><)
+    )\s*$
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def parse_token(token):
+    """
+    Parse a single GUI input token
+
+    returns: int, float, bool, '*' or '<'
+    raises: ValueError if the token is none of these
+    """
+    match = TOKEN_REGEX.match(token)
+    if match is None:
+        raise ValueError("Unrecognized value: {}".format(token))
+    kind = match.lastgroup
+    if kind == 'float':
+        return float(match.group(kind))
+    elif kind == 'int':
+        return int(match.group(kind))
+    elif kind == 'true':
+        return True
+    elif kind == 'false':
+        return False
+    return match.group(kind)
+
+
+def tokenize(s):
+    """
+    Split a string of comma-separated-values into parsed tokens
+
+    returns:
+        tokens: parsed tokens; tokens that could not be parsed are kept as
+            stripped strings
+        errors: positions of the tokens that could not be parsed
+    """
+    tokens = []
+    errors = []
+    for i, token in enumerate(s.split(',')):
+        try:
+            tokens.append(parse_token(token))
+        except ValueError:
+            tokens.append(token.strip())
+            errors.append(i)
+    return tokens, errors
+
+
+def tokenize_fields(fields):
+    """
+    Tokenize every non-empty string value in `fields`
+
+    returns: dictionary mapping field names to `tokenize` results
+    """
+    return {name: tokenize(value) for name, value in fields.items()
+            if isinstance(value, six.string_types) and value}
 
 
 def is_safe(s):
@@ -32,26 +86,10 @@ def is_safe(s):
     Returns:
         success: whether value is "safe" or not
     """
-    if len(s) > 100:
+    if len(s) > MAX_INPUT_LENGTH:
         return False
-    parsers = [VALUE, BOOL, REVERSE]
-    tokens = s.split(',')
-    success = [False] * len(tokens)
-    for i, token in enumerate(tokens):
-        token_strip = token.strip()
-        for parser in parsers:
-            try:
-                parser.parseString(token_strip)
-                if parser == VALUE:
-                    # make sure `ast.literal_eval` can parse
-                    # throws ValueError or SyntaxError on failure
-                    ast.literal_eval(token_strip)
-            except (pp.ParseException, ValueError, SyntaxError):
-                pass
-            else:
-                success[i] = True
-                break
-    return all(success)
+    _, errors = tokenize(s)
+    return not errors
 
 
 TRUE_REGEX = re.compile('(?i)true')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ...param_index import (ParameterIndex, index_path, save_index,
+                            PARAM_INDEX_DIR)
+from ....constants import START_YEARS
+
+
+class Command(BaseCommand):
+    help = ("Build the Tax-Calculator parameter index for each start year so "
+            "that web processes do not have to")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-year', action='append', dest='years',
+                            help='start year to build (default: all)')
+        parser.add_argument('--directory', default=PARAM_INDEX_DIR,
+                            help='where to save the indexes')
+
+    def handle(self, *args, **options):
+        for start_year in options['years'] or START_YEARS:
+            path = index_path(start_year, directory=options['directory'])
+            save_index(ParameterIndex.build(int(start_year)), path)
+            self.stdout.write('wrote {}'.format(path))
@@ -47,6 +47,32 @@ class MockCompute(Compute):
             mock.register_uri('GET', '/dropq_get_result', text=text)
             return Compute.remote_retrieve_results(self, theurl, params)
 
+    def remote_completed_years(self, theurl, params):
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/dropq_query_years',
+                              text=json.dumps({'completed': [], 'total': 0}))
+            return Compute.remote_completed_years(self, theurl, params)
+
+    def remote_job_progress(self, theurl, params):
+        # answered as by hosts without the progress endpoint, so that the
+        # status and years come from the mocks above
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/dropq_job_progress', status_code=404)
+            return Compute.remote_job_progress(self, theurl, params)
+
+    def remote_retrieve_year_results(self, theurl, params):
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/dropq_get_year_result',
+                              text='not ready', status_code=202)
+            return Compute.remote_retrieve_year_results(self, theurl, params)
+
+    def remote_task_runtimes(self, theurl):
+        # nothing has been measured, so ETAs use the fixed time per job
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/task_runtimes',
+                              text=json.dumps({'tasks': {}, 'queues': {}}))
+            return Compute.remote_task_runtimes(self, theurl)
+
     def reset_count(self):
         """
         reset worker node count
@@ -54,6 +80,31 @@ class MockCompute(Compute):
         self.count = 0
 
 
+class MockPartialCompute(MockCompute):
+    """
+    Report that the first year has finished while the job is still running
+    """
+
+    def remote_completed_years(self, theurl, params):
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/dropq_query_years',
+                              text=json.dumps({'completed': [0], 'total': 2}))
+            return Compute.remote_completed_years(self, theurl, params)
+
+    def remote_retrieve_year_results(self, theurl, params):
+        mock_path = os.path.join(os.path.split(__file__)[0], "tests",
+                                 "distributed_response.json")
+        with open(mock_path, 'r') as f:
+            outputs = json.load(f)['outputs']
+        first_year = outputs[0]['year']
+        text = json.dumps({
+            'index': 0,
+            'outputs': [o for o in outputs if o['year'] == first_year]})
+        with requests_mock.Mocker() as mock:
+            mock.register_uri('GET', '/dropq_get_year_result', text=text)
+            return Compute.remote_retrieve_year_results(self, theurl, params)
+
+
 class MockFailedCompute(MockCompute):
 
     def remote_results_ready(self, theurl, params):
@@ -3,9 +3,8 @@ from django.core.urlresolvers import reverse
 from django.contrib.postgres.fields import ArrayField
 from ..core.models import CoreInputs, CoreRun
 
-import taxcalc
-
 from . import param_formatters
+from .param_index import param_index
 
 from .behaviors import Fieldable, DataSourceable
 
@@ -45,7 +44,7 @@ class TaxSaveInputs(DataSourceable, Fieldable, CoreInputs):
                field is the type that Tax-Calculator expects from this param
             4. Remove errors on undisplayed parameters
         """
-        Fieldable.set_fields(self, [taxcalc.Policy, taxcalc.Behavior],
+        Fieldable.set_fields(self, param_index(self.start_year),
                              nonparam_fields=self.NONPARAM_FIELDS.union(
                                 f.name
                                 for f in CoreInputs._meta.get_fields()))
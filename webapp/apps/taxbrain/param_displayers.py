@@ -1,16 +1,21 @@
-import taxcalc
-
 from .helpers import (
     string_to_float,
     is_string)
 from .param_formatters import MetaParam, parse_value
+from .param_index import param_index
 
 
 class TaxCalcField(object):
     """
     An atomic unit of data for a TaxCalcParam, which can be stored as a field
     Used for both CSV float fields (value column data) and boolean fields (cpi)
+
+    `values` is the column of the parameter's values that belongs to this
+    field and is not copied. Only the default value is formatted up front;
+    `values_by_year` is worked out when asked for.
     """
+    __slots__ = ('id', 'label', 'values', 'param', 'meta_param',
+                 'default_value')
 
     def __init__(
             self,
@@ -24,15 +29,19 @@ class TaxCalcField(object):
         self.label = label
         self.values = values
         self.param = param
+        self.meta_param = meta_param
+        self.default_value = self.format_value(
+            values[first_budget_year - param.start_year])
 
-        self.values_by_year = {}
-        for i, value in enumerate(values):
-            year = param.start_year + i
-            if meta_param is not None:
-                value = parse_value(str(value), meta_param)
-            self.values_by_year[year] = str(value)
+    def format_value(self, value):
+        if self.meta_param is not None:
+            value = parse_value(str(value), self.meta_param)
+        return str(value)
 
-        self.default_value = self.values_by_year[first_budget_year]
+    @property
+    def values_by_year(self):
+        return {self.param.start_year + i: self.format_value(value)
+                for i, value in enumerate(self.values)}
 
 
 class TaxCalcParam(object):
@@ -41,6 +50,9 @@ class TaxCalcParam(object):
     for one of TaxCalc's Parameters
     """
     FORM_HIDDEN_PARAMS = ["widow", "separate", "dependent"]
+    __slots__ = ('tc_id', 'nice_id', 'name', 'info', 'gray_out', 'start_year',
+                 'coming_soon', 'hidden', 'col_fields', 'inflatable',
+                 'cpi_field', 'max', 'min')
 
     def __init__(self, param_id, attributes, first_budget_year,
                  use_puf_not_cps=True):
@@ -204,11 +216,7 @@ def nested_form_parameters(budget_year=2017, use_puf_not_cps=True,
                            defaults=None):
     # defaults are None unless we are testing
     if defaults is None:
-        defaults_pol = taxcalc.Policy.default_data(metadata=True,
-                                                   start_year=budget_year)
-        defaults_behv = taxcalc.Behavior.default_data(metadata=True,
-                                                      start_year=budget_year)
-        defaults = dict(defaults_pol, **defaults_behv)
+        defaults = param_index(budget_year)
 
     groups = parse_top_level(defaults)
     for x in groups:
@@ -220,8 +228,7 @@ def nested_form_parameters(budget_year=2017, use_puf_not_cps=True,
 
 
 def default_behavior(first_budget_year):
-    behv_defaults = taxcalc.Behavior.default_data(metadata=True,
-                                                  start_year=first_budget_year)
+    behv_defaults = param_index(first_budget_year).behavior
 
     default_taxcalc_params = {}
     for k, v in behv_defaults.items():
@@ -233,8 +240,7 @@ def default_behavior(first_budget_year):
 
 # Create a list of default policy
 def default_policy(first_budget_year, use_puf_not_cps=True):
-    policy_defaults = taxcalc.Policy.default_data(metadata=True,
-                                                  start_year=first_budget_year)
+    policy_defaults = param_index(first_budget_year).policy
 
     default_taxcalc_params = {}
     for k, v in policy_defaults.items():
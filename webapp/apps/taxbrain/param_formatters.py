@@ -1,18 +1,29 @@
 from collections import defaultdict, namedtuple
+import copy
+import os
 import six
 import json
-import ast
 import re
 
 from django.forms import NullBooleanSelect
+from requests.exceptions import RequestException
 
 import taxcalc
 
-from .helpers import is_wildcard, is_reverse
+from ..constants import TAXCALC_VERSION
+from ..core.caches import BoundedCache
+from ..core.compute import Compute, WORKER_HOSTS
+from .helpers import (is_wildcard, is_reverse, parse_token,
+                      json_int_key_encode)
 
 
 MetaParam = namedtuple("MetaParam", ["param_name", "param_meta"])
 CPI_WIDGET = NullBooleanSelect()
+VALIDATION_CACHE_SIZE = int(os.environ.get('VALIDATION_CACHE_SIZE', 256))
+# Validate reforms on the distributed API instead of in the web process
+# whenever there are workers to do it
+VALIDATE_ON_WORKERS = bool(os.environ.get('VALIDATE_ON_WORKERS',
+                                          '1' if WORKER_HOSTS else ''))
 
 
 def parse_value(value, meta_param):
@@ -38,20 +49,12 @@ def parse_value(value, meta_param):
     else:
         integer_value = meta_param.param_meta["integer_value"]
 
-    # Try to parse case-insensitive True/False strings
-    if value.lower() == "true":
-        prepped = "True"
-    elif value.lower() == "false":
-        prepped = "False"
-    else:
-        prepped = value
-
     # Try to parse string and except ValueError if
-    # value is not an integer, float, or boolean string
+    # value is not an integer, float, or case-insensitive boolean string
     try:
-        parsed = ast.literal_eval(prepped)
-    except (SyntaxError, ValueError):
-        return prepped
+        parsed = parse_token(value)
+    except ValueError:
+        return value
     # Use information given to us by upstream specs to convert this value
     # into desired type or let upstream package throw error
     if boolean_value:
@@ -104,7 +107,7 @@ def parse_fields(param_dict, default_params):
         values = []
         if meta_param.param_name.endswith("cpi"):
             assert len(v.split(',')) == 1
-            prepped = ast.literal_eval(v)
+            prepped = parse_token(v)
             # raw data is stored as choices 1, 2, 3 with the following
             # mapping:
             #     '1': unknown (unknown=unspecified ==> use upstream default)
@@ -135,6 +138,14 @@ class ParameterLookUpException(Exception):
     pass
 
 
+class ValidationPending(Exception):
+    '''Raised while the workers are still validating a reform'''
+
+    def __init__(self, job_id):
+        super(ValidationPending, self).__init__(job_id)
+        self.job_id = job_id
+
+
 def get_default_policy_param(param, default_params):
     """
     Map TaxBrain field name to Tax-Calculator parameter name
@@ -142,6 +153,11 @@ def get_default_policy_param(param, default_params):
 
     returns: named tuple with taxcalc param name and metadata
     """
+    # parameter indexes know the names of all of the fields
+    names = getattr(default_params, 'names', None)
+    if names is not None and param in names:
+        param_name, meta_name = names[param]
+        return MetaParam(param_name, default_params[meta_name])
     if '_' + param in default_params:  # ex. EITC_indiv --> _EITC_indiv
         return MetaParam('_' + param, default_params['_' + param])
     param_pieces = param.split('_')
@@ -271,22 +287,66 @@ def parse_errors_warnings(errors_warnings):
     return parsed
 
 
-def read_json_reform(reform, assumptions, use_puf_not_cps=True):
+def canonical_json(text):
     """
-    Read reform and parse errors
+    Reform and assumption texts that differ only in comments, whitespace or
+    key order describe the same inputs and are validated once
 
-    returns reform and assumption dictionaries that are compatible with
-            taxcalc.Policy.implement_reform
-            parsed warning and error messsages to be displayed on input page
-            if necessary
+    returns: sorted, compact JSON text for `text` or `text` itself if it
+             cannot be parsed, in which case Tax-Calculator reports the error
+    """
+    if text is None:
+        return None
+    try:
+        parsed = json.loads(re.sub('//.*', ' ', text))
+    except ValueError:
+        return text
+    return json.dumps(parsed, sort_keys=True, separators=(',', ':'))
+
+
+def validate_on_workers(reform, assumptions, use_puf_not_cps):
+    """
+    Look up or start the validation of a reform on the workers without
+    waiting for it
+
+    returns: parameter dictionary and Tax-Calculator's errors and warnings
+             as computed by the workers, or None if the workers cannot be
+             reached
+
+    raises: ValidationPending with the id of the validation job if it has
+            not finished yet, ValueError with the workers' message if the
+            reform could not be read
     """
-    policy_dict = taxcalc.Calculator.read_json_param_objects(
-        reform,
-        assumptions,
-    )
-    # get errors and warnings on parameters that do not cause ValueErrors
-    tc_errors_warnings = taxcalc.tbi.reform_warnings_errors(policy_dict,
-                                                            use_puf_not_cps)
+    try:
+        response_d = Compute().start_validation(reform, assumptions,
+                                                use_puf_not_cps)
+    except (IOError, RequestException) as e:
+        print('could not validate on the workers', e)
+        return None
+    if response_d.get('error') is not None:
+        raise ValueError(response_d['error'])
+    if response_d.get('result') is None:
+        raise ValidationPending(response_d['job_id'])
+    result = response_d['result']
+    return (json_int_key_encode(result['policy_dict']),
+            result['errors_warnings'])
+
+
+def validate_json_reform(reform, assumptions, use_puf_not_cps,
+                         taxcalc_version):
+    validated = None
+    if VALIDATE_ON_WORKERS:
+        validated = validate_on_workers(reform, assumptions, use_puf_not_cps)
+    if validated is not None:
+        policy_dict, tc_errors_warnings = validated
+    else:
+        policy_dict = taxcalc.Calculator.read_json_param_objects(
+            reform,
+            assumptions,
+        )
+        # get errors and warnings on parameters that do not cause ValueErrors
+        tc_errors_warnings = taxcalc.tbi.reform_warnings_errors(
+            policy_dict, use_puf_not_cps)
     # errors_warnings contains warnings and errors separated by each
     # project/project module
     errors_warnings = {}
@@ -302,6 +362,28 @@ def read_json_reform(reform, assumptions, use_puf_not_cps=True):
     return reform_dict, assumptions_dict, errors_warnings
 
 
+# Validation results by (reform, assumptions, use_puf_not_cps, Tax-Calculator
+# version) so that resubmitting a reform after reviewing its warnings or
+# uploading the same file again does not validate it again
+VALIDATED_REFORMS = BoundedCache(validate_json_reform, VALIDATION_CACHE_SIZE)
+
+
+def read_json_reform(reform, assumptions, use_puf_not_cps=True):
+    """
+    Read reform and parse errors
+
+    returns reform and assumption dictionaries that are compatible with
+            taxcalc.Policy.implement_reform
+            parsed warning and error messsages to be displayed on input page
+            if necessary
+    """
+    key = (canonical_json(reform), canonical_json(assumptions),
+           bool(use_puf_not_cps), TAXCALC_VERSION)
+    # callers add messages to the errors and warnings and pass the
+    # dictionaries on, so each gets its own copy of the cached result
+    return copy.deepcopy(VALIDATED_REFORMS.get(key))
+
+
 def get_reform_from_file(request_files, some_reform_inputs=None,
                          some_assumption_inputs=None, use_puf_not_cps=True):
     """
@@ -0,0 +1,156 @@
+"""
+Index of the Tax-Calculator parameter metadata that TaxBrain works with.
+
+`taxcalc.Policy.default_data` and `taxcalc.Behavior.default_data` read and
+extrapolate every parameter each time they are called. The index holds their
+merged output for one start year along with the TaxBrain field name to
+Tax-Calculator parameter name map, and is saved to PARAM_INDEX_DIR so that
+later processes only have to load it. Indexes are built by the
+`build_param_index` management command or the first time they are needed.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import msgpack
+import taxcalc
+
+from ..constants import TAXCALC_VERSION
+
+
+PARAM_INDEX_DIR = os.environ.get(
+    'PARAM_INDEX_DIR',
+    os.path.join(tempfile.gettempdir(), 'policybrain-param-index'))
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def field_names(metadata):
+    """
+    returns: TaxBrain field name -> (Tax-Calculator parameter name, name of
+             the parameter whose metadata applies) for every field that
+             TaxBrain shows for `metadata`. For example, STD_0 maps to
+             (_STD_single, _STD) and SS_Earnings_c_cpi maps to
+             (_SS_Earnings_c_cpi, _SS_Earnings_c).
+    """
+    names = {}
+    for param, meta in metadata.items():
+        if not param.startswith('_'):
+            continue
+        names[param[1:]] = (param, param)
+        names[param[1:] + '_cpi'] = (param + '_cpi', param)
+        col_labels = meta.get('col_label')
+        if isinstance(col_labels, list):
+            for ix, col_label in enumerate(col_labels):
+                names['{0}_{1}'.format(param[1:], ix)] = (
+                    param + '_' + col_label, param)
+    # parameters whose name ends like a column or cpi flag keep their meaning
+    for param in metadata:
+        if param.startswith('_'):
+            names[param[1:]] = (param, param)
+    return names
+
+
+class ParameterIndex(Mapping):
+    """
+    Read-only mapping from Tax-Calculator parameter names to their metadata
+    for one start year. The metadata is shared by every user of the index
+    and must not be modified.
+    """
+
+    def __init__(self, start_year, policy, behavior):
+        self.start_year = start_year
+        self.policy = policy
+        self.behavior = behavior
+        self._metadata = OrderedDict(policy)
+        self._metadata.update(behavior)
+        self.names = field_names(self._metadata)
+
+    def __getitem__(self, param):
+        return self._metadata[param]
+
+    def __iter__(self):
+        return iter(self._metadata)
+
+    def __len__(self):
+        return len(self._metadata)
+
+    @classmethod
+    def build(cls, start_year):
+        policy = taxcalc.Policy.default_data(metadata=True,
+                                             start_year=start_year)
+        behavior = taxcalc.Behavior.default_data(metadata=True,
+                                                 start_year=start_year)
+        return cls(start_year, policy, behavior)
+
+    def dumps(self):
+        return msgpack.dumps({'policy': self.policy,
+                              'behavior': self.behavior},
+                             use_bin_type=True, default=_to_builtin)
+
+    @classmethod
+    def loads(cls, start_year, packed):
+        data = msgpack.loads(packed, raw=False, use_list=True,
+                             object_pairs_hook=OrderedDict)
+        return cls(start_year, data['policy'], data['behavior'])
+
+
+def _to_builtin(obj):
+    # numpy scalars and arrays
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('cannot serialize {!r}'.format(obj))
+
+
+def index_path(start_year, version=TAXCALC_VERSION,
+               directory=PARAM_INDEX_DIR):
+    return os.path.join(directory, 'taxcalc-{0}-{1}.msgpack'.format(
+        version, start_year))
+
+
+def save_index(index, path):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # write to a temporary file first so that other processes never load a
+    # partly written index
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(index.dumps())
+    os.replace(tmp_path, path)
+
+
+def load_index(start_year, directory=PARAM_INDEX_DIR):
+    """
+    Load the index for `start_year` from `directory`, building and saving it
+    if it is not there
+    """
+    path = index_path(start_year, directory=directory)
+    try:
+        with open(path, 'rb') as f:
+            return ParameterIndex.loads(start_year, f.read())
+    except (IOError, ValueError, KeyError) as e:
+        print('building parameter index', path, e)
+    index = ParameterIndex.build(start_year)
+    try:
+        save_index(index, path)
+    except (IOError, OSError) as e:
+        print('could not save parameter index', path, e)
+    return index
+
+
+def param_index(start_year):
+    """
+    returns: `ParameterIndex` for `start_year`, loaded once per process
+    """
+    start_year = int(start_year)
+    index = _indexes.get(start_year)
+    if index is None:
+        with _lock:
+            index = _indexes.get(start_year)
+            if index is None:
+                index = load_index(start_year)
+                _indexes[start_year] = index
+    return index
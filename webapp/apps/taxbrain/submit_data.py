@@ -2,19 +2,24 @@ from collections import namedtuple
 import datetime
 import json
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
 from ipware.ip import get_real_ip
 from django.http import HttpResponse
 from django.contrib.auth.models import User
 
 from ..taxbrain.models import TaxBrainRun, TaxSaveInputs
-from ..core.compute import NUM_BUDGET_YEARS, NUM_BUDGET_YEARS_QUICK
+from ..core.compute import (NUM_BUDGET_YEARS, NUM_BUDGET_YEARS_QUICK,
+                            DROPQ_URL, DROPQ_SMALL_URL)
 from .forms import TaxBrainForm
 from .helpers import make_bool, json_int_key_encode
-from .param_formatters import get_reform_from_file, append_errors_warnings
+from .param_formatters import (get_reform_from_file, append_errors_warnings,
+                               ValidationPending)
 from ..constants import (START_YEAR, OUT_OF_RANGE_ERROR_MSG,
                          WEBAPP_VERSION, TAXCALC_VERSION)
 
+# Time per queued job used for ETAs until the workers have measured how long
+# their tasks take
 JOB_PROC_TIME_IN_SECONDS = 35
 
 PostMeta = namedtuple(
@@ -34,6 +39,7 @@ PostMeta = namedtuple(
      'assumption_inputs_file',
      'submitted_id',
      'max_q_length',
+     'eta_seconds',
      'user',
      'url',
      'years_n']
@@ -41,6 +47,35 @@ PostMeta = namedtuple(
 
 BadPost = namedtuple('BadPost', ['http_response_404', 'has_errors'])
 
+# The page that waits for the workers to validate a reform posts the uploaded
+# files back as text in fields named after the file field plus this suffix
+POSTED_FILE_SUFFIX = '_text'
+
+
+def restore_posted_files(request):
+    """
+    Turn the file texts posted back by the validation page into uploaded
+    files again
+    """
+    for name in ('docfile', 'assumpfile'):
+        text = request.POST.get(name + POSTED_FILE_SUFFIX)
+        if text is not None and name not in request.FILES:
+            request.FILES[name] = SimpleUploadedFile(name + '.json',
+                                                     text.encode('utf-8'))
+
+
+def posted_files(request):
+    """
+    returns: list of (field name, text) pairs of the uploaded files, to be
+             posted back by the validation page
+    """
+    files = []
+    for name, upload in request.FILES.items():
+        upload.seek(0)
+        files.append((name + POSTED_FILE_SUFFIX,
+                      upload.read().decode('utf-8')))
+    return files
+
 
 def process_reform(request, dropq_compute, user=None, **kwargs):
     """
@@ -106,8 +141,10 @@ def save_model(post_meta):
         unique_url.webapp_vers = WEBAPP_VERSION
 
     cur_dt = timezone.now()
-    future_offset_seconds = ((2 + post_meta.max_q_length) *
-                             JOB_PROC_TIME_IN_SECONDS)
+    future_offset_seconds = post_meta.eta_seconds
+    if future_offset_seconds is None:
+        future_offset_seconds = ((2 + post_meta.max_q_length) *
+                                 JOB_PROC_TIME_IN_SECONDS)
     future_offset = datetime.timedelta(seconds=future_offset_seconds)
     expected_completion = cur_dt + future_offset
     unique_url.exp_comp_datetime = expected_completion
@@ -154,6 +191,7 @@ def submit_reform(request, dropq_compute, user=None, inputs_id=None):
     model = None
     submitted_id = None
     max_q_length = None
+    eta_seconds = None
     # Assume we do the full calculation unless we find out otherwise
     do_full_calc = False if fields.get('quick_calc') else True
     if do_full_calc and 'full_calc' in fields:
@@ -225,9 +263,14 @@ def submit_reform(request, dropq_compute, user=None, inputs_id=None):
                 model = personal_inputs.save(commit=False)
                 model.set_fields()
                 model.save()
-                (reform_parameters, assumption_parameters, reform_inputs_file,
-                    assumption_inputs_file,
-                    errors_warnings) = model.get_model_specs()
+                try:
+                    (reform_parameters, assumption_parameters,
+                        reform_inputs_file, assumption_inputs_file,
+                        errors_warnings) = model.get_model_specs()
+                except ValidationPending:
+                    # the inputs are saved again when they are posted back
+                    model.delete()
+                    raise
 
         if model:
             model.upstream_parameters.update({
@@ -304,11 +347,16 @@ def submit_reform(request, dropq_compute, user=None, inputs_id=None):
                 'use_puf_not_cps': use_puf_not_cps}
         data_list = [dict(year_n=i, **data) for i in years_n]
         if do_full_calc:
+            endpoint = DROPQ_URL
             submitted_id, max_q_length = (
                 dropq_compute.submit_calculation(data_list))
         else:
+            endpoint = DROPQ_SMALL_URL
             submitted_id, max_q_length = (
                 dropq_compute.submit_quick_calculation(data_list))
+        eta_seconds = dropq_compute.eta_seconds(
+            submitted_id, endpoint, data_list, max_q_length,
+            JOB_PROC_TIME_IN_SECONDS)
 
     return PostMeta(
         request=request,
@@ -327,6 +375,7 @@ def submit_reform(request, dropq_compute, user=None, inputs_id=None):
         assumption_inputs_file=assumption_inputs_file,
         submitted_id=submitted_id,
         max_q_length=max_q_length,
+        eta_seconds=eta_seconds,
         user=user,
         url=None,
         years_n=years_n
@@ -1,7 +1,17 @@
 from django.test import TestCase
 from django.test import Client
+import json
+import time
+import msgpack
+import pytest
+import requests_mock
 
 from ..mock_compute import MockCompute
+from ...core.compute import (Compute, WORKER_HN, DROPQ_URL, BTAX_URL,
+                             estimate_seconds)
+from ...core.hosts import HostPool
+from ...core.transport import (backoff, CircuitBreaker, CircuitOpenError,
+                               Transport)
 
 
 class MockComputeTests(MockCompute):
@@ -34,3 +44,252 @@ class ComputeTests(TestCase):
         self.dropq_compute.submit(
             data, 'http://{hn}/dropq_start_job'
         )
+
+
+def test_backoff_is_bounded():
+    for attempt in range(10):
+        limit = min(2.0, 0.1 * 2 ** attempt)
+        assert 0 <= backoff(attempt, base=0.1, cap=2.0) <= limit
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_in_seconds=60)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_transport_opens_circuit_on_server_errors():
+    transport = Transport()
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://down/dropq_query_result',
+                          status_code=502)
+        for _ in range(transport.breaker('down').threshold):
+            transport.get('http://down/dropq_query_result')
+        with pytest.raises(CircuitOpenError):
+            transport.get('http://down/dropq_query_result')
+    assert not transport.is_available('down')
+    stats = transport.stats()['/dropq_query_result']
+    assert stats['count'] == stats['errors'] == 5
+
+
+def test_submit_fails_fast_when_worker_is_down():
+    compute = MockComputeTests()
+    compute.transport = Transport()
+    breaker = compute.transport.breaker(str(WORKER_HN))
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    with pytest.raises(IOError):
+        compute.submit({}, 'http://{hn}/dropq_start_job')
+
+
+def test_host_pool_prefers_short_queues():
+    pool = HostPool(['a:5050', 'b:5050'])
+    transport = Transport()
+    pool.report('a:5050', 10)
+    pool.report('b:5050', 2)
+    pool.report('b:5050', 20, lane='/dropq_small_start_job')
+    assert pool.choose(transport) == 'b:5050'
+    assert pool.choose(transport, lane='/dropq_small_start_job') == 'a:5050'
+    assert pool.choose(transport, exclude={'b:5050'}) == 'a:5050'
+    for _ in range(transport.breaker('b:5050').threshold):
+        transport.breaker('b:5050').record_failure()
+    assert pool.choose(transport) == 'a:5050'
+
+
+def test_host_pool_forgets_old_queue_lengths(monkeypatch):
+    pool = HostPool(['a:5050', 'b:5050'], report_ttl=60)
+    transport = Transport()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    pool.report('a:5050', 10)
+    pool.report('b:5050', 2)
+    assert pool.choose(transport) == 'b:5050'
+    # a has not been told about its queue since; it counts as idle
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    pool.report('b:5050', 2)
+    assert pool.choose(transport) == 'a:5050'
+
+
+def test_submit_fails_over_and_remembers_host():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['down:5050', 'up:5050'])
+    # the host that is down looks idle, so it is tried first
+    compute.hosts.report('up:5050', 1, lane='http://{hn}/dropq_start_job')
+    resp = json.dumps({'job_id': 'job-id', 'qlength': 3})
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('POST', 'http://down:5050/dropq_start_job',
+                          status_code=502)
+        mock.register_uri('POST', 'http://up:5050/dropq_start_job',
+                          text=resp)
+        mock.register_uri('GET', 'http://up:5050/dropq_query_result',
+                          text='NO')
+        assert compute.submit({}, 'http://{hn}/dropq_start_job') == (
+            'job-id', 3)
+        assert compute.hosts.owner('job-id') == 'up:5050'
+        assert compute.results_ready('job-id') == 'NO'
+
+
+def test_host_for_asks_hosts_about_unknown_jobs():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['a:5050', 'b:5050'])
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://a:5050/dropq_owns_job', text='NO')
+        mock.register_uri('GET', 'http://b:5050/dropq_owns_job', text='YES')
+        assert compute.host_for('job-id') == 'b:5050'
+    assert compute.hosts.owner('job-id') == 'b:5050'
+
+
+RUNTIMES = {
+    'tasks': {
+        'api.celery_tasks.dropq_task_async:puf': {'mean_seconds': 60.0,
+                                                  'samples': 10},
+        'api.celery_tasks.taxbrain_postprocess': {'mean_seconds': 5.0,
+                                                  'samples': 10},
+    },
+    'queues': {'full': {'length': 10, 'running': 2, 'capacity': 4}},
+}
+
+
+def test_estimate_seconds_from_measured_runtimes():
+    data_list = [{'year_n': i, 'use_puf_not_cps': True} for i in range(10)]
+    # 12 tasks on 4 worker processes take 3 rounds
+    assert estimate_seconds(RUNTIMES, DROPQ_URL, data_list) == 3 * 60 + 5
+    # CPS runs and B-Tax runs have not been measured
+    data_list = [{'year_n': i, 'use_puf_not_cps': False} for i in range(10)]
+    assert estimate_seconds(RUNTIMES, DROPQ_URL, data_list) is None
+    assert estimate_seconds(RUNTIMES, BTAX_URL, [{}]) is None
+    assert estimate_seconds(None, DROPQ_URL, data_list) is None
+
+
+def test_eta_seconds_falls_back_to_fixed_time():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['runtimes:5050'])
+    data_list = [{'year_n': i, 'use_puf_not_cps': True} for i in range(10)]
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://runtimes:5050/task_runtimes',
+                          text=json.dumps(RUNTIMES))
+        assert compute.eta_seconds('job-id', DROPQ_URL, data_list, 3,
+                                   35) == 185
+        data_list = [dict(d, use_puf_not_cps=False) for d in data_list]
+        assert compute.eta_seconds('job-id', DROPQ_URL, data_list, 3,
+                                   35) == 5 * 35
+
+
+def test_start_validation_does_not_wait_for_job():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['validate:5050'])
+    result = {'policy_dict': {'policy': {'2018': {'_II_em': [8000]}}},
+              'errors_warnings': {'policy': {'warnings': '', 'errors': ''}}}
+    reform = '{"policy": {"_II_em": {"2018": [8000]}}}'
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('POST', 'http://validate:5050/validate_reform',
+                          text=json.dumps({'job_id': None, 'qlength': 0,
+                                           'result': result}))
+        assert compute.start_validation(reform, None,
+                                        True)['result'] == result
+        mock.register_uri('POST', 'http://validate:5050/validate_reform',
+                          text=json.dumps({'job_id': 'job-id',
+                                           'qlength': 1}))
+        assert compute.start_validation(reform, None, True) == {
+            'job_id': 'job-id', 'qlength': 1}
+        assert compute.hosts.owner('job-id') == 'validate:5050'
+        assert mock.call_count == 2
+
+
+def test_bulk_results_ask_each_host_once():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['a:5050', 'b:5050'])
+    compute.hosts.assign('job-a', 'a:5050')
+    compute.hosts.assign('job-b', 'b:5050')
+    compute.hosts.assign('job-c', 'b:5050')
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://a:5050/dropq_query_results',
+                          text=json.dumps({'job-a': 'YES'}))
+        mock.register_uri('GET', 'http://b:5050/dropq_query_results',
+                          text=json.dumps({'job-b': 'FAIL', 'job-c': 'NO'}))
+        assert compute.results_ready_many(['job-a', 'job-b', 'job-c']) == {
+            'job-a': 'YES', 'job-b': 'FAIL', 'job-c': 'NO'}
+        assert mock.call_count == 2
+
+        mock.register_uri('GET', 'http://a:5050/dropq_get_results',
+                          content=msgpack.dumps(
+                              {'results': {'job-a': {'outputs': []}},
+                               'failed': {}, 'pending': []},
+                              use_bin_type=True),
+                          headers={'Content-Type': 'application/msgpack'})
+        # hosts without the bulk endpoint are asked about each job
+        mock.register_uri('GET', 'http://b:5050/dropq_get_results',
+                          status_code=404)
+        mock.register_uri('GET', 'http://b:5050/dropq_get_result',
+                          text='Traceback: ValueError')
+        assert compute.get_results_many(['job-a', 'job-b', 'job-c']) == {
+            'results': {'job-a': {'outputs': []}},
+            'failed': {'job-b': 'Traceback: ValueError'},
+            'pending': ['job-c']}
+
+
+def test_bulk_results_ask_every_host_about_unknown_jobs():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['a:5050', 'b:5050'])
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://a:5050/dropq_get_results',
+                          text=json.dumps(
+                              {'results': {'job-a': {'outputs': []}},
+                               'failed': {}, 'pending': ['job-b']}))
+        mock.register_uri('GET', 'http://b:5050/dropq_get_results',
+                          text=json.dumps(
+                              {'results': {}, 'failed': {},
+                               'pending': ['job-a', 'job-b']}))
+        assert compute.get_results_many(['job-a', 'job-b']) == {
+            'results': {'job-a': {'outputs': []}}, 'failed': {},
+            'pending': ['job-b']}
+        # no host was asked whether it owns a job
+        assert mock.call_count == 2
+        assert compute.hosts.owner('job-a') == 'a:5050'
+        assert compute.hosts.owner('job-b') is None
+
+
+def test_forget_results_skips_hosts_without_endpoint():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['a:5050', 'b:5050'])
+    compute.hosts.assign('job-a', 'a:5050')
+    compute.hosts.assign('job-b', 'b:5050')
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('POST', 'http://a:5050/dropq_forget_results',
+                          text=json.dumps({'forgotten': ['job-a']}))
+        mock.register_uri('POST', 'http://b:5050/dropq_forget_results',
+                          status_code=404)
+        assert compute.forget_results(['job-a', 'job-b']) == ['job-a']
+        assert mock.call_count == 2
+
+
+def test_get_results_decodes_msgpack():
+    compute = Compute()
+    compute.transport = Transport()
+    compute.hosts = HostPool(['a:5050'])
+    compute.hosts.assign('job-a', 'a:5050')
+    values = [1.5, 2.0]
+    with requests_mock.Mocker() as mock:
+        mock.register_uri('GET', 'http://a:5050/dropq_get_result',
+                          content=msgpack.dumps({'outputs': [values]},
+                                                use_bin_type=True),
+                          headers={'Content-Type': 'application/msgpack'})
+        assert compute.get_results('job-a') == {'outputs': [[1.5, 2.0]]}
+        assert 'application/msgpack' in mock.last_request.headers['Accept']
+        # hosts that predate msgpack results answer with JSON
+        mock.register_uri('GET', 'http://a:5050/dropq_get_result',
+                          text=json.dumps({'outputs': []}))
+        assert compute.get_results('job-a') == {'outputs': []}
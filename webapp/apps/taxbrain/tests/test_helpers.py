@@ -1,9 +1,17 @@
 import pytest
 import json
+import threading
+import time
 import taxcalc
 from ..helpers import (json_int_key_encode, is_safe, make_bool,
-                       is_reverse, convert_val)
-from ..param_formatters import parse_value, MetaParam
+                       is_reverse, convert_val, tokenize, tokenize_fields)
+from ..param_formatters import (parse_value, MetaParam,
+                                get_default_policy_param, canonical_json,
+                                read_json_reform, VALIDATED_REFORMS)
+from ..param_index import ParameterIndex, load_index, param_index
+from ..forms import TaxBrainForm
+from ...core.caches import BoundedCache
+from ...core import results as packing
 from ..param_displayers import (TaxCalcParam, nested_form_parameters,
                                 default_policy)
 
@@ -114,6 +122,14 @@ def test_parsing_fail(item):
     assert not is_safe(item)
 
 
+def test_tokenize():
+    assert tokenize(' 1, -2.5 ,*,<, TRUE,false') == (
+        [1, -2.5, '*', '<', True, False], [])
+    assert tokenize('1,abc,,1e3') == ([1, 'abc', '', 1000.0], [1, 2])
+    assert tokenize_fields({'a': '1,*', 'b': '', 'c': True}) == {
+        'a': ([1, '*'], [])}
+
+
 @pytest.mark.parametrize(
     'item,exp',
     [('True', True), ('true', True), ('TRUE', True), (True, True),
@@ -162,6 +178,15 @@ def test_taxbrain_TaxCalcParam():
                 assert value == parse_value(str(value), meta_param)
 
 
+def test_taxbrain_TaxCalcParam_is_compact():
+    param = TaxCalcParam('_STD', param_index(2017)['_STD'], 2017)
+    assert not hasattr(param, '__dict__')
+    for field in param.col_fields:
+        assert not hasattr(field, '__dict__')
+        assert field.param is param
+        assert field.default_value == field.values_by_year[2017]
+
+
 def test_convert_val():
     field = '*,*,130000'
     out = [convert_val(x) for x in field.split(',')]
@@ -181,3 +206,115 @@ def test_default_taxcalc_data_cpi_flags_on_II_credit():
     taxcalc_default_params = default_policy(int(2017))
     assert taxcalc_default_params['II_credit'].inflatable
     assert taxcalc_default_params['II_credit_ps'].inflatable
+
+
+def test_param_index_field_names():
+    """
+    The field names known to the parameter index map to the same
+    Tax-Calculator parameters as the names worked out on the fly
+    """
+    index = ParameterIndex.build(2017)
+    metadata = dict(index)
+    for field in index.names:
+        assert (get_default_policy_param(field, index) ==
+                get_default_policy_param(field, metadata))
+
+
+def test_param_index_round_trip(tmpdir):
+    index = load_index(2017, directory=str(tmpdir))
+    assert tmpdir.listdir()
+    loaded = load_index(2017, directory=str(tmpdir))
+    assert list(loaded) == list(index)
+    assert loaded.names == index.names
+
+
+def test_bounded_cache_evicts_least_recently_used():
+    cache = BoundedCache(lambda x: [x], maxsize=2)
+    one = cache.get((1,))
+    cache.get((2,))
+    assert cache.get((1,)) is one
+    cache.get((3,))
+    assert (1,) in cache and (3,) in cache
+    assert (2,) not in cache
+    assert len(cache) == 2
+
+
+def test_bounded_cache_builds_once_per_key():
+    calls = []
+
+    def build(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return x
+
+    cache = BoundedCache(build, maxsize=2)
+    threads = [threading.Thread(target=cache.get, args=((1,),))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+
+
+@pytest.mark.django_db
+def test_taxbrain_form_does_not_change_shared_fields():
+    default = TaxBrainForm(2017, True)
+    edited = TaxBrainForm(2017, True, initial={'AMT_CG_brk2_cpi': 'False'})
+    assert (edited.fields['AMT_CG_brk2_cpi'].widget.attrs['placeholder']
+            is False)
+    assert default.fields['AMT_CG_brk2_cpi'].widget.attrs['placeholder']
+    # changes made to one form's fields do not reach other forms
+    default.fields['II_em'].widget.attrs['placeholder'] = 'changed'
+    default.fields['II_em'].initial = 'changed'
+    other = TaxBrainForm(2017, True)
+    assert other.fields['II_em'] is not default.fields['II_em']
+    assert other.fields['II_em'].widget.attrs['placeholder'] != 'changed'
+    assert other.fields['II_em'].initial != 'changed'
+
+
+def test_canonical_json():
+    text = """
+    // raise the standard deduction
+    {"policy": {"_STD": {"2018": [[15000, 30000, 15000, 20000, 30000]]},
+                "_II_em": {"2018": [8000]}}}
+    """
+    reordered = ('{"policy": {"_II_em": {"2018": [8000]}, '
+                 '"_STD": {"2018": [[15000, 30000, 15000, 20000, 30000]]}}}')
+    assert canonical_json(text) == canonical_json(reordered)
+    assert canonical_json('{"policy": ') == '{"policy": '
+    assert canonical_json(None) is None
+
+
+def test_read_json_reform_validates_once(monkeypatch):
+    calls = []
+    read_json_param_objects = taxcalc.Calculator.read_json_param_objects
+
+    def counted(reform, assumptions):
+        calls.append(reform)
+        return read_json_param_objects(reform, assumptions)
+
+    monkeypatch.setattr(taxcalc.Calculator, 'read_json_param_objects',
+                        counted)
+    VALIDATED_REFORMS.clear()
+    reform = '{"policy": {"_II_em": {"2018": [8000]}}}'
+    first = read_json_reform(reform, None, use_puf_not_cps=True)
+    first[2]['policy']['errors']['II_em'] = {'2018': 'changed by caller'}
+    second = read_json_reform(reform.replace(' ', ''), None,
+                              use_puf_not_cps=True)
+    assert len(calls) == 1
+    assert second[0] == first[0]
+    assert 'II_em' not in second[2]['policy']['errors']
+    read_json_reform(reform, None, use_puf_not_cps=False)
+    assert len(calls) == 2
+
+
+def test_pack_results_round_trip():
+    results = {'outputs': [{'title': 'table', 'year': '2018',
+                            'renderable': '<table></table>' * 100,
+                            'downloadable': [{'filename': 'table.csv',
+                                              'text': ',a,b\n0,1.5,2\n'}]}],
+               'aggr_outputs': None}
+    packed = packing.pack(results)
+    assert len(packed) < len(json.dumps(results))
+    assert packing.unpack(memoryview(packed)) == results
@@ -1,12 +1,23 @@
 from django.test import Client
 from django.test.client import RequestFactory
+from django.core.cache import cache, caches
+import io
 import json
 import pytest
 import os
 import msgpack
+import zipfile
 
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+
+from .. import views, param_formatters
 from ..models import TaxBrainRun, TaxSaveInputs
-from ..mock_compute import NodeDownCompute, MockFailedCompute
+from ...core import results as packing
+from ...core import views as core_views
+from ...core.compute import Compute
+from ..mock_compute import (NodeDownCompute, MockFailedCompute,
+                            MockPartialCompute)
 import taxcalc
 
 from ...test_assets.utils import (check_posted_params, do_micro_sim,
@@ -30,6 +41,21 @@ class TestTaxBrainViews(object):
         # Check that the response is 200 OK.
         assert response.status_code == 200
 
+    def test_taxbrain_get_uses_cached_sections(self, monkeypatch):
+        cache.clear()
+        first = CLIENT.get('/taxbrain/?start_year=2017&data_source=CPS')
+        assert first.status_code == 200
+
+        def fail(*args, **kwargs):
+            raise AssertionError('default form was built again')
+        monkeypatch.setattr(views, 'nested_form_parameters', fail)
+        monkeypatch.setattr(views, 'TaxBrainForm', fail)
+        second = CLIENT.get('/taxbrain/?start_year=2017&data_source=CPS')
+        assert second.status_code == 200
+        assert b'id="get-started"' in second.content
+        assert (first.content.count(b'class="inputs-block"') ==
+                second.content.count(b'class="inputs-block"'))
+
     @pytest.mark.parametrize('data_source', ['PUF', 'CPS'])
     def test_taxbrain_post(self, data_source):
         """
@@ -241,6 +267,157 @@ class TestTaxBrainViews(object):
         # Make sure the failure message is in the response
         assert "Your calculation failed" in response.content.decode('utf-8')
 
+    def test_taxbrain_partial_results(self):
+        # Monkey patch to mock out running of compute jobs
+        get_dropq_compute_from_module(
+            'webapp.apps.taxbrain.views',
+            MockComputeObj=MockPartialCompute,
+            num_times_to_wait=1
+        )
+
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+
+        response = CLIENT.post('/taxbrain/', data)
+        assert response.status_code == 302
+        url = response.url
+        link_idx = url[:-1].rfind('/')
+        response = CLIENT.get(url)
+        assert response.status_code == 200
+        assert 'Results for the years that have finished' in (
+            response.content.decode('utf-8'))
+        model = TaxBrainRun.objects.get(pk=url[link_idx + 1:-1])
+        assert list(model.partial_outputs.keys()) == ['0']
+        assert not model.outputs
+        # the waiting page asks for the tables of the new years only
+        response = CLIENT.get(url, {'years': '0'})
+        assert response.status_code == 200
+        content = response.content.decode('utf-8')
+        assert content.count('class="partial-output"') == len(
+            model.partial_outputs['0'])
+        assert 'panel-heading' not in content
+
+        # the whole job is done on the next request
+        response = CLIENT.get(url)
+        assert response.status_code == 200
+        model = TaxBrainRun.objects.get(pk=url[link_idx + 1:-1])
+        assert model.outputs
+        assert model.partial_outputs is None
+
+    def test_taxbrain_poll_results(self):
+        # Monkey patch to mock out running of compute jobs
+        get_dropq_compute_from_module(
+            'webapp.apps.taxbrain.views',
+            num_times_to_wait=1
+        )
+
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+
+        response = CLIENT.post('/taxbrain/', data)
+        assert response.status_code == 302
+        url = response.url
+        response = CLIENT.post(url)
+        assert response.status_code in (200, 202)
+        assert set(response.json()) == {'eta', 'years_ready'}
+        # the poll after the job is done returns the results page
+        response = CLIENT.post(url)
+        assert response.status_code == 200
+        assert 'Static Results' in response.content.decode('utf-8')
+
+    def test_taxbrain_results_are_cached(self):
+        caches['results'].clear()
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+        result = do_micro_sim(CLIENT, data)
+        url = result['response'].url
+        response = CLIENT.get(url)
+        assert response.status_code == 200
+        assert 'private' in response['Cache-Control']
+        assert 'public' not in response['Cache-Control']
+        # the tables are kept in the shared results cache
+        assert len(caches['results']._cache) == 1
+        etag = response['ETag']
+        assert CLIENT.get(url).content == response.content
+
+        response = CLIENT.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        response = CLIENT.get(url, HTTP_IF_NONE_MATCH='"other"')
+        assert response.status_code == 200
+
+    def test_taxbrain_run_results_are_deferred(self):
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+        result = do_micro_sim(CLIENT, data)
+        run = TaxBrainRun.objects.get(pk=result['pk'])
+        assert {'outputs', 'aggr_outputs'} <= run.get_deferred_fields()
+        # deferred results are loaded when they are used
+        assert run.outputs
+        run = TaxBrainRun.objects.with_results().get(pk=result['pk'])
+        assert not run.get_deferred_fields()
+        run = TaxBrainRun.objects.with_has_results().get(pk=result['pk'])
+        assert run.has_results
+
+    def test_taxbrain_results_are_compressed(self, monkeypatch):
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+        stored = do_micro_sim(CLIENT, data)
+        run = TaxBrainRun.objects.with_results().get(pk=stored['pk'])
+        outputs, aggr_outputs = run.outputs, run.aggr_outputs
+        assert run.packed_results is None
+
+        call_command('compress_results')
+        assert TaxBrainRun.objects.filter(
+            pk=stored['pk'], outputs__isnull=True, aggr_outputs__isnull=True,
+            packed_results__isnull=False).exists()
+        run = TaxBrainRun.objects.get(pk=stored['pk'])
+        assert run.outputs == outputs
+        assert run.aggr_outputs == aggr_outputs
+        response = CLIENT.get(stored['response'].url)
+        assert response.status_code == 200
+
+        monkeypatch.setattr(packing, 'COMPRESS_RESULTS', True)
+        run = TaxBrainRun.objects.with_results().get(pk=stored['pk'])
+        run.outputs = outputs[:1]
+        run.save()
+        assert run.outputs == outputs[:1]
+        run = TaxBrainRun.objects.get(pk=stored['pk'])
+        assert run.outputs == outputs[:1]
+
+    def test_taxbrain_download_streams_and_stores_archive(self, monkeypatch,
+                                                          tmpdir):
+        monkeypatch.setattr(core_views, 'default_storage',
+                            FileSystemStorage(location=str(tmpdir)))
+        data = get_post_data(START_YEAR)
+        data['II_em'] = ['4333']
+        stored = do_micro_sim(CLIENT, data)
+        run = TaxBrainRun.objects.with_results().get(pk=stored['pk'])
+        filenames = [d['filename'] for output in run.outputs + run.aggr_outputs
+                     for d in output['downloadable']]
+
+        response = CLIENT.get(run.get_absolute_download_url())
+        assert response.status_code == 200
+        assert response.streaming
+        archive = b''.join(response.streaming_content)
+        assert zipfile.ZipFile(io.BytesIO(archive)).namelist() == filenames
+        assert tmpdir.join('archives', 'taxbrain', 'taxbrainrun',
+                           '{}.zip'.format(run.pk)).check()
+
+        response = CLIENT.get(run.get_absolute_download_url())
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == archive
+
+    def test_storing_archive_twice_keeps_one_copy(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(core_views, 'default_storage',
+                            FileSystemStorage(location=str(tmpdir)))
+        name = 'archives/taxbrain/taxbrainrun/1.zip'
+        core_views.store_archive(io.BytesIO(b'first'), name)
+        core_views.store_archive(io.BytesIO(b'second'), name)
+        stored = tmpdir.join('archives', 'taxbrain', 'taxbrainrun')
+        assert [f.basename for f in stored.listdir()] == ['1.zip']
+        assert stored.join('1.zip').read_binary() == b'second'
+
     @pytest.mark.xfail
     def test_taxbrain_has_growth_params(self):
 
@@ -510,6 +687,33 @@ class TestTaxBrainViews(object):
         check_posted_params(result['tb_dropq_compute'], truth_mods,
                             str(START_YEAR), data_source=data_source)
 
+    def test_taxbrain_file_post_waits_for_validation(self, monkeypatch, r1):
+        monkeypatch.setattr(param_formatters, 'VALIDATE_ON_WORKERS', True)
+        param_formatters.VALIDATED_REFORMS.clear()
+        answers = [{'job_id': 'validation-id', 'qlength': 1},
+                   {'job_id': 'validation-id', 'qlength': 0,
+                    'error': 'could not read the reform'}]
+        monkeypatch.setattr(Compute, 'start_validation',
+                            lambda self, *args: answers.pop(0))
+        monkeypatch.setattr(Compute, 'results_ready',
+                            lambda self, job_id: 'FAIL')
+        data = get_file_post_data(START_YEAR, r1)
+        response = CLIENT.post('/taxbrain/file/', data)
+        assert response.status_code == 200
+        assert 'taxbrain/validating.html' in [t.name for t in
+                                              response.templates]
+        assert response.context['job_id'] == 'validation-id'
+        # the page posts the file back as text once the job is done
+        assert response.context['files'] == [('docfile_text', r1)]
+        response = CLIENT.get('/taxbrain/validating/validation-id/')
+        assert json.loads(response.content.decode('utf-8')) == {
+            'status': 'FAIL'}
+        posted = dict(data, docfile_text=r1)
+        del posted['docfile']
+        # errors found by the workers are raised without validating again
+        with pytest.raises(ValueError, match='could not read the reform'):
+            CLIENT.post('/taxbrain/file/', posted)
+
     @pytest.mark.xfail
     def test_taxbrain_view_old_data_model(self, test_coverage_fields):
         # Monkey patch to mock out running of compute jobs
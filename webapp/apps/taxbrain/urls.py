@@ -1,13 +1,15 @@
 from django.conf.urls import url
 
 from .views import (personal_results, edit_personal_results,
-                    resubmit, file_input, TaxBrainRunDetailView,
-                    TaxBrainRunDownloadView)
+                    resubmit, file_input, validation_status,
+                    TaxBrainRunDetailView, TaxBrainRunDownloadView)
 
 
 urlpatterns = [
     url(r'^$', personal_results, name='tax_form'),
     url(r'^file/$', file_input, name='json_file'),
+    url(r'^validating/(?P<job_id>[-\w]+)/$', validation_status,
+        name='validation_status'),
     url(r'^submit/(?P<pk>[-\d\w]+)/', resubmit, name='resubmit'),
     url(r'^edit/(?P<pk>[-\d\w]+)/', edit_personal_results,
         name='edit_personal_results'),
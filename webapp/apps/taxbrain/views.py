@@ -6,12 +6,15 @@ import sys
 
 from urllib.parse import urlparse, parse_qs
 
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.functional import SimpleLazyObject
 
 from .forms import TaxBrainForm
 from .helpers import json_int_key_encode
 from .param_displayers import nested_form_parameters
-from ..core.compute import Compute, NUM_BUDGET_YEARS
+from ..core.compute import (Compute, JobFailError, NUM_BUDGET_YEARS,
+                            DROPQ_URL)
 from ..taxbrain.models import TaxBrainRun
 from ..core.views import CoreRunDetailView, CoreRunDownloadView
 from ..core.models import Tag, TagOption
@@ -24,13 +27,19 @@ from ..constants import (DISTRIBUTION_TOOLTIP, DIFFERENCE_TOOLTIP,
                          WEBAPP_VERSION, TAXCALC_VERSION)
 
 from ..formatters import get_version
-from .param_formatters import append_errors_warnings
-from .submit_data import PostMeta, BadPost, process_reform, save_model, log_ip
+from .param_formatters import append_errors_warnings, ValidationPending
+from .submit_data import (PostMeta, BadPost, process_reform, save_model,
+                          log_ip, restore_posted_files, posted_files,
+                          JOB_PROC_TIME_IN_SECONDS)
 
 # Mock some module for imports because we can't fit them on Heroku slugs
 MOCK_MODULES = ['matplotlib', 'matplotlib.pyplot', 'mpl_toolkits',
                 'mpl_toolkits.mplot3d']
 ENABLE_QUICK_CALC = bool(os.environ.get('ENABLE_QUICK_CALC', ''))
+# How long the rendered default parameter sections of the input page are
+# kept. The cache key includes the upstream and webapp versions.
+INPUT_FORM_CACHE_TIMEOUT = int(
+    os.environ.get('INPUT_FORM_CACHE_TIMEOUT', 60 * 60 * 24))
 sys.modules.update((mod_name, Mock()) for mod_name in MOCK_MODULES)
 
 dropq_compute = Compute()
@@ -115,6 +124,35 @@ class TaxBrainRunDownloadView(CoreRunDownloadView):
     model = TaxBrainRun
 
 
+def render_validating(request, job_id):
+    """
+    Show a page that waits for the workers to validate the submitted reform
+    and then posts the submission again
+    """
+    fields = [(name, value) for name, values in request.POST.lists()
+              for value in values if name != 'csrfmiddlewaretoken']
+    context = {
+        'job_id': job_id,
+        'action': request.get_full_path(),
+        'fields': fields,
+        'files': posted_files(request),
+        'upstream_version': TAXCALC_VERSION,
+        'webapp_version': WEBAPP_VERSION,
+    }
+    return render(request, 'taxbrain/validating.html', context)
+
+
+def validation_status(request, job_id):
+    """
+    returns: JSON with the status of the validation job `job_id`
+    """
+    try:
+        status = dropq_compute.results_ready(job_id)
+    except JobFailError:
+        status = 'FAIL'
+    return JsonResponse({'status': status})
+
+
 def file_input(request):
     """
     Receive request from file input interface and returns parsed data or an
@@ -140,13 +178,17 @@ def file_input(request):
                        request.POST.get('start_year', None))
         assert data_source is not None
 
+        restore_posted_files(request)
         # File is not submitted
         if 'docfile' not in dict(request.FILES) and form_id is None:
             errors = ["Please specify a tax-law change before submitting."]
             inputs = None
         else:
-            obj, post_meta = process_reform(request, dropq_compute,
-                                            inputs_id=form_id)
+            try:
+                obj, post_meta = process_reform(request, dropq_compute,
+                                                inputs_id=form_id)
+            except ValidationPending as pending:
+                return render_validating(request, pending.job_id)
             if isinstance(post_meta, BadPost):
                 return post_meta.http_response_404
             else:
@@ -204,10 +246,16 @@ def personal_results(request):
     start_year = START_YEAR
     has_errors = False
     data_source = DEFAULT_SOURCE
+    # the default form is the same for everyone, so its parameter sections
+    # are rendered once and cached
+    cache_params = False
     if request.method == 'POST':
         print('method=POST get', request.GET)
         print('method=POST post', request.POST)
-        obj, post_meta = process_reform(request, dropq_compute)
+        try:
+            obj, post_meta = process_reform(request, dropq_compute)
+        except ValidationPending as pending:
+            return render_validating(request, pending.job_id)
         # case where validation failed in forms.TaxBrainForm
         # TODO: assert HttpResponse status is 404
         if isinstance(post_meta, BadPost):
@@ -241,12 +289,19 @@ def personal_results(request):
             if data_source != 'PUF':
                 use_puf_not_cps = False
 
-        personal_inputs = TaxBrainForm(first_year=start_year,
-                                       use_puf_not_cps=use_puf_not_cps)
+        # only built if the cached sections have expired
+        personal_inputs = SimpleLazyObject(
+            lambda: TaxBrainForm(first_year=start_year,
+                                 use_puf_not_cps=use_puf_not_cps))
+        cache_params = True
 
+    params = SimpleLazyObject(
+        lambda: nested_form_parameters(int(start_year), use_puf_not_cps))
     init_context = {
         'form': personal_inputs,
-        'params': nested_form_parameters(int(start_year), use_puf_not_cps),
+        'params': params,
+        'cache_params': cache_params,
+        'params_cache_timeout': INPUT_FORM_CACHE_TIMEOUT,
         'upstream_version': TAXCALC_VERSION,
         'webapp_version': WEBAPP_VERSION,
         'start_years': START_YEARS,
@@ -267,7 +322,8 @@ def resubmit(request, pk):
     job after one has submitted parameters for a 'quick calculation'
     """
     # TODO: get this function to work with process_reform
-    url = get_object_or_404(TaxBrainRun, pk=pk)
+    url = get_object_or_404(
+        TaxBrainRun.objects.select_related('inputs'), pk=pk)
 
     model = url.inputs
     start_year = model.start_year
@@ -296,10 +352,13 @@ def resubmit(request, pk):
 
     # start calc job
     years_n = list(range(NUM_BUDGET_YEARS))
-    data_list = [dict(year=i, **data) for i in years_n]
+    data_list = [dict(year_n=i, **data) for i in years_n]
     submitted_id, max_q_length = dropq_compute.submit_calculation(
         data_list
     )
+    eta_seconds = dropq_compute.eta_seconds(
+        submitted_id, DROPQ_URL, data_list, max_q_length,
+        JOB_PROC_TIME_IN_SECONDS)
 
     post_meta = PostMeta(
         url=url,
@@ -315,6 +374,7 @@ def resubmit(request, pk):
         assumption_inputs_file=(model.inputs_file['assumption'] or ""),
         submitted_id=submitted_id,
         max_q_length=max_q_length,
+        eta_seconds=eta_seconds,
         user=None,
         personal_inputs=None,
         stop_submission=False,
@@ -331,7 +391,8 @@ def edit_personal_results(request, pk):
     """
     This view handles the editing of previously entered inputs
     """
-    url = get_object_or_404(TaxBrainRun, pk=pk)
+    url = get_object_or_404(
+        TaxBrainRun.objects.select_related('inputs'), pk=pk)
 
     model = url.inputs
     start_year = model.first_year
@@ -38,6 +38,13 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, 'static'),
 )
 
+# Files generated by the webapp, such as the result archives that are built
+# on the first download of a run and kept under archives/. Archives are
+# rebuilt from the stored results when they are missing, so the directory can
+# be pruned or cleared at any time to reclaim space. Files ending in .part are
+# left by interrupted writes and can be deleted, too.
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True if os.environ.get('DEV_DEBUG') == 'True' else False
 
@@ -134,6 +141,31 @@ else:  # DATABASE_URL is not set--try default
     DATABASES.update(TEST_DATABASE)
 
 
+# Rendered results pages are kept in the "results" cache. Set
+# RESULTS_CACHE_URL to a Redis database, e.g. redis://redis:6379/2, so that
+# the web processes share one copy of each page. Cap the database's size with
+# maxmemory and the allkeys-lru policy so that the least viewed pages are
+# evicted. Without it each process keeps a few pages in its own memory.
+RESULTS_CACHE_URL = os.environ.get('RESULTS_CACHE_URL', None)
+if RESULTS_CACHE_URL:
+    RESULTS_CACHE = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': RESULTS_CACHE_URL,
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+else:
+    RESULTS_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'results',
+        'OPTIONS': {'MAX_ENTRIES': 10},
+    }
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': RESULTS_CACHE,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
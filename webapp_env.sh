@@ -22,5 +22,8 @@ export DEV_DEBUG=True
 export HTML_MINIFY=True
 
 export OGUSA_WORKERS=127.0.0.1:5050
+# comma separated lists of distributed API hosts, e.g. host1:5050,host2:5050
 export DROPQ_WORKERS=127.0.0.1:5050
 export BTAX_WORKERS=127.0.0.1:5050
+# Redis database shared by the web processes for rendered results pages
+# export RESULTS_CACHE_URL=redis://127.0.0.1:6379/2